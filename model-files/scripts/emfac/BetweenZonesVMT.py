@@ -10,15 +10,20 @@ import pandas as pd
 import numpy as np
 
 import os.path
+import sys
 from os import path
 
+# loadednet is in CTRAMP\scripts\metrics
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "metrics"))
+import loadednet
+
 #import argparse
 
 # -------------------------------------------------------------------
 # Input/output file names and locations
 # -------------------------------------------------------------------
 # loaded network assignment file
-loadednet_df = pd.read_csv(os.path.join(os.getcwd(), "hwy", "iter3", "avgload5period_vehclasses.csv"), index_col=False, sep=",")
+loadednet_df = loadednet.read_loaded_network(os.path.join(os.getcwd(), "hwy", "iter3", "avgload5period_vehclasses.csv"))
 
 # Todo: add truck or no truck
 
@@ -12,15 +12,16 @@ USAGE = """
 import os, sys
 import numpy, pandas
 
+# for loadednet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "metrics"))
+import loadednet
+
 if __name__ == '__main__':
     pandas.set_option('display.width', 500)
     iteration       = int(os.environ['ITER'])
     TIMEPERIODS     = ['EA','AM','MD','PM','EV']
     VEHCLASSES      = ['da','s2','s3','sm','hv']
 
-    # read the network with volumes
-    loaded_net_df = pandas.read_table(os.path.join("hwy", "iter%d" % iteration, "avgload5period_vehclasses.csv"), sep=",")
-
     # we only need a subset of columns
     cols_to_keep = ['a','b','distance','ft']
     for timeperiod in TIMEPERIODS:
@@ -28,7 +29,10 @@ if __name__ == '__main__':
         for vehclass in VEHCLASSES:
             cols_to_keep.append("vol%s_%s"  % (timeperiod, vehclass))
             cols_to_keep.append("vol%s_%st" % (timeperiod, vehclass)) # toll
-    loaded_net_df = loaded_net_df[cols_to_keep]
+
+    # read the network with volumes
+    loaded_net_df = loadednet.read_loaded_network(os.path.join("hwy", "iter%d" % iteration, "avgload5period_vehclasses.csv"),
+                                                  columns=cols_to_keep)
 
     # filter out FT=10 since those are toll plazas and not real links
     loaded_net_df = loaded_net_df.loc[loaded_net_df.ft != 10,]
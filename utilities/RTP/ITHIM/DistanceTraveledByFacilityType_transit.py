@@ -5,29 +5,19 @@ USAGE = """
     roadway facility types)
 
   * Reads hwy\iter%ITER%\avgload5period_vehclasses.csv for facility types
-  * Reads trn\trnlink(EA|AM|MD|PM|EV)_(wlk|drv)_(com|hvy|exp|lrf|loc)_(wlk_drv).dbf
+  * Reads trn\trnlink(EA|AM|MD|PM|EV)_(wlk|drv)_(com|hvy|exp|lrf|loc)_(wlk_drv).dbf (see transitlinks.py)
   * Summarizes vehicle miles traveled, passenger miles traveled, and passenger hours traveled
     by bus+ITHIM facility type and rail
   * Writes summary to metrics\ITHIM\DistanceTraveledByFacilityType_transit.csv
 
 """
-import os, sys
+import multiprocessing, os, sys
 import numpy, pandas
 
-def read_dbf(dbf_fullpath):
-    """
-    Returns the pandas DataFrame
-    """
-    import pysal
-    dbfin = pysal.open(dbf_fullpath)
-    vars = dbfin.header
-    data = dict([(var, dbfin.by_col(var)) for var in vars])
-
-    table_df = pandas.DataFrame(data)
-
-    print "  Read %d lines from %s" % (len(table_df), dbf_fullpath)
-
-    return table_df
+# for loadednet, transitlinks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "metrics"))
+import loadednet
+import transitlinks
 
 if __name__ == '__main__':
     pandas.set_option('display.width', 500)
@@ -38,9 +28,7 @@ if __name__ == '__main__':
 
     # read the road network for facility types
     roadway_file  = os.path.join("hwy", "iter%d" % iteration, "avgload5period_vehclasses.csv")
-    loaded_net_df = pandas.read_table(roadway_file, sep=",")
-    loaded_net_df = loaded_net_df[['a','b','distance','ft']] # we only need a subset of columns
-    print "  Read %s lines from %s" % (len(loaded_net_df), roadway_file)
+    loaded_net_df = loadednet.read_loaded_network(roadway_file, columns=['a','b','distance','ft']) # we only need a subset of columns
 
     # filter out FT=10 since those are toll plazas and not real links
     loaded_net_df = loaded_net_df.loc[loaded_net_df.ft != 10,]
@@ -65,31 +53,29 @@ if __name__ == '__main__':
     loaded_net_df.drop("ft", axis=1, inplace=True)
     # print loaded_net_df.head()
 
-    # Read the transit assignment files
-    first = True
-    trnlines_df = None
-    for timeperiod in TIMEPERIODS:
-        for access in ['wlk','drv']:
-            for submode in SUBMODES:
-                for egress in ['wlk','drv']:
-
-                    if access == 'drv' and egress == 'drv': continue
-                    filename = os.path.join("trn","trnlink%s_%s_%s_%s.dbf" % (timeperiod, access, submode, egress))
-                    trnline_df = read_dbf(filename)
-                    trnline_df['access'            ] = access
-                    trnline_df['egress'            ] = egress
-                    trnline_df['submode'           ] = submode
-                    trnline_df['TimePeriod'        ] = timeperiod
-                    trnline_df['TimePeriodDuration'] = TIMEPERIOD_DURATIONS[timeperiod]
-                    if first:
-                        trnlines_df = trnline_df
-                        first = False
-                    else:
-                        trnlines_df = pandas.concat([trnlines_df, trnline_df], axis=0)
-
-    # we only need some columns
-    trnlines_df = trnlines_df[['A','B','AB_VOL','DIST','FREQ','MODE','NAME','SEQ','TIME',
-                               'access','egress','submode','TimePeriod','TimePeriodDuration']]
+    # Read the transit assignment files -- the timeperiods for each access/submode/egress are read in parallel,
+    # by one pool shared across them
+    pool        = multiprocessing.Pool(len(TIMEPERIODS))
+    trnline_dfs = []
+    for access in ['wlk','drv']:
+        for submode in SUBMODES:
+            for egress in ['wlk','drv']:
+
+                if access == 'drv' and egress == 'drv': continue
+                # we only need some columns
+                trnline_df = transitlinks.read_transit_links(os.path.join("trn","trnlink{}_%s_%s_%s.dbf" % (access, submode, egress)),
+                                                             timeperiods=TIMEPERIODS, period_col='TimePeriod',
+                                                             columns=['A','B','AB_VOL','DIST','FREQ','MODE','NAME','SEQ','TIME'],
+                                                             pool=pool)
+                trnline_df['access'            ] = access
+                trnline_df['egress'            ] = egress
+                trnline_df['submode'           ] = submode
+                trnline_dfs.append(trnline_df)
+    pool.close()
+    pool.join()
+    trnlines_df = pandas.concat(trnline_dfs, axis=0, ignore_index=True)
+    trnlines_df['TimePeriod'        ] = trnlines_df['TimePeriod'].astype(str)  # plain strings for the groupby below
+    trnlines_df['TimePeriodDuration'] = trnlines_df['TimePeriod'].map(TIMEPERIOD_DURATIONS)
 
     # Recode Line-haul modes to ITHIM modes
     # Line-haul modes http://analytics.mtc.ca.gov/foswiki/Main/TransitNetworkCoding
@@ -1,20 +1,28 @@
 import argparse
 import collections
+import copy
+import functools
+import hashlib
+import multiprocessing
 import operator
 import os
+import pickle
 import re
 import string
 import sys
 import csv
+import traceback
 from collections import OrderedDict, defaultdict
 from shutil import copyfile
 
 import pandas as pd     # yay for DataFrames and Series!
 import numpy
 import math
-import xlwings as xl
 import xlsxwriter       # for writing workbooks -- formatting is better than openpyxl
-from xlsxwriter.utility import xl_range, xl_rowcol_to_cell
+from xlsxwriter.utility import xl_cell_to_rowcol, xl_range, xl_rowcol_to_cell
+
+import loadednet        # for reading avgload5period_vehclasses.csv
+
 pd.set_option('display.precision',10)
 pd.set_option('display.width', 500)
 
@@ -29,13 +37,279 @@ USAGE = """
   * project_metrics_dir\BC_ProjectID[_BaseProjectID].xlsx with run results summary
   * all_projects_metrics_dir\BC_ProjectID[_BaseProjectID].csv with a version for rolling up
   * logsum diff maps in \OUTPUT\logsums\logsum_diff.twb
+  * project_metrics_dir\OUTPUT\metrics\daily_metrics.pkl with the daily metrics, which are re-used
+    as long as the script, config and input files are unchanged
 
   Run the script from the "L:\\RTP2021_PPA\\Projects" folder, where the baseline runs are saved.
   example: python \\\\mainmodel\\MainModelShare\\travel-model-one-master\\utilities\\PBA40\\metrics\\RunResults.py 1_Crossings1\\2050_TM151_PPA_RT_02_1_Crossings1_03 all_projects_bc_workbooks
 
+  Multiple project dirs (or --all_projects for every project in the configs_projects sheet) may be given
+  to run them as a batch with --processes processes.  Each distinct baseline is read once and shared, and
+  all_projects_metrics_dir\\batch_bc_metrics.csv rolls up the BC csvs of the batch.
+
+  With --csv_only, the BC workbooks are not written; only the csvs for rolling up.
+
+  With --sensitivity, the B/C of the projects is evaluated over a grid of --discount_rates and --valuation_sets
+  from the persisted daily metrics, written to all_projects_metrics_dir\\sensitivity_bc_metrics.csv.
+  example: python RunResults.py --sensitivity --all_projects --discount_rates 0.02,0.03,0.04 all_projects_metrics
+
 
 """
 
+class BufferedWorksheet:
+    """
+    Stands in for an xlsxwriter worksheet.  Cells are collected as they are written (in any order)
+    and streamed to the underlying worksheet in row order by flush(), as xlsxwriter's constant_memory
+    mode requires.
+
+    Formula values are evaluated here, for the subset of Excel formulas used by the BC workbooks
+    (cell and range references, +-*/^, SUM, NPV, MAX, ABS and IF), so that the results can be read
+    without Excel recalculating the workbook.  They are also written as the cached formula results,
+    with results that aren't finite written as #DIV/0! like Excel would show them.
+    """
+    CELL_RE     = re.compile(r"(?:([A-Za-z_]\w*)!)?\$?([A-Z]{1,3})\$?([0-9]+)(?::\$?([A-Z]{1,3})\$?([0-9]+))?")
+    FUNCTION_RE = re.compile(r"\b(SUM|NPV|MAX|ABS|IF)\(", re.IGNORECASE)
+    EQUALS_RE   = re.compile(r"(?<![<>!=])=(?!=)")
+
+    def __init__(self, workbook, name, worksheet=None):
+        self.workbook  = workbook
+        self.name      = name
+        self.worksheet = worksheet   # the xlsxwriter worksheet, or None if the workbook isn't written
+        self.cells     = {}          # (row,col) => (token, cell_format)
+        self.row_args  = {}          # row => set_row() args
+        self.merges    = {}          # first row => list of merge_range() args
+        self.calls     = []          # set_column(), freeze_panes(), etc, made as is on flush()
+
+    @staticmethod
+    def rowcol(args):
+        """
+        Converts A1 notation in the first argument to (row, col), like xlsxwriter.
+        """
+        if len(args) > 0 and isinstance(args[0], basestring):
+            return tuple(xl_cell_to_rowcol(args[0])) + tuple(args[1:])
+        return tuple(args)
+
+    def write(self, *args):
+        args = BufferedWorksheet.rowcol(args)
+        self.cells[(args[0], args[1])] = (args[2], args[3] if len(args) > 3 else None)
+        self.workbook.invalidate(self.name, args[0], args[1])
+
+    def write_row(self, row, col, data, cell_format=None):
+        for offset in range(len(data)):
+            self.write(row, col+offset, data[offset], cell_format)
+
+    def merge_range(self, *args):
+        args = BufferedWorksheet.rowcol(args)
+        self.merges.setdefault(args[0], []).append(args)
+        self.write(args[0], args[1], args[4], args[5] if len(args) > 5 else None)
+
+    def set_row(self, row, *args):
+        self.row_args[row] = args
+
+    def set_column(self, *args):
+        self.calls.append( ("set_column", args) )
+
+    def freeze_panes(self, *args):
+        self.calls.append( ("freeze_panes", args) )
+
+    def insert_image(self, *args):
+        self.calls.append( ("insert_image", args) )
+
+    def protect(self, *args):
+        self.calls.append( ("protect", args) )
+
+    def max_row(self):
+        return max([row for (row,col) in self.cells.keys()] + [-1])
+
+    def value(self, row, col):
+        """
+        Returns the value of the given cell: the number or string written, the evaluated formula,
+        or NaN for empty cells.
+        """
+        if (row,col) not in self.cells: return numpy.nan
+        token = self.cells[(row,col)][0]
+        if not isinstance(token, basestring) or not token.startswith("="): return token
+
+        key = (self.name, row, col)
+        if key not in self.workbook.values:
+            references = []
+            self.workbook.evaluated(key, self.evaluate(token, references), references)
+        return self.workbook.values[key]
+
+    def number(self, row, col):
+        """
+        Returns the numeric value of the given cell; empty cells are zero and strings are NaN.
+        """
+        if (row,col) not in self.cells: return numpy.float64(0)
+        value = self.value(row, col)
+        if isinstance(value, (int, long, float, numpy.number)): return numpy.float64(value)
+        if value is None or value == "": return numpy.float64(0)
+        return numpy.float64(numpy.nan)
+
+    def range_numbers(self, first_row, first_col, last_row, last_col):
+        """
+        Returns the numbers in the given range, skipping empty and string cells like Excel's SUM.
+        """
+        numbers = []
+        for row in range(first_row, last_row+1):
+            for col in range(first_col, last_col+1):
+                if (row,col) not in self.cells: continue
+                value = self.value(row, col)
+                if isinstance(value, (int, long, float, numpy.number)) and not isinstance(value, bool):
+                    numbers.append(numpy.float64(value))
+        return numbers
+
+    def evaluate(self, formula, references):
+        """
+        Evaluates the given formula by translating it to a python expression.
+        The (sheet, first_row, first_col, last_row, last_col) ranges it reads are appended to references.
+        """
+        def reference(match):
+            (sheet, first_col, first_row, last_col, last_row) = match.groups()
+            (first_row, first_col) = xl_cell_to_rowcol(first_col + first_row)
+            if last_col:
+                (last_row, last_col) = xl_cell_to_rowcol(last_col + last_row)
+                return "_range(%r,%d,%d,%d,%d)" % (sheet or self.name, first_row, first_col, last_row, last_col)
+            return "_cell(%r,%d,%d)" % (sheet or self.name, first_row, first_col)
+
+        expression = BufferedWorksheet.CELL_RE.sub(reference, formula[1:])
+        expression = BufferedWorksheet.FUNCTION_RE.sub(lambda match: "_%s(" % match.group(1).lower(), expression)
+        expression = BufferedWorksheet.EQUALS_RE.sub("==", expression).replace("^", "**")
+
+        def flatten(args):
+            numbers = []
+            for arg in args:
+                if isinstance(arg, list): numbers.extend(arg)
+                else: numbers.append(numpy.float64(arg))
+            return numbers
+
+        def npv(rate, *args):
+            values = numpy.array(flatten(args))
+            return numpy.sum(values / numpy.power(1.0+rate, numpy.arange(1, len(values)+1)))
+
+        def cell(sheet, row, col):
+            references.append( (sheet, row, col, row, col) )
+            return self.workbook.sheet(sheet).number(row, col)
+
+        def cell_range(sheet, first_row, first_col, last_row, last_col):
+            references.append( (sheet, first_row, first_col, last_row, last_col) )
+            return self.workbook.sheet(sheet).range_numbers(first_row, first_col, last_row, last_col)
+
+        functions = {
+            "_cell" : cell,
+            "_range": cell_range,
+            "_sum"  : lambda *args: numpy.sum(flatten(args)),
+            "_max"  : lambda *args: numpy.max(flatten(args)),
+            "_abs"  : lambda arg: numpy.abs(arg),
+            "_if"   : lambda condition, if_true, if_false: if_true if condition else if_false,
+            "_npv"  : npv,
+        }
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return eval(expression, {"__builtins__":{}}, functions)
+
+    def flush(self):
+        """
+        Writes the collected cells to the xlsxwriter worksheet in row order.
+        """
+        for (name, args) in self.calls:
+            getattr(self.worksheet, name)(*args)
+
+        row_cols = defaultdict(list)
+        for (row,col) in self.cells.keys(): row_cols[row].append(col)
+
+        for row in sorted(set(row_cols.keys()) | set(self.row_args.keys()) | set(self.merges.keys())):
+            if row in self.row_args:
+                self.worksheet.set_row(row, *self.row_args[row])
+
+            merged = set()
+            for args in self.merges.get(row, []):
+                self.worksheet.merge_range(*args)
+                merged.add( (args[0], args[1]) )
+
+            for col in sorted(row_cols[row]):
+                if (row,col) in merged: continue
+                (token, cell_format) = self.cells[(row,col)]
+                if isinstance(token, basestring) and token.startswith("="):
+                    value = self.value(row, col)
+                    if isinstance(value, (bool, numpy.bool_)):
+                        value = bool(value)
+                    elif isinstance(value, (int, long, float, numpy.number)):
+                        # the BC formulas only go infinite or NaN by dividing by zero
+                        if not numpy.isfinite(value): value = "#DIV/0!"
+                    elif not isinstance(value, basestring):
+                        value = 0
+                    self.worksheet.write_formula(row, col, token, cell_format, value)
+                else:
+                    self.worksheet.write(row, col, token, cell_format)
+
+
+class BufferedWorkbook:
+    """
+    Stands in for an xlsxwriter workbook, with BufferedWorksheets.  If filename is None, nothing is
+    written but the worksheet values are still available; otherwise the workbook is written on close()
+    using xlsxwriter's constant_memory mode.
+    """
+    def __init__(self, filename=None):
+        self.filename   = filename
+        self.workbook   = xlsxwriter.Workbook(filename, {'constant_memory': True}) if filename else None
+        self.worksheets = OrderedDict()
+        self.values     = {}          # evaluated formulas, (sheet,row,col) => value
+        self.references = {}          # evaluated formulas, (sheet,row,col) => list of ranges read
+        self.dependents = defaultdict(set)  # (sheet,row) => set of (first_col,last_col,formula key) reading that row
+
+    def add_worksheet(self, name):
+        if name in self.worksheets:
+            raise Exception("Sheetname '%s', with case ignored, is already in use." % name)
+        worksheet = self.workbook.add_worksheet(name) if self.workbook else None
+        self.worksheets[name] = BufferedWorksheet(self, name, worksheet)
+        return self.worksheets[name]
+
+    def add_format(self, properties=None):
+        if self.workbook: return self.workbook.add_format(properties)
+        return None
+
+    def sheet(self, name):
+        return self.worksheets[name]
+
+    def evaluated(self, key, value, references):
+        """
+        Saves the value of the formula at key, (sheet,row,col), and the ranges it read.
+        """
+        self.values[key]     = value
+        self.references[key] = references
+        for (sheet, first_row, first_col, last_row, last_col) in references:
+            for row in range(first_row, last_row+1):
+                self.dependents[(sheet,row)].add( (first_col, last_col, key) )
+
+    def forget(self, key):
+        """
+        Drops the evaluated formula at key, (sheet,row,col), if there is one.
+        """
+        self.values.pop(key, None)
+        for (sheet, first_row, first_col, last_row, last_col) in self.references.pop(key, []):
+            for row in range(first_row, last_row+1):
+                self.dependents[(sheet,row)].discard( (first_col, last_col, key) )
+
+    def invalidate(self, sheet, row, col):
+        """
+        Drops the evaluated formulas that depend on the given cell, directly or through other formulas.
+        """
+        changed = [(sheet, row, col)]
+        while changed:
+            (sheet, row, col) = changed.pop()
+            self.forget((sheet, row, col))
+            for (first_col, last_col, key) in list(self.dependents.get((sheet,row), [])):
+                if first_col <= col <= last_col and key in self.values:
+                    self.forget(key)
+                    changed.append(key)
+
+    def close(self):
+        if not self.workbook: return
+        for worksheet in self.worksheets.values():
+            worksheet.flush()
+        self.workbook.close()
+
+
 class RunResults:
     """
     This represents the run results for a single model run, to be used to calculate
@@ -62,6 +336,23 @@ class RunResults:
     WORK_ANNUALIZATION          = 250
     DISCOUNT_RATE               = 0.03
 
+    # valuation columns in the valuations sheet after the base valuations, by future
+    VALUATION_SETS              = ['base', 'CAG', 'RTFF', 'BTTF']
+
+    # benefit and cost streams run 2025-2080, with lifecycle present values through 2060 and 2080
+    STREAM_YEARS                = range(2025, 2081)
+    LIFECYCLE_YEARS             = [2060, 2080]
+    # the category1s summed into the total benefits for the B/C ratio; this leaves out the logsums without CEM
+    # and the categories for reference only
+    BC_CATEGORIES               = ['Accessibility Benefits (household-based) (with CEM)',
+                                   'Accessibility Benefits (other)',
+                                   'Other Transportation Benefits',
+                                   'Environmental Benefits',
+                                   'Safety Benefits',
+                                   'Health Benefits']
+    # the proxies worksheet header row; the proxies follow it in readStreamProxies() order
+    PROXIES_HEADER_ROW          = 4
+
     # per 100000. Crude mortality rate.  For HEAT mortality calcs    ##### AT CHECK THIS
     BAY_AREA_MORTALITY_RATE_2074YRS = 340
     BAY_AREA_MORTALITY_RATE_2064YRS = 232
@@ -74,6 +365,13 @@ class RunResults:
     CEM_THRESHOLD = 0.1
     CEM_SHALLOW    = 0.05
 
+    # logsums are converted to minutes with these ivt coefficients: mandatory, nonmandatory
+    LOGSUM_MINUTES_COEF = [0.0134, 0.0175]
+
+    # dimensions of the dense accessibility arrays used for consumer surplus
+    ACCESSIBILITY_DIMS  = ['taz','walk_subzone','incQ_label','autoSuff_label','hasAV']
+    INCOME_LABELS       = ['lowInc','medInc','highInc','veryHighInc']
+
     COUNTY_NUM_TO_NAME          = {
        1:'San Francisco',
        2:'San Mateo',
@@ -127,7 +425,23 @@ class RunResults:
 
 
 
-    def __init__(self, rundir, overwrite_config=None):
+    # metrics csvs in OUTPUT\metrics read by readInputs()
+    METRICS_CSVS = ["auto_times.csv", "autos_owned.csv", "parking_costs.csv", "vmt_vht_metrics.csv",
+                    "nonmot_times.csv", "transit_boards_miles.csv", "transit_times_by_acc_mode_egr.csv",
+                    "transit_times_by_mode_income.csv", "unique_active_travelers.csv",
+                    "transit_crowding.csv", "transit_crowding_complete.csv"]
+
+    # daily metrics are persisted in OUTPUT\metrics; see readDailyMetrics()
+    DAILY_METRICS_CACHE = "daily_metrics.pkl"
+    DAILY_METRICS_ATTRS = ['daily_results', 'daily_category_results', 'lil_cats', 'quick_summary', 'ovtt_adjustment',
+                           'population_by_incQ']
+
+    PPA_MASTER_INPUT = "L:\\RTP2021_PPA\\Projects\\PPAMasterInput.xlsx"
+
+    # PPAMasterInput.xlsx sheets by workbook, parsed once per process.  See readMasterInput()
+    MASTER_INPUT_SHEETS = {}
+
+    def __init__(self, rundir, overwrite_config=None, read_inputs=True):
         """
     Parameters
     ----------
@@ -136,61 +450,20 @@ class RunResults:
     overwrite_config : dict
         Pass overwrite config if this is a base scenario and we should use the
         project's ovtt adjustment mode.
+    read_inputs : bool
+        Pass False to defer reading the run's csvs until they're needed; see readInputs().
 
     Read configuration and input data.
     """
-        self.ppa_master_input = "L:\\RTP2021_PPA\\Projects\\PPAMasterInput.xlsx"
+        self.ppa_master_input = RunResults.PPA_MASTER_INPUT
 
         # read the configs
         self.rundir = os.path.join(os.path.abspath(rundir), 'OUTPUT', 'metrics')
-        # if this is a baseline run, then read from configs_base sheet of master input file
-        # else this is a project run, then read from configs_projects sheet of master input file
-        #if 'CaltrainMod_00' not in rundir:  #for RTFF
-        if len(rundir) > 22:
-            configs_df = pd.read_excel(self.ppa_master_input, sheet_name='configs_projects', header=0)
-            configs_df = configs_df.drop(['Base Model', 'Base ID', 'Future Run', 'Iteration', 'Full Name'], axis=1)
-            configs_df.insert(0,'Folder','')
-            configs_df['Folder'] =  configs_df[['Foldername - Project', 'Foldername - Future']].apply(lambda x: '\\'.join(x), axis=1)
-            configs_df.drop(['Foldername - Project', 'Foldername - Future'], axis=1)
-        else:
-            configs_df = pd.read_excel(self.ppa_master_input, sheet_name='configs_base', header=0)
-        configs_df = configs_df.T
-        configs_df.columns = configs_df.iloc[0]
-        configs_df = configs_df[1:]
-        self.config = configs_df[[rundir]].iloc[:,0]
+        self.config = RunResults.readConfig(self.ppa_master_input, rundir)
         self.config['Project Run Dir'] = self.rundir
 
         # read the Benefit Valuations depending on future
-        # See RAWG Dec 2018'Plan Bay Area Performance Assessment Report_FINAL.pdf'
-        # Table 9: Benefit Valuations
-        # Units in 2017 dollars
-        # this sets it into the format {('cat1','cat2','cat3'):[val0,val1,val2,val3]} where vals are base, CAG, RTFF, BTTF
-
-        valuations_df = pd.read_excel(self.ppa_master_input, sheet_name='valuations', header=0)
-        self.BENEFIT_VALUATION = valuations_df.set_index(['Benefit Category 1','Benefit Category 2','Benefit Category 3']).T.to_dict('list')
-
-        # dict with 3-tuple keys and some have a 3rd val of "NAN"
-        old_keys = self.BENEFIT_VALUATION.keys()
-
-        for dict_key in old_keys:
-            # this one is bad
-            try:
-                if math.isnan(float(dict_key[2])):
-                    self.BENEFIT_VALUATION[(dict_key[0],dict_key[1])] = self.BENEFIT_VALUATION.get(dict_key)
-                    del self.BENEFIT_VALUATION[dict_key]
-            except:
-                None
-
-        if self.config.loc['Future'] in ['CAG']:
-            for k, v in self.BENEFIT_VALUATION.iteritems():
-                del v[3], v[2], v[0]
-        elif self.config.loc['Future'] in ['RTFF']:
-            for k, v in self.BENEFIT_VALUATION.iteritems():
-                del v[3], v[0], v[0]
-        elif self.config.loc['Future'] in ['BTTF']:
-            for k, v in self.BENEFIT_VALUATION.iteritems():
-                del v[0], v[0], v[0]
-
+        self.BENEFIT_VALUATION = RunResults.readValuations(self.ppa_master_input, self.config.loc['Future'])
 
         self.base_results = None
 
@@ -215,6 +488,93 @@ class RunResults:
         elif 'base_dir' not in self.config.keys():
             self.is_base_dir = True
 
+        #####################################
+
+        # Reading from master excel input file
+        if 'base_dir' in self.config.keys():
+
+            # Project costs
+            df_costs = RunResults.readMasterInput(self.ppa_master_input, 'project_costs')
+            df_costs = df_costs.drop(['Project Name'], axis=1)
+            df_costs = df_costs[df_costs['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
+            self.proj_costs = df_costs.to_dict('records', into=OrderedDict)[0]
+
+            # asset life
+            df_asset_life =  RunResults.readMasterInput(self.ppa_master_input, 'asset_life')
+            self.asset_life = df_asset_life.set_index(['asset_class']).T.to_dict('records', into=OrderedDict)[0]
+
+            # CRF-related collisions
+            df_collisions_SWITRS = RunResults.readMasterInput(self.ppa_master_input, 'collisions_switrs')
+            new_header = df_collisions_SWITRS.iloc[0] #grab the first row for the header
+            df_collisions_SWITRS = df_collisions_SWITRS[1:] #take the data less the header row
+            df_collisions_SWITRS.columns = new_header
+            df_collisions_SWITRS = df_collisions_SWITRS.drop(['Project Name'], axis=1)
+
+            df_collisions_SWITRS2 = df_collisions_SWITRS[df_collisions_SWITRS['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
+            if df_collisions_SWITRS2.shape[0] == 0:
+                df_collisions_SWITRS2 = df_collisions_SWITRS[df_collisions_SWITRS['project_id'] == 0]
+            self.collisions_switrs = df_collisions_SWITRS2.to_dict('records', into=OrderedDict)[0]
+
+
+            # Natural Land
+            df_natural_land = RunResults.readMasterInput(self.ppa_master_input, 'natural_land')
+            df_natural_land = df_natural_land.drop(['Project Name'], axis=1)
+            df_natural_land2 = df_natural_land[df_natural_land['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
+            if df_natural_land2.shape[0] == 0:
+                df_natural_land2 = df_natural_land[df_natural_land['project_id'] == 0]
+            self.natural_land = df_natural_land2.to_dict('records', into=OrderedDict)[0]
+
+            # Guiding Principles
+            df_gp = RunResults.readMasterInput(self.ppa_master_input, 'guiding_principles')
+            df_gp = df_gp.drop(['Project Name'], axis=1)
+            df_gp2 = df_gp[df_gp['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
+            if df_gp2.shape[0] == 0:
+                df_gp2 = df_gp[df_gp['project_id'] == 0]
+            df_gp2 = df_gp2.drop(['project_id'], axis=1)
+            self.gp = df_gp2.to_dict('records', into=OrderedDict)[0]
+
+
+
+        self.inputs_read = False
+        if read_inputs: self.readInputs()
+
+    def findRoadwayNetfile(self):
+        """
+        Returns the location of avgload5period_vehclasses.csv for this run.
+        """
+        # on M
+        roadway_netfile = os.path.abspath(os.path.join(self.rundir, "..", "avgload5period_vehclasses.csv"))
+        if os.path.exists(roadway_netfile): return roadway_netfile
+
+        # on model machine for reading baseline
+        roadway_netfile = os.path.abspath(os.path.join(self.rundir, "..", "extractor", "avgload5period_vehclasses.csv"))
+        if os.path.exists(roadway_netfile): return roadway_netfile
+
+        # on model machine for reading non-baseline
+        if 'ITER' not in os.environ:
+            print "Could not find roadway network in %s" % roadway_netfile
+            print "So looking in hwy/iterX but ITER isn't in the environment."
+            sys.exit(2)
+
+        return os.path.abspath(os.path.join(self.rundir, "..", "hwy", "iter%s" % os.environ['ITER'], "avgload5period_vehclasses.csv"))
+
+    def inputFiles(self):
+        """
+        Returns the list of files read by readInputs().
+        """
+        return [os.path.join(self.rundir, filename) for filename in RunResults.METRICS_CSVS] + \
+               [self.findRoadwayNetfile(),
+                os.path.join(self.rundir, "..", "logsums", "mandatoryAccessibilities.csv"),
+                os.path.join(self.rundir, "..", "logsums", "nonMandatoryAccessibilities.csv"),
+                os.path.join(self.rundir, "..", "core_summaries", "AccessibilityMarkets.csv")]
+
+    def readInputs(self):
+        """
+        Reads the run's metrics csvs, roadway network, accessibilities and accessibility markets.
+        These are only needed to calculate the daily metrics, so this is skipped when those are cached.
+        """
+        if self.inputs_read: return
+
         print("")
         # read the csvs
         self.auto_times = \
@@ -265,123 +625,23 @@ class RunResults:
         self.crowding_df = pd.read_csv(os.path.join(self.rundir, "transit_crowding.csv"))
         self.crowding_complete_df = pd.read_csv(os.path.join(self.rundir, "transit_crowding_complete.csv"))
 
-        #####################################
-
-        # Reading from master excel input file
-        if 'base_dir' in self.config.keys():
-
-            # Project costs
-            df_costs = pd.read_excel(self.ppa_master_input, sheet_name='project_costs', header=0)
-            df_costs = df_costs.drop(['Project Name'], axis=1)
-            df_costs = df_costs[df_costs['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
-            self.proj_costs = df_costs.to_dict('records', into=OrderedDict)[0]
-
-            # asset life
-            df_asset_life =  pd.read_excel(self.ppa_master_input, sheet_name='asset_life', header=0)
-            self.asset_life = df_asset_life.set_index(['asset_class']).T.to_dict('records', into=OrderedDict)[0]
-
-            # CRF-related collisions
-            df_collisions_SWITRS = pd.read_excel(self.ppa_master_input, sheet_name='collisions_switrs', header=0)
-            new_header = df_collisions_SWITRS.iloc[0] #grab the first row for the header
-            df_collisions_SWITRS = df_collisions_SWITRS[1:] #take the data less the header row
-            df_collisions_SWITRS.columns = new_header
-            df_collisions_SWITRS = df_collisions_SWITRS.drop(['Project Name'], axis=1)
-
-            df_collisions_SWITRS2 = df_collisions_SWITRS[df_collisions_SWITRS['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
-            if df_collisions_SWITRS2.shape[0] == 0:
-                df_collisions_SWITRS2 = df_collisions_SWITRS[df_collisions_SWITRS['project_id'] == 0]
-            self.collisions_switrs = df_collisions_SWITRS2.to_dict('records', into=OrderedDict)[0]
-
-
-            # Natural Land
-            df_natural_land = pd.read_excel(self.ppa_master_input, sheet_name='natural_land', header=0)
-            df_natural_land = df_natural_land.drop(['Project Name'], axis=1)
-            df_natural_land2 = df_natural_land[df_natural_land['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
-            if df_natural_land2.shape[0] == 0:
-                df_natural_land2 = df_natural_land[df_natural_land['project_id'] == 0]
-            self.natural_land = df_natural_land2.to_dict('records', into=OrderedDict)[0]
-
-            # Guiding Principles
-            df_gp = pd.read_excel(self.ppa_master_input, sheet_name='guiding_principles', header=0)
-            df_gp = df_gp.drop(['Project Name'], axis=1)
-            df_gp2 = df_gp[df_gp['project_id'] == int(self.config.loc['Project ID'].split('_')[0])]
-            if df_gp2.shape[0] == 0:
-                df_gp2 = df_gp[df_gp['project_id'] == 0]
-            df_gp2 = df_gp2.drop(['project_id'], axis=1)
-            self.gp = df_gp2.to_dict('records', into=OrderedDict)[0]
-
-
-
         # read roadway network for truck costs
-        roadway_read    = False
+        roadway_netfile  = self.findRoadwayNetfile()
+        self.roadways_df = loadednet.read_loaded_network(roadway_netfile)
+        print "Read roadways from %s" % roadway_netfile
 
-        # on M
-        roadway_netfile = os.path.abspath(os.path.join(self.rundir, "..", "avgload5period_vehclasses.csv"))
-        if os.path.exists(roadway_netfile):
-            self.roadways_df = pd.read_table(roadway_netfile, sep=",")
-            #print "Read roadways from %s" % roadway_netfile
-            roadway_read = True
+        # aggregate truck volumes over timeperiods, with and without tolls
+        truck_volumes = loadednet.vehclass_volumes(self.roadways_df, vehclasses=['sm','smt','hv','hvt'])
+        self.roadways_df['small truck volume'] = truck_volumes[:,0:2,:].sum(axis=(0,1))
+        self.roadways_df['large truck volume'] = truck_volumes[:,2:4,:].sum(axis=(0,1))
 
-        # on model machine for reading baseline
-        if not roadway_read:
-            roadway_netfile = os.path.abspath(os.path.join(self.rundir, "..", "extractor", "avgload5period_vehclasses.csv"))
-            if os.path.exists(roadway_netfile):
-                self.roadways_df = pd.read_table(roadway_netfile, sep=",")
-                print "Read roadways from %s" % roadway_netfile
-                roadway_read = True
+        if self.is_base_dir: col_prefix = 'base'
+        else:                col_prefix = 'scen'
 
-        # on model machine for reading non-baseline
-        if not roadway_read:
-            if 'ITER' not in os.environ:
-                print "Could not find roadway network in %s" % roadway_netfile
-                print "So looking in hwy/iterX but ITER isn't in the environment."
-                sys.exit(2)
-
-            roadway_netfile = os.path.abspath(os.path.join(self.rundir, "..", "hwy", "iter%s" % os.environ['ITER'], "avgload5period_vehclasses.csv"))
-            self.roadways_df = pd.read_table(roadway_netfile, sep=",")
-            print "Read roadways from %s" % roadway_netfile
-            roadway_read = True
-
-        # aggregate truck volumes
-        self.roadways_df['small truck volume'] = self.roadways_df.volEA_sm + self.roadways_df.volEA_smt + \
-                                                 self.roadways_df.volAM_sm + self.roadways_df.volAM_smt + \
-                                                 self.roadways_df.volMD_sm + self.roadways_df.volMD_smt + \
-                                                 self.roadways_df.volPM_sm + self.roadways_df.volPM_smt + \
-                                                 self.roadways_df.volEV_sm + self.roadways_df.volEV_smt
-        self.roadways_df['large truck volume'] = self.roadways_df.volEA_hv + self.roadways_df.volEA_hvt + \
-                                                 self.roadways_df.volAM_hv + self.roadways_df.volAM_hvt + \
-                                                 self.roadways_df.volMD_hv + self.roadways_df.volMD_hvt + \
-                                                 self.roadways_df.volPM_hv + self.roadways_df.volPM_hvt + \
-                                                 self.roadways_df.volEV_hv + self.roadways_df.volEV_hvt
-
-        for filename in ['mandatoryAccessibilities', 'nonMandatoryAccessibilities']:
-            accessibilities = \
-                pd.read_table(os.path.join(self.rundir, "..", "logsums", "%s.csv" % filename),
-                              sep=",")
-            accessibilities.drop('destChoiceAlt', axis=1, inplace=True)
-            accessibilities.set_index(['taz','subzone'], inplace=True)
-            # put 'lowInc_0_autos' etc are in a column not column headers
-            accessibilities = pd.DataFrame(accessibilities.stack())
-            accessibilities.reset_index(inplace=True)
-            # split the income/auto sufficiency column into three columns
-            accessibilities['incQ_label']     = accessibilities['level_2'].str.split('_',n=1).str.get(0)
-            accessibilities['autoSuff_label'] = accessibilities['level_2'].str.split('_',n=1).str.get(1)
-            accessibilities['autoSuff_label'] = accessibilities['autoSuff_label'].str.rsplit('_',n=1).str.get(0)
-            accessibilities['hasAV']          = accessibilities.apply(lambda row: 0 if "noAV" in row['level_2'] else 1, axis=1)
-            # remove the now extraneous 'level_2'
-            accessibilities.drop('level_2', axis=1, inplace=True)
-
-            if self.is_base_dir: col_prefix = 'base'
-            else:                col_prefix = 'scen'
-
-            accessibilities.rename(columns={0:'%s_dclogsum' % col_prefix,
-                                                 'subzone':'walk_subzone'},
-                                        inplace=True)
-
-            if filename == 'mandatoryAccessibilities':
-                self.mandatoryAccessibilities = accessibilities
-            elif filename == 'nonMandatoryAccessibilities':
-                self.nonmandatoryAccessibilities = accessibilities
+        self.mandatoryAccessibilities    = RunResults.readAccessibilities(
+            os.path.join(self.rundir, "..", "logsums", "mandatoryAccessibilities.csv"), col_prefix)
+        self.nonmandatoryAccessibilities = RunResults.readAccessibilities(
+            os.path.join(self.rundir, "..", "logsums", "nonMandatoryAccessibilities.csv"), col_prefix)
 
         self.accessibilityMarkets = \
             pd.read_table(os.path.join(self.rundir, "..", "core_summaries", "AccessibilityMarkets.csv"),
@@ -392,10 +652,79 @@ class RunResults:
                                                   'num_workers_students':'%s_num_workers_students' % col_prefix},
                                          inplace=True)
 
+        self.inputs_read = True
 
-    def createBaseRunResults(self):
+    def dailyMetricsKey(self):
+        """
+        Returns a hash of everything the daily metrics depend upon: this script, the config,
+        the input files, the PPAMasterInput rows written into the daily results (natural land
+        and collisions) and, if there is one, the same for the base.
+        """
+        key = hashlib.md5()
+        for filename in [os.path.realpath(__file__).replace(".pyc",".py")] + self.inputFiles():
+            with open(filename, 'rb') as input_file:
+                for block in iter(lambda: input_file.read(1024*1024), b""):
+                    key.update(block)
+        key.update(str(sorted(self.config.to_dict().items())))
+        for attr in ['natural_land', 'collisions_switrs']:
+            if hasattr(self, attr): key.update(str(list(getattr(self, attr).items())))
+        if self.base_results:
+            key.update(self.base_results.dailyMetricsKey())
+        return key.hexdigest()
+
+    def readDailyMetrics(self):
+        """
+        Reads the daily metrics for this run (and its base) persisted by writeDailyMetrics(), if they
+        were calculated from the same inputs.  Returns True if they were read.
+        """
+        cache_file = os.path.join(self.rundir, RunResults.DAILY_METRICS_CACHE)
+        if not os.path.exists(cache_file): return False
+
+        self.daily_metrics_key = self.dailyMetricsKey()
+        try:
+            with open(cache_file, 'rb') as cache:
+                (cache_key, daily_metrics, base_daily_metrics) = pickle.load(cache)
+        except Exception as e:
+            print("Couldn't read %s: %s" % (cache_file, str(e)))
+            return False
+
+        if cache_key != self.daily_metrics_key:
+            print("Inputs changed since %s was written" % cache_file)
+            return False
+
+        for attr in daily_metrics.keys(): setattr(self, attr, daily_metrics[attr])
+        if self.base_results:
+            for attr in base_daily_metrics.keys(): setattr(self.base_results, attr, base_daily_metrics[attr])
+        print("Read daily metrics from %s" % cache_file)
+        return True
+
+    def writeDailyMetrics(self):
+        """
+        Persists the daily metrics for this run (and its base) into OUTPUT\metrics, keyed by
+        dailyMetricsKey(), so that re-running the benefit/cost calculation only re-applies the
+        valuations and costs.
+        """
+        if not hasattr(self, 'daily_metrics_key'): self.daily_metrics_key = self.dailyMetricsKey()
+
+        daily_metrics      = dict((attr, getattr(self, attr)) for attr in RunResults.DAILY_METRICS_ATTRS if hasattr(self, attr))
+        base_daily_metrics = {}
+        if self.base_results:
+            base_daily_metrics = dict((attr, getattr(self.base_results, attr)) for attr in RunResults.DAILY_METRICS_ATTRS if hasattr(self.base_results, attr))
+
+        cache_file = os.path.join(self.rundir, RunResults.DAILY_METRICS_CACHE)
+        try:
+            with open(cache_file, 'wb') as cache:
+                pickle.dump((self.daily_metrics_key, daily_metrics, base_daily_metrics), cache, pickle.HIGHEST_PROTOCOL)
+            print("Wrote daily metrics to %s" % cache_file)
+        except (IOError, OSError) as e:
+            print("Couldn't write %s: %s" % (cache_file, str(e)))
+
+    def createBaseRunResults(self, base_results=None):
         """
         Create instance of RunResults representing the base, if applicable.
+
+        base_results, if passed, is a dict of base_dir => RunResults already read for that base,
+        (see loadBaseResults()), which will be shared rather than read again.
         """
         try:
             self.base_dir     = self.config.loc['base_dir']
@@ -416,8 +745,15 @@ class RunResults:
 
             print self.base_dir
             #print base_overwrite_config
-            self.base_results = RunResults(rundir = self.base_dir,
-                                           overwrite_config=base_overwrite_config)
+            if base_results and self.base_dir in base_results:
+                # share the inputs that were read; the config and daily metrics are per project
+                self.base_results = copy.copy(base_results[self.base_dir])
+                self.base_results.config = self.base_results.config.copy()
+                for key in base_overwrite_config.keys(): self.base_results.config[key] = base_overwrite_config[key]
+            else:
+                self.base_results = RunResults(rundir = self.base_dir,
+                                               overwrite_config=base_overwrite_config,
+                                               read_inputs=False)
 
     def updateDailyMetrics(self):
         """
@@ -511,6 +847,109 @@ class RunResults:
         self.daily_results[cat1,cat2,'Truck VMT - Computed'] = (1.0+pct_change_vmt)*base_truck_vmt
 
 
+    @staticmethod
+    def readMasterInput(ppa_master_input, sheet_name):
+        """
+        Returns a copy of the given sheet of the PPA master input workbook.
+
+        The whole workbook is parsed once per process.  A pickled snapshot of it is also saved
+        as [ppa_master_input].pkl, keyed by the workbook's modification time and size, so later
+        runs skip the slow excel parse until the workbook changes.
+        """
+        if ppa_master_input not in RunResults.MASTER_INPUT_SHEETS:
+            workbook_stat = os.stat(ppa_master_input)
+            workbook_key  = (workbook_stat.st_mtime, workbook_stat.st_size)
+            snapshot      = "%s.pkl" % ppa_master_input
+            sheets        = None
+
+            if os.path.exists(snapshot):
+                try:
+                    with open(snapshot, 'rb') as snapshot_file:
+                        (snapshot_key, sheets) = pickle.load(snapshot_file)
+                    if snapshot_key != workbook_key: sheets = None
+                except Exception as e:
+                    print("Couldn't read %s: %s" % (snapshot, str(e)))
+                    sheets = None
+
+            if sheets is None:
+                sheets = pd.read_excel(ppa_master_input, sheet_name=None, header=0)
+                # projects run in parallel share the master input, so write to a per-process file and rename it
+                temp_snapshot = "%s.%d.tmp" % (snapshot, os.getpid())
+                try:
+                    with open(temp_snapshot, 'wb') as snapshot_file:
+                        pickle.dump((workbook_key, sheets), snapshot_file, pickle.HIGHEST_PROTOCOL)
+                    if os.path.exists(snapshot): os.remove(snapshot)
+                    os.rename(temp_snapshot, snapshot)
+                    print("Wrote %s" % snapshot)
+                except (IOError, OSError) as e:
+                    print("Couldn't write %s: %s" % (snapshot, str(e)))
+            else:
+                print("Read %s" % snapshot)
+
+            RunResults.MASTER_INPUT_SHEETS[ppa_master_input] = sheets
+
+        return RunResults.MASTER_INPUT_SHEETS[ppa_master_input][sheet_name].copy()
+
+    @staticmethod
+    def readValuations(ppa_master_input, future):
+        """
+        Reads the Benefit Valuations for the given future (one of VALUATION_SETS, or the base valuations otherwise).
+        See RAWG Dec 2018'Plan Bay Area Performance Assessment Report_FINAL.pdf'
+        Table 9: Benefit Valuations
+        Units in 2017 dollars
+        Returns them in the format {('cat1','cat2','cat3'):[val]}
+        """
+        valuations_df = RunResults.readMasterInput(ppa_master_input, 'valuations')
+        benefit_valuation = valuations_df.set_index(['Benefit Category 1','Benefit Category 2','Benefit Category 3']).T.to_dict('list')
+
+        # dict with 3-tuple keys and some have a 3rd val of "NAN"
+        old_keys = benefit_valuation.keys()
+
+        for dict_key in old_keys:
+            # this one is bad
+            try:
+                if math.isnan(float(dict_key[2])):
+                    benefit_valuation[(dict_key[0],dict_key[1])] = benefit_valuation.get(dict_key)
+                    del benefit_valuation[dict_key]
+            except:
+                None
+
+        # vals are base, CAG, RTFF, BTTF
+        column = RunResults.VALUATION_SETS.index(future) if future in RunResults.VALUATION_SETS else 0
+        for k, v in benefit_valuation.iteritems():
+            benefit_valuation[k] = [v[column]]
+        return benefit_valuation
+
+    @staticmethod
+    def readConfigs(ppa_master_input, base):
+        """
+        Returns the configs_base (if base) or configs_projects sheet of the PPA master input
+        as a DataFrame with one column per run folder.
+        """
+        if base:
+            configs_df = RunResults.readMasterInput(ppa_master_input, 'configs_base')
+        else:
+            configs_df = RunResults.readMasterInput(ppa_master_input, 'configs_projects')
+            configs_df = configs_df.drop(['Base Model', 'Base ID', 'Future Run', 'Iteration', 'Full Name'], axis=1)
+            configs_df.insert(0,'Folder','')
+            configs_df['Folder'] =  configs_df[['Foldername - Project', 'Foldername - Future']].apply(lambda x: '\\'.join(x), axis=1)
+            configs_df.drop(['Foldername - Project', 'Foldername - Future'], axis=1)
+        configs_df = configs_df.T
+        configs_df.columns = configs_df.iloc[0]
+        configs_df = configs_df[1:]
+        return configs_df
+
+    @staticmethod
+    def readConfig(ppa_master_input, rundir):
+        """
+        Returns the config for the given run folder as a Series.
+        """
+        # if this is a baseline run, then read from configs_base sheet of master input file
+        # else this is a project run, then read from configs_projects sheet of master input file
+        #if 'CaltrainMod_00' not in rundir:  #for RTFF
+        configs_df = RunResults.readConfigs(ppa_master_input, base=(len(rundir) <= 22))
+        return configs_df[[rundir]].iloc[:,0]
+
     @staticmethod
     def parseNumList(numlist_str):
         """
@@ -536,6 +975,143 @@ class RunResults:
                     taz += 1
         return taz_list
 
+    @staticmethod
+    def readAccessibilities(filename, col_prefix, av_suffix_only=False):
+        """
+        Reads a mandatoryAccessibilities.csv or nonMandatoryAccessibilities.csv file and returns it in long format
+        with columns taz, walk_subzone, [col_prefix]_dclogsum, incQ_label, autoSuff_label, hasAV.
+
+        By default the last part of each autoSuff_label is dropped and hasAV is 0 for noAV columns and 1 otherwise.
+        With av_suffix_only, only an _AV or _noAV suffix is dropped and hasAV is -1 for columns with neither
+        (as mapAccessibilityDiffs.py expects).
+
+        The column headers (e.g. 'lowInc_autos_lt_workers_noAV') are parsed once and broadcast to the rows as
+        categorical codes, so this costs about as much as the stack itself.
+        """
+        accessibilities = pd.read_table(filename, sep=",")
+        accessibilities.drop('destChoiceAlt', axis=1, inplace=True)
+        accessibilities.set_index(['taz','subzone'], inplace=True)
+
+        # split the income/auto sufficiency column headers into three attributes
+        columns         = list(accessibilities.columns)
+        incQ_labels     = [col.split('_',1)[0] for col in columns]
+        if av_suffix_only:
+            autoSuff_labels = []
+            hasAV           = []
+            for col in columns:
+                autoSuff_label = col.split('_',1)[1]
+                if   autoSuff_label.endswith('_noAV'): autoSuff_labels.append(autoSuff_label[:-5]); hasAV.append(0)
+                elif autoSuff_label.endswith('_AV'):   autoSuff_labels.append(autoSuff_label[:-3]); hasAV.append(1)
+                else:                                  autoSuff_labels.append(autoSuff_label);      hasAV.append(-1)
+            hasAV = numpy.array(hasAV)
+        else:
+            autoSuff_labels = [col.split('_',1)[1].rsplit('_',1)[0] for col in columns]
+            hasAV           = numpy.array([0 if "noAV" in col else 1 for col in columns])
+
+        # put 'lowInc_0_autos' etc in a column not column headers -- row-major like stack(), which drops NaNs
+        num_rows  = len(accessibilities)
+        col_codes = numpy.tile(numpy.arange(len(columns)), num_rows)
+        row_codes = numpy.repeat(numpy.arange(num_rows), len(columns))
+        values    = accessibilities.values.ravel()
+        keep      = ~numpy.isnan(values)
+        col_codes = col_codes[keep]
+        row_codes = row_codes[keep]
+
+        long_df = pd.DataFrame(collections.OrderedDict([
+            ('taz',                      accessibilities.index.get_level_values('taz').values[row_codes]),
+            ('walk_subzone',             accessibilities.index.get_level_values('subzone').values[row_codes]),
+            ('%s_dclogsum' % col_prefix, values[keep])]))
+        for label_col, labels in [('incQ_label', incQ_labels), ('autoSuff_label', autoSuff_labels)]:
+            categories = pd.unique(numpy.array(labels, dtype=object))
+            label_codes = pd.Index(categories).get_indexer(labels)
+            long_df[label_col] = pd.Categorical.from_codes(label_codes[col_codes], categories)
+        long_df['hasAV'] = hasAV[col_codes]
+        return long_df
+
+    @staticmethod
+    def denseAccessibilityLevels(frames):
+        """
+        Returns a list of pandas.Index, one per RunResults.ACCESSIBILITY_DIMS, with the sorted values of
+        that dimension found in any of the given frames.  Together these define a dense array with one
+        cell per (taz, walk_subzone, incQ_label, autoSuff_label, hasAV).
+        """
+        levels = []
+        for dim in RunResults.ACCESSIBILITY_DIMS:
+            values = numpy.concatenate([frame[dim].values for frame in frames])
+            levels.append(pd.Index(pd.unique(values)).sort_values())
+        return levels
+
+    @staticmethod
+    def denseAccessibilityPositions(frame, levels):
+        """
+        Returns the flat position of each row of frame in the dense array defined by levels.
+        """
+        codes = [levels[dim_num].get_indexer(frame[dim].values) for dim_num,dim in enumerate(RunResults.ACCESSIBILITY_DIMS)]
+        return numpy.ravel_multi_index(codes, tuple(len(level) for level in levels))
+
+    @staticmethod
+    def denseRows(positions, size):
+        """
+        Returns an array of length size with the row number at each of the given positions, or -1 where there is none.
+        """
+        rows = numpy.full(size, -1, dtype=numpy.int64)
+        rows[positions] = numpy.arange(len(positions))
+        return rows
+
+    @staticmethod
+    def joinDenseRows(frame, source, rows, columns):
+        """
+        Adds the given columns of source to frame, taking source row rows[i] for frame row i.
+        Rows of -1 get NaN, as a left join would.
+        """
+        missing = (rows < 0)
+        for col in columns:
+            values = source[col].values[numpy.where(missing, 0, rows)]
+            frame[col] = values
+            if missing.any():
+                frame[col] = frame[col].where(~missing)
+        return frame
+
+    @staticmethod
+    def consumerSurplusArrays(scen_dclogsum, base_dclogsum, scen_market, base_market, zero_neg_cells, zero_cells):
+        """
+        Consumer surplus engine operating on dense arrays.
+
+        scen_dclogsum, base_dclogsum are arrays of [mandatory/nonmandatory, cell] with NaN where the cell isn't present.
+        scen_market, base_market are arrays of [mandatory/nonmandatory, cell] with the number of people in each market:
+        workers & students for mandatory and all persons for nonmandatory.
+        zero_neg_cells, zero_cells are boolean arrays of [cell] for which negative diffs or all diffs should be zeroed.
+
+        Returns (diff_dclogsum, logsum_diff_minutes, ldm_ratio, ldm_mult, ldm_cem, cs_diff_min), where all are
+        [mandatory/nonmandatory, cell] except cs_diff_min, the rule of one-half consumer surplus in minutes,
+        which is [with cem/no cem, mandatory/nonmandatory, cell].
+        """
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            diff_dclogsum = scen_dclogsum - base_dclogsum
+
+            # zero out negative diffs and diffs if directed; only for cells in the scenario
+            diff_dclogsum[(diff_dclogsum < 0) & zero_neg_cells] = 0.0
+            diff_dclogsum[:, zero_cells] = 0.0
+            diff_dclogsum[numpy.isnan(scen_dclogsum)] = numpy.nan
+
+            logsum_diff_minutes = diff_dclogsum / numpy.array(RunResults.LOGSUM_MINUTES_COEF)[:,numpy.newaxis]
+
+            # Cliff Effect Mitigation
+            abs_ldm = numpy.abs(logsum_diff_minutes)
+            ldm_max = numpy.where(numpy.isnan(abs_ldm), 0.0, abs_ldm).max(axis=1)[:,numpy.newaxis]
+            ldm_ratio = abs_ldm/ldm_max    # how big is the magnitude compared to max magnitude?
+            ldm_mult  = 1.0/(1.0+numpy.exp(-(ldm_ratio-RunResults.CEM_THRESHOLD)/RunResults.CEM_SHALLOW))
+            no_diff   = (ldm_max[:,0] < 0.00001)
+            ldm_ratio[no_diff,:] = 1.0
+            ldm_mult[ no_diff,:] = 1.0
+            ldm_cem   = logsum_diff_minutes*ldm_mult
+
+            # rule of one-half
+            cs_diff_min = (0.5*base_market + 0.5*scen_market)*numpy.stack([ldm_cem, logsum_diff_minutes])
+            cs_diff_min[numpy.isnan(cs_diff_min)] = 0.0
+
+        return (diff_dclogsum, logsum_diff_minutes, ldm_ratio, ldm_mult, ldm_cem, cs_diff_min)
+
     @staticmethod
     def calculateConsumerSurplus(config,                      daily_results,
                                  mandatoryAccessibilities,    base_mandatoryAccessibilities,
@@ -546,6 +1122,10 @@ class RunResults:
         Static method for calculating consumer surplus.
         Done as a static method so it can be used by this script as well as by other scripts (e.g. mapAccessibilitydiffs.py)
 
+        The accessibilities and markets are put into dense arrays indexed by RunResults.ACCESSIBILITY_DIMS
+        and the consumer surplus is calculated by RunResults.consumerSurplusArrays() for all of
+        mandatory/nonmandatory and with/without cliff effect mitigation at once.
+
         config is used for 'Zero Logsum TAZs' -- and if it's configured, 'Project Run Dir'
 
         If debug_dir is specified, this also writes a debug file, consumer_surplus.csv, to debug_dir
@@ -578,112 +1158,98 @@ class RunResults:
                 zero_taz_list = RunResults.parseNumList(str(config["Zero Logsum TAZs"]))
                 print "Zeroing out diffs for tazs %s" % str(zero_taz_list)
 
-        # Take the difference and convert utils to minutes (k_ivt = 0.0134 k_mc_ls = 1.0 in access calcs);
-        # TODO: is k_mc_ls = 1.0?  DestinationChoice.cls has different values
-        mandatoryAccessibilities = pd.merge(mandatoryAccessibilities,
-                                            base_mandatoryAccessibilities,
-                                            how='left')
-        mandatoryAccessibilities['diff_dclogsum'] = mandatoryAccessibilities['scen_dclogsum'] - mandatoryAccessibilities['base_dclogsum']
-
-        # zero out negative diffs if directed
-        if len(zero_neg_taz_list) > 0:
-            mandatoryAccessibilities.loc[(mandatoryAccessibilities.taz.isin(zero_neg_taz_list)) & (mandatoryAccessibilities.diff_dclogsum<0), 'diff_dclogsum'] = 0.0
-
-        # zero out diffs if directed
-        if len(zero_taz_list) > 0:
-            mandatoryAccessibilities.loc[mandatoryAccessibilities.taz.isin(zero_taz_list), 'diff_dclogsum'] = 0.0
-
-        mandatoryAccessibilities['logsum_diff_minutes'] = mandatoryAccessibilities.diff_dclogsum / 0.0134
-
-        # Cliff Effect Mitigation
-        mand_ldm_max = mandatoryAccessibilities.logsum_diff_minutes.abs().max()
-        if mand_ldm_max < 0.00001:
-            mandatoryAccessibilities['ldm_ratio'] = 1.0
-            mandatoryAccessibilities['ldm_mult' ] = 1.0
-        else:
-            mandatoryAccessibilities['ldm_ratio'] = mandatoryAccessibilities['logsum_diff_minutes'].abs()/mand_ldm_max    # how big is the magnitude compared to max magnitude?
-            mandatoryAccessibilities['ldm_mult' ] = 1.0/(1.0+numpy.exp(-(mandatoryAccessibilities['ldm_ratio']-RunResults.CEM_THRESHOLD)/RunResults.CEM_SHALLOW))
-            mandatoryAccessibilities['ldm_cem']   = mandatoryAccessibilities['logsum_diff_minutes']*mandatoryAccessibilities['ldm_mult']
-
-        # This too
-        nonmandatoryAccessibilities = pd.merge(nonmandatoryAccessibilities,
-                                               base_nonmandatoryAccessibilities,
-                                               how='left')
-        nonmandatoryAccessibilities['diff_dclogsum'] = \
-                nonmandatoryAccessibilities['scen_dclogsum'] - nonmandatoryAccessibilities['base_dclogsum']
-
-        # zero out negative diffs if directed
-        if len(zero_neg_taz_list) > 0:
-            nonmandatoryAccessibilities.loc[(nonmandatoryAccessibilities.taz.isin(zero_neg_taz_list)) & (nonmandatoryAccessibilities.diff_dclogsum<0), 'diff_dclogsum'] = 0.0
-
-        # zero out diffs if directed
-        if len(zero_taz_list) > 0:
-            nonmandatoryAccessibilities.loc[nonmandatoryAccessibilities.taz.isin(zero_taz_list), 'diff_dclogsum'] = 0.0
-
-        nonmandatoryAccessibilities['logsum_diff_minutes'] = nonmandatoryAccessibilities['diff_dclogsum'] / 0.0175
-
-        # Cliff Effect Mitigation
-        nonmm_ldm_max = nonmandatoryAccessibilities['logsum_diff_minutes'].abs().max()
-        nonmandatoryAccessibilities['ldm_ratio'] = nonmandatoryAccessibilities['logsum_diff_minutes'].abs()/nonmm_ldm_max    # how big is the magnitude compared to max magnitude?
-        nonmandatoryAccessibilities['ldm_mult' ] = 1.0/(1.0+numpy.exp(-(nonmandatoryAccessibilities['ldm_ratio']-RunResults.CEM_THRESHOLD)/RunResults.CEM_SHALLOW))
-        nonmandatoryAccessibilities['ldm_cem']   = nonmandatoryAccessibilities['logsum_diff_minutes']*nonmandatoryAccessibilities['ldm_mult']
-
-        # merge scenario + base accessbiity markets data
-        accessibilityMarkets = pd.merge(accessibilityMarkets, base_accessibilityMarkets, how='left')
-
-        mandatoryAccess = pd.merge(mandatoryAccessibilities, accessibilityMarkets, how='left')
-        mandatoryAccess.fillna(0, inplace=True)
-
-        nonmandatoryAccess = pd.merge(nonmandatoryAccessibilities, accessibilityMarkets, how='left')
-        nonmandatoryAccess.fillna(0, inplace=True)
-
-        # Cliff Effect Mitigated - rule of one-half
-        cat1 = 'Accessibility Benefits (household-based) (with CEM)'
-        cat2 = 'Logsum Hours - Mandatory Tours - Workers & Students'
-        mandatoryAccess['CS diff work/school'] = \
-            (0.5*mandatoryAccess.base_num_workers_students + 0.5*mandatoryAccess.scen_num_workers_students) *mandatoryAccess.ldm_cem
-        for inclabel in ['lowInc','medInc','highInc','veryHighInc']:
-            daily_results[(cat1,cat2,inclabel)] = mandatoryAccess.loc[mandatoryAccess.incQ_label==inclabel, 'CS diff work/school'].sum()/60.0;
-
-        cat2 = 'Logsum Hours - NonMandatory Tours - All people'
-        nonmandatoryAccess['CS diff all'] = \
-            (0.5*nonmandatoryAccess.base_num_persons + 0.5*nonmandatoryAccess.scen_num_persons)*nonmandatoryAccess.ldm_cem
-        for inclabel in ['lowInc','medInc','highInc','veryHighInc']:
-            daily_results[(cat1,cat2,inclabel)] = nonmandatoryAccess.loc[mandatoryAccess.incQ_label==inclabel, 'CS diff all'].sum()/60.0;
-
-        # create dataframe for debugging -- with mandatory and nonmandatory logsums and CS
-        mandatoryAccess["mandatory"] = True
-        nonmandatoryAccess["mandatory"] = False
-        debug_cem_df = pd.concat(objs=[mandatoryAccess.rename(columns={'CS diff work/school':'CS diff min'}), 
-                                       nonmandatoryAccess.rename(columns={'CS diff all':'CS diff min'})], axis="index", sort=True)
-        debug_cem_df["cem"] = True
-
-        # No Cliff Effect Mitigation - rule of one-half
-        cat1 = 'Accessibility Benefits (household-based) (no CEM)'
-        cat2 = 'Logsum Hours - Mandatory Tours - Workers & Students'
-        mandatoryAccess['CS diff work/school'] = \
-            (0.5*mandatoryAccess.base_num_workers_students + 0.5*mandatoryAccess.scen_num_workers_students)*mandatoryAccess.logsum_diff_minutes
-        for inclabel in ['lowInc','medInc','highInc','veryHighInc']:
-            daily_results[(cat1,cat2,inclabel)] = mandatoryAccess.loc[mandatoryAccess.incQ_label==inclabel, 'CS diff work/school'].sum()/60.0;
-
-        cat2 = 'Logsum Hours - NonMandatory Tours - All people'
-        nonmandatoryAccess['CS diff all'] = \
-            (0.5*nonmandatoryAccess.base_num_persons + 0.5*nonmandatoryAccess.scen_num_persons)*nonmandatoryAccess.logsum_diff_minutes
-        for inclabel in ['lowInc','medInc','highInc','veryHighInc']:
-            daily_results[(cat1,cat2,inclabel)] = nonmandatoryAccess.loc[mandatoryAccess.incQ_label==inclabel, 'CS diff all'].sum()/60.0;
-
-        # create dataframe for debugging -- with mandatory and nonmandatory logsums and CS
-        debug_nocem_df = pd.concat(objs=[mandatoryAccess.rename(columns={'CS diff work/school':'CS diff min'}), 
-                                         nonmandatoryAccess.rename(columns={'CS diff all':'CS diff min'})], axis="index", sort=True)
-        debug_nocem_df["cem"] = True
-        debug_nocem_df["cem"] = False
-
+        accessibilities      = [mandatoryAccessibilities,      nonmandatoryAccessibilities     ]
+        base_accessibilities = [base_mandatoryAccessibilities, base_nonmandatoryAccessibilities]
+        levels = RunResults.denseAccessibilityLevels(accessibilities + base_accessibilities +
+                                                     [accessibilityMarkets, base_accessibilityMarkets])
+        shape  = tuple(len(level) for level in levels)
+        size   = int(numpy.prod(shape))
+
+        # dense logsums: [mandatory/nonmandatory, cell]
+        scen_dclogsum = numpy.full((2,size), numpy.nan)
+        base_dclogsum = numpy.full((2,size), numpy.nan)
+        positions     = []
+        for mand_num in range(2):
+            positions.append(RunResults.denseAccessibilityPositions(accessibilities[mand_num], levels))
+            scen_dclogsum[mand_num, positions[mand_num]] = accessibilities[mand_num]['scen_dclogsum'].values
+            base_positions = RunResults.denseAccessibilityPositions(base_accessibilities[mand_num], levels)
+            base_dclogsum[mand_num, base_positions] = base_accessibilities[mand_num]['base_dclogsum'].values
+
+        # dense markets: workers & students for mandatory, all persons for nonmandatory
+        # base markets only count where the scenario has the market, as in a left join
+        market_rows      = RunResults.denseRows(RunResults.denseAccessibilityPositions(accessibilityMarkets,      levels), size)
+        base_market_rows = RunResults.denseRows(RunResults.denseAccessibilityPositions(base_accessibilityMarkets, levels), size)
+        base_market_rows[market_rows < 0] = -1
+        scen_market = numpy.zeros((2,size))
+        base_market = numpy.zeros((2,size))
+        for mand_num,col in enumerate(['num_workers_students','num_persons']):
+            scen_market[mand_num, market_rows      >= 0] = accessibilityMarkets[     'scen_%s' % col].values[market_rows[     market_rows      >= 0]]
+            base_market[mand_num, base_market_rows >= 0] = base_accessibilityMarkets['base_%s' % col].values[base_market_rows[base_market_rows >= 0]]
+
+        # tazs for zeroing, broadcast to cells
+        taz_dim = numpy.zeros(shape, dtype=numpy.int64) + levels[0].values.reshape((-1,1,1,1,1))
+        taz_dim = taz_dim.ravel()
+        zero_neg_cells = numpy.in1d(taz_dim, zero_neg_taz_list)
+        zero_cells     = numpy.in1d(taz_dim, zero_taz_list)
+
+        (diff_dclogsum, logsum_diff_minutes, ldm_ratio, ldm_mult, ldm_cem, cs_diff_min) = \
+            RunResults.consumerSurplusArrays(scen_dclogsum, base_dclogsum, scen_market, base_market, zero_neg_cells, zero_cells)
+
+        # sum to [cem/no cem, mandatory/nonmandatory, incQ_label] in one go
+        cs_by_income = cs_diff_min.reshape((2,2)+shape).sum(axis=(2,3,5,6))
+
+        for cem_num,cat1 in enumerate(['Accessibility Benefits (household-based) (with CEM)',
+                                       'Accessibility Benefits (household-based) (no CEM)']):
+            for mand_num,cat2 in enumerate(['Logsum Hours - Mandatory Tours - Workers & Students',
+                                            'Logsum Hours - NonMandatory Tours - All people']):
+                for inclabel in RunResults.INCOME_LABELS:
+                    if inclabel in levels[2]:
+                        daily_results[(cat1,cat2,inclabel)] = cs_by_income[cem_num, mand_num, levels[2].get_loc(inclabel)]/60.0
+                    else:
+                        daily_results[(cat1,cat2,inclabel)] = 0.0
+
+        # put the dense results back into the long frames
+        market_cols = [col for col in accessibilityMarkets.columns if col not in RunResults.ACCESSIBILITY_DIMS]
+        base_market_cols = [col for col in base_accessibilityMarkets.columns
+                            if col not in RunResults.ACCESSIBILITY_DIMS and col not in market_cols]
+        access_frames = []
+        for mand_num in range(2):
+            pos   = positions[mand_num]
+            frame = accessibilities[mand_num].copy()
+            frame['base_dclogsum']       = base_dclogsum[mand_num, pos]
+            frame['diff_dclogsum']       = diff_dclogsum[mand_num, pos]
+            frame['logsum_diff_minutes'] = logsum_diff_minutes[mand_num, pos]
+            frame['ldm_ratio']           = ldm_ratio[mand_num, pos]
+            frame['ldm_mult' ]           = ldm_mult[mand_num, pos]
+            frame['ldm_cem'  ]           = ldm_cem[mand_num, pos]
+            accessibilities[mand_num]    = frame
+
+            access = RunResults.joinDenseRows(frame.copy(), accessibilityMarkets, market_rows[pos], market_cols)
+            access = RunResults.joinDenseRows(access, base_accessibilityMarkets, base_market_rows[pos], base_market_cols)
+            # the labels are categorical and never missing
+            fill_cols = access.select_dtypes(exclude=['category']).columns
+            access[fill_cols] = access[fill_cols].fillna(0)
+            access_frames.append(access)
+        (mandatoryAccessibilities, nonmandatoryAccessibilities) = accessibilities
+        (mandatoryAccess, nonmandatoryAccess) = access_frames
+
+        # create dataframes for debugging -- with mandatory and nonmandatory logsums and CS
         # note that this is misleading in that the cem column here pertains to the CEM status of the CS columns
         # but the logsum diffs themselves have CEM enabled in the ldm_cem column and not in the logsum_diff_minutes column
+        debug_dfs = []
+        for cem_num in range(2):
+            mandatoryAccess[   'CS diff work/school'] = cs_diff_min[cem_num, 0, positions[0]]
+            nonmandatoryAccess['CS diff all'        ] = cs_diff_min[cem_num, 1, positions[1]]
+            mandatoryAccess[   "mandatory"] = True
+            nonmandatoryAccess["mandatory"] = False
+            debug_cem_df = pd.concat(objs=[mandatoryAccess.rename(columns={'CS diff work/school':'CS diff min'}),
+                                           nonmandatoryAccess.rename(columns={'CS diff all':'CS diff min'})], axis="index", sort=True)
+            debug_cem_df["cem"] = (cem_num == 0)
+            debug_dfs.append(debug_cem_df)
 
         if debug_dir:
             # prepare the debug info
-            debug_df = pd.concat(objs=[debug_cem_df, debug_nocem_df], axis="index", sort=True)
+            debug_df = pd.concat(objs=debug_dfs, axis="index", sort=True)
             debug_df['CS diff hours'] = debug_df['CS diff min']/60.0
 
             # drop columns that are redundant (but missing data) -- incQ_label and walk_subzone should be used
@@ -713,6 +1279,7 @@ class RunResults:
 
         Creates self.quick_summary results as well, a panda.Series with a simple string index.
         """
+        self.readInputs()
 
         # we really want these by class -- ignore time periods and income levels
         vmt_byclass     = self.vmt_vht_metrics.sum(level='vehicle class') # vehicles, not people
@@ -725,6 +1292,9 @@ class RunResults:
         quick_summary   = {}
         ######################################################################################
         if self.base_results:
+            # population by income for the equity score
+            self.population_by_incQ = self.accessibilityMarkets.groupby('incQ_label')['scen_num_persons'].sum()
+
             (self.mandatoryAccessibilities, self.nonMandatoryAccessibilities, self.mandatoryAccess, self.nonmandatoryAccess) = \
                 RunResults.calculateConsumerSurplus(self.config,                      daily_results,
                                                     self.mandatoryAccessibilities,    self.base_results.mandatoryAccessibilities,
@@ -1475,12 +2045,12 @@ class RunResults:
         self.quick_summary = self.quick_summary.append(self.config)
 
 
-    def calculateBenefitCosts(self, project_dir, all_projects_dir):
+    def calculateBenefitCosts(self, project_dir, all_projects_dir, write_workbook=True):
         """
         Compares the run results with those from the base results (if they exist),
         calculating the daily difference, annual difference, and annual benefits.
 
-        Writes a pretty workbook into `project_dir`, and flat csv series
+        Writes a pretty workbook into `project_dir` (unless `write_workbook` is False), and flat csv series
         into a csv in `all_projects_dir` named [Project ID].csv.
         """
         workbook_name = "BC_%s.xlsx" % self.config.loc['Project ID']
@@ -1502,7 +2072,8 @@ class RunResults:
 
         project_folder_name = project_dir.split('\\OUTPUT')[0]
         BC_detail_workbook = os.path.join(project_folder_name, workbook_name)
-        workbook        = xlsxwriter.Workbook(BC_detail_workbook)
+        # the worksheets are laid out in memory and streamed to the workbook on close
+        workbook        = BufferedWorkbook(BC_detail_workbook if write_workbook else None)
 
         scen_minus_base = self.writeBCWorksheet(workbook)
 
@@ -1510,7 +2081,8 @@ class RunResults:
             if self.config.loc['Compare'] == 'baseline-scenario':
                 base_minus_scen = self.writeBCWorksheet(workbook, scen_minus_baseline=False)
         workbook.close()
-        print("Wrote the BC workbook %s" % BC_detail_workbook)
+        if write_workbook:
+            print("Wrote the BC workbook %s" % BC_detail_workbook)
 
 
 
@@ -1535,35 +2107,18 @@ class RunResults:
             #       If cell positions are changed in the functions that create the worksheet, the following code
             #       will have to be adapted accordingly.
 
-            # Getting key B/C metrics from just created workbook
-
-            # Need to first open and save the workbook so all formulas get calculated
-            app = xl.App(visible=False)
-            book = app.books.open(BC_detail_workbook)
-            book.save()
-            book.close()
-            app.kill()
-            df_lifecycleben = pd.read_excel(BC_detail_workbook, sheet_name='benefit_streams', header=None)
-
-            # Getting 2060 Lifecycle benefits by category
-            df_lifecycleben_2060 = df_lifecycleben
-            df_lifecycleben_2060 =  df_lifecycleben_2060.drop(df_lifecycleben_2060.index[[0,1,2,3,4]])
-            df_lifecycleben_2060 = df_lifecycleben_2060[[0,1,2,4]]
-            df_lifecycleben_2060.insert(3, 'variable', 'Lifecycle Benefits 2060 (PV 2019$)')
-            df_lifecycleben_2060.columns = ['category1', 'category2','category3','variable_name','values']
-            df_lifecycleben_2060 = df_lifecycleben_2060.set_index(['category1', 'category2','category3','variable_name'])
-            lifecycle_ben = df_lifecycleben_2060.T.iloc[0]
-            self.bc_metrics = self.bc_metrics.append(lifecycle_ben)
-
-            # Getting 2080 Lifecycle benefits by category
-            df_lifecycleben_2080 = df_lifecycleben
-            df_lifecycleben_2080 =  df_lifecycleben_2080.drop(df_lifecycleben_2080.index[[0,1,2,3,4]])
-            df_lifecycleben_2080 = df_lifecycleben_2080[[0,1,2,5]]
-            df_lifecycleben_2080.insert(3, 'variable', 'Lifecycle Benefits 2080 (PV 2019$)')
-            df_lifecycleben_2080.columns = ['category1', 'category2','category3','variable_name','values']
-            df_lifecycleben_2080 = df_lifecycleben_2080.set_index(['category1', 'category2','category3','variable_name'])
-            lifecycle_ben = df_lifecycleben_2080.T.iloc[0]
-            self.bc_metrics = self.bc_metrics.append(lifecycle_ben)
+            # Getting 2060 and 2080 Lifecycle benefits by category, discounting the benefit streams
+            # of the benefit_streams worksheet
+            (benefit_keys, benefit_streams) = self.benefitStreams()
+            present_values = RunResults.presentValues(benefit_streams, [RunResults.DISCOUNT_RATE])
+            for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+                idx = pd.MultiIndex.from_tuples([key + ('Lifecycle Benefits %d (PV 2019$)' % lifecycle_year,) for key in benefit_keys],
+                                                names=['category1','category2','category3','variable_name'])
+                lifecycle_ben = pd.Series(present_values[lifecycle_year][:,0], index=idx)
+                self.bc_metrics = self.bc_metrics.append(lifecycle_ben)
+
+            # Getting key B/C metrics from the worksheets just laid out; the formulas are evaluated
+            # by the BufferedWorksheets so Excel isn't needed to calculate them
 
             # Getting highest level b/c metrics for the project
             bc_overall_tuples = [('bc_overall', 'Horizon Year', 'bc_overall','Total Horizon Yr Benefit (2019$)'),\
@@ -1577,11 +2132,11 @@ class RunResults:
                                   ('bc_overall', '2080', 'bc_overall', 'B/C Ratio'),\
                                   ('bc_overall', 'Equity', 'bc_overall','Equity Score')]
             idx = pd.MultiIndex.from_tuples(bc_overall_tuples, names=['category1','category2','category3','variable_name'])
-            df_bc = pd.read_excel(BC_detail_workbook, sheet_name='scenario-baseline', header=None)
-            bc_overall_array = numpy.asarray([df_bc.iloc[12,8], df_bc.iloc[13,8], df_bc.iloc[14,8],\
-                                    df_bc.iloc[12,10], df_bc.iloc[13,10], df_bc.iloc[14,10],\
-                                    df_bc.iloc[12,12], df_bc.iloc[13,12], df_bc.iloc[14,12],\
-                                    df_bc.iloc[11,1]])       # these are the cell locations of all higher level b/c metrics
+            df_bc = workbook.sheet('scenario-baseline')
+            bc_overall_array = numpy.asarray([df_bc.value(12,8), df_bc.value(13,8), df_bc.value(14,8),\
+                                    df_bc.value(12,10), df_bc.value(13,10), df_bc.value(14,10),\
+                                    df_bc.value(12,12), df_bc.value(13,12), df_bc.value(14,12),\
+                                    df_bc.value(11,1)])       # these are the cell locations of all higher level b/c metrics
             bc_overall = pd.Series(bc_overall_array, index=idx)
             self.bc_metrics = self.bc_metrics.append(bc_overall)
 
@@ -1599,11 +2154,11 @@ class RunResults:
                             ('costs', 'Annualized Costs (2019$)', '2050','Capital'),\
                             ('costs', 'Annualized Costs (2019$)', '2050','O&M')]
             idx = pd.MultiIndex.from_tuples(costs_tuples, names=['category1','category2','category3','variable_name'])
-            df_costs = pd.read_excel(BC_detail_workbook, sheet_name='cost_streams', header=None)
-            costs_array = numpy.asarray([df_costs.iloc[2,5], df_costs.iloc[3,5], df_costs.iloc[1,9], -df_costs.iloc[2,9],\
-                                         df_costs.iloc[2,6], df_costs.iloc[3,6], df_costs.iloc[1,10], -df_costs.iloc[2,10],\
-                                         df_costs.iloc[1,13], df_costs.iloc[2,13],\
-                                         df_costs.iloc[2,4], df_costs.iloc[3,4]])       # these are the cell locations of all higher level b/c metrics
+            df_costs = workbook.sheet('cost_streams')
+            costs_array = numpy.asarray([df_costs.value(2,5), df_costs.value(3,5), df_costs.value(1,9), -df_costs.value(2,9),\
+                                         df_costs.value(2,6), df_costs.value(3,6), df_costs.value(1,10), -df_costs.value(2,10),\
+                                         df_costs.value(1,13), df_costs.value(2,13),\
+                                         df_costs.value(2,4), df_costs.value(3,4)])       # these are the cell locations of all higher level b/c metrics
             costs = pd.Series(costs_array, index=idx)
             self.bc_metrics = self.bc_metrics.append(costs)
 
@@ -1629,9 +2184,108 @@ class RunResults:
             self.bc_metrics.to_csv(all_proj_filename, header=True, float_format='%.5f')
             print("Wrote the bc metrics csv %s" % csv_name)
 
-        copyfile(BC_detail_workbook, os.path.join(project_folder_name,"..","..","all_projects_bc_workbooks", workbook_name))
-        print("Copied BC workbook into all_projects_bc_workbooks directory")
+        if write_workbook:
+            copyfile(BC_detail_workbook, os.path.join(project_folder_name,"..","..","all_projects_bc_workbooks", workbook_name))
+            print("Copied BC workbook into all_projects_bc_workbooks directory")
+
+        if self.base_dir: return all_proj_filename
+        return None
+
+
+    @staticmethod
+    def lookupCategory(table, key, default):
+        """
+        Returns the value in table for (category1, category2, category3), or else (category1, category2), or else default.
+        """
+        if (key[0],key[1],key[2]) in table: return table[(key[0],key[1],key[2])]
+        if (key[0],key[1]) in table: return table[(key[0],key[1])]
+        return default
+
+    def benefitStreams(self, scen_minus_baseline=True, benefit_valuation=None):
+        """
+        Returns (keys, streams) for the valued benefits (not including those for reference only), valued with
+        benefit_valuation (if passed) or else BENEFIT_VALUATION, where keys is
+        the list of (category1, category2, category3) and streams is a (category x year) numpy array of the annual
+        benefits (2019$) for STREAM_YEARS.
+
+        The horizon year benefits are the daily differences times the annualization and valuation vectors.  Like the
+        benefit_streams worksheet, these are zero until the project is implemented and then scaled by the
+        stream proxies (see streamProxies()).
+        """
+        colA = self if scen_minus_baseline else self.base_results
+        colB = self.base_results if scen_minus_baseline else self
+        if benefit_valuation == None: benefit_valuation = self.BENEFIT_VALUATION
+
+        keys = [key for key in colA.daily_results.index if "for reference only" not in key[0] and \
+                RunResults.lookupCategory(benefit_valuation, key, None) != None]
+        idx  = pd.MultiIndex.from_tuples(keys)
+
+        already_diff   = numpy.array([RunResults.lookupCategory(RunResults.ALREADY_DIFF,   key, False) for key in keys], dtype=bool)
+        already_annual = numpy.array([RunResults.lookupCategory(RunResults.ALREADY_ANNUAL, key, False) for key in keys], dtype=bool)
+        annualization  = numpy.array([RunResults.lookupCategory(RunResults.ANNUALIZATION_FACTOR, key, RunResults.ANNUALIZATION)
+                                      for key in keys], dtype=float)
+        valuation      = numpy.array([RunResults.lookupCategory(benefit_valuation, key, None)[0] for key in keys], dtype=float)
+
+        # a category missing from colB is blank in the worksheet, so the diff is just colA
+        scen_daily = colA.daily_results.reindex(idx).values.astype(float)
+        base_daily = colB.daily_results.reindex(idx).fillna(0).values.astype(float)
+        daily_diff = numpy.where(already_diff, scen_daily, scen_daily - base_daily)
+        annualization[already_annual] = 1.0
+        horizon_benefit = daily_diff * annualization * valuation
+
+        streams = horizon_benefit[:, numpy.newaxis] * self.streamProxies(keys)
+        streams[:, :self.proj_costs.get('Years required to implement')] = 0
+        return (keys, streams)
+
+    @staticmethod
+    def discountFactors(discount_rates):
+        """
+        Returns a (discount rate x year) numpy array of the discount factors for STREAM_YEARS, 1/(1+rate)^n
+        for the nth year, as Excel's NPV() uses.
+        """
+        rates = numpy.asarray(discount_rates, dtype=float).reshape(-1, 1)
+        return numpy.power(1.0 + rates, -numpy.arange(1, len(RunResults.STREAM_YEARS)+1, dtype=float))
+
+    @staticmethod
+    def presentValues(streams, discount_rates):
+        """
+        Discounts the given (category x year) streams for STREAM_YEARS with a single dot product against the
+        discount factors for each discount rate and lifecycle year.
+        Returns an OrderedDict of lifecycle year => (category x discount rate) numpy array of present values.
+        """
+        factors  = RunResults.discountFactors(discount_rates)
+        lifecycle_factors = []
+        for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+            lifecycle_factors.append(numpy.where(numpy.array(RunResults.STREAM_YEARS) <= lifecycle_year, factors, 0.0))
+        present_values = numpy.dot(streams, numpy.vstack(lifecycle_factors).T)
 
+        num_rates = factors.shape[0]
+        return OrderedDict([(lifecycle_year, present_values[:, num*num_rates:(num+1)*num_rates])
+                            for (num, lifecycle_year) in enumerate(RunResults.LIFECYCLE_YEARS)])
+
+    def lifecycleCosts(self, discount_rates):
+        """
+        Returns an OrderedDict of lifecycle year => numpy array of the total lifecycle costs (PV 2019$)
+        for each of the given discount rates, from the cost_streams worksheet laid out at each rate.
+        """
+        lifecycle_costs = OrderedDict([(lifecycle_year, []) for lifecycle_year in RunResults.LIFECYCLE_YEARS])
+        for discount_rate in discount_rates:
+            workbook = BufferedWorkbook()
+            self.writeCostsWorksheet(workbook, None, scen_minus_baseline=False, discount_rate=discount_rate)
+            # Total Cost row; see calculateBenefitCosts()
+            for (col, lifecycle_year) in zip([5,6], RunResults.LIFECYCLE_YEARS):
+                lifecycle_costs[lifecycle_year].append(workbook.sheet('cost_streams').value(1,col))
+        for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+            lifecycle_costs[lifecycle_year] = numpy.array(lifecycle_costs[lifecycle_year], dtype=float)
+        return lifecycle_costs
+
+    def bcCategories(self):
+        """
+        Returns the category1s of the daily results summed into the total benefits for the B/C ratio in the
+        BC worksheet, the RunResults.BC_CATEGORIES.
+        """
+        cat1s = list(OrderedDict.fromkeys([key[0] for key in self.daily_results.index]))
+        return [cat1 for cat1 in cat1s if cat1 in RunResults.BC_CATEGORIES]
 
     def writeBCWorksheet(self, workbook, scen_minus_baseline=True):
         """
@@ -2040,11 +2694,11 @@ class RunResults:
 
         # Equity Score
         if self.base_dir:
-            population_lowinc = self.accessibilityMarkets.loc[self.accessibilityMarkets['incQ_label'] == "lowInc", 'scen_num_persons'].sum()
-            population_medinc = self.accessibilityMarkets.loc[self.accessibilityMarkets['incQ_label'] == "medInc", 'scen_num_persons'].sum()
-            population_highinc = self.accessibilityMarkets.loc[self.accessibilityMarkets['incQ_label'] == "highInc", 'scen_num_persons'].sum()
-            population_veryhighinc = self.accessibilityMarkets.loc[self.accessibilityMarkets['incQ_label'] == "veryHighInc", 'scen_num_persons'].sum()
-            population_total = self.accessibilityMarkets['scen_num_persons'].sum()
+            population_lowinc = self.population_by_incQ.get("lowInc", 0)
+            population_medinc = self.population_by_incQ.get("medInc", 0)
+            population_highinc = self.population_by_incQ.get("highInc", 0)
+            population_veryhighinc = self.population_by_incQ.get("veryHighInc", 0)
+            population_total = self.population_by_incQ.sum()
             pct_lowinc = float(population_lowinc) / population_total
             pct_medinc = float(population_lowinc+population_medinc) / population_total
 
@@ -2121,14 +2775,11 @@ class RunResults:
             worksheet.write(TABLE_HEADER_ROW-3, 7, "",format_bc_header)
             worksheet.write(TABLE_HEADER_ROW-2, 7, "",format_bc_header)
 
-            sum_indices = cat1_sums.keys()
-            sum_indices_PV1 = cat1_sumsPV1.keys()
-            sum_indices_PV2 = cat1_sumsPV2.keys()
-
-            # choose the correct major categories for summing; drop 1,3,4 = logsum no cem, travel time, travel cost
-            sum_indices = [sum_indices[0]] + sum_indices[2:7]
-            sum_indices_PV1 = [sum_indices_PV1[0]] + sum_indices_PV1[2:7]
-            sum_indices_PV2 = [sum_indices_PV2[0]] + sum_indices_PV2[2:7]
+            # choose the major categories for summing by name; there's a cat1 sum cell for each cat1, in order
+            cat1s           = list(OrderedDict.fromkeys([key[0] for key in colA.daily_results.index]))
+            sum_indices     = [cell for (cat1,cell) in zip(cat1s, cat1_sums.keys())    if cat1 in RunResults.BC_CATEGORIES]
+            sum_indices_PV1 = [cell for (cat1,cell) in zip(cat1s, cat1_sumsPV1.keys()) if cat1 in RunResults.BC_CATEGORIES]
+            sum_indices_PV2 = [cell for (cat1,cell) in zip(cat1s, cat1_sumsPV2.keys()) if cat1 in RunResults.BC_CATEGORIES]
 
             worksheet.write(TABLE_HEADER_ROW-5, 8, 'Horizon Year', format_bc_header_left)
             worksheet.write(TABLE_HEADER_ROW-5, 10, 'NPV 2025-60', format_bc_header_left)
@@ -2184,13 +2835,55 @@ class RunResults:
         return bc_metrics
 
 
-    def writeProxiesWorksheet(self, workbook):
-
-        # Reading proxies from master input file
-        df_proxies = pd.read_excel(self.ppa_master_input, sheet_name='stream_proxies', header=0)
+    def readStreamProxies(self):
+        """
+        Reads the stream proxies for this project's Future and Project Type from the master input file.
+        """
+        df_proxies = RunResults.readMasterInput(self.ppa_master_input, 'stream_proxies')
         df_proxies = df_proxies.loc[df_proxies['Future']==self.config.loc['Future']]
         df_proxies = df_proxies.loc[(df_proxies['Project Type']==self.config.loc['Project Type']) | (df_proxies['Project Type']=="All")]
         df_proxies = df_proxies.drop(['Future', 'Project Type', 'Base2015', 'Base2030', 'Base2050'], axis=1)
+        return df_proxies
+
+    def streamProxyRows(self, df_proxies, keys):
+        """
+        Returns the positions in df_proxies (from readStreamProxies()) of the proxies for the given list of
+        (category1, category2, category3) keys, matched to the Benefit Category columns.
+        Raises an Exception if a key doesn't have exactly one row of proxies.
+        """
+        category_cols = ['Benefit Category 1', 'Benefit Category 2', 'Benefit Category 3']
+        proxy_keys    = [tuple(cats) for cats in df_proxies[category_cols].fillna("").values.tolist()]
+
+        duplicate_keys = sorted(set(key for key in keys if proxy_keys.count(key) > 1))
+        if len(duplicate_keys) > 0:
+            raise Exception("Multiple stream_proxies rows for Future %s, Project Type %s: %s" %
+                            (self.config.loc['Future'], self.config.loc['Project Type'], duplicate_keys))
+        missing_keys = [key for key in keys if key not in proxy_keys]
+        if len(missing_keys) > 0:
+            raise Exception("No stream_proxies row for Future %s, Project Type %s: %s" %
+                            (self.config.loc['Future'], self.config.loc['Project Type'], missing_keys))
+        return [proxy_keys.index(key) for key in keys]
+
+    def streamProxies(self, keys):
+        """
+        Returns a (category x year) numpy array of the stream proxies for STREAM_YEARS for the given list of
+        (category1, category2, category3) keys, matched by streamProxyRows().
+
+        The years are in the same columns as the proxies worksheet references, and blank proxies are 0,
+        as the worksheet formulas read them.
+        """
+        num_years  = len(RunResults.STREAM_YEARS)
+        df_proxies = self.readStreamProxies()
+        year_cols  = list(df_proxies.columns[13:13+num_years])
+
+        proxies = numpy.zeros((len(keys), num_years))
+        proxies[:, :len(year_cols)] = df_proxies[year_cols].iloc[self.streamProxyRows(df_proxies, keys)].fillna(0).values.astype(float)
+        return proxies
+
+    def writeProxiesWorksheet(self, workbook):
+
+        # Reading proxies from master input file
+        df_proxies = self.readStreamProxies()
 
         format_basicstats = workbook.add_format({'bg_color':'#FFFFC0', 'bold':True})
         format_header = workbook.add_format({'bg_color':'#1F497D',
@@ -2225,13 +2918,13 @@ class RunResults:
         worksheet.write(row,0,'Project Type', format_basicstats)
         worksheet.write(row,1, self.config.loc['Project Type'], format_basicstats)
 
-        writer = pd.ExcelWriter(workbook, engine = 'xlsxwriter')
-        writer.sheets['proxies'] = worksheet
-        df_proxies.to_excel(writer, sheet_name = 'proxies', startrow=4, index=False)
-
-        for col_num, value in enumerate(df_proxies.columns.values):
-            worksheet.write(4, col_num, value, format_header)
-
+        row = RunResults.PROXIES_HEADER_ROW
+        worksheet.write_row(row, 0, list(df_proxies.columns.values), format_header)
+        row+=1
+        for values in df_proxies.values.tolist():
+            for col_num, value in enumerate(values):
+                if not pd.isnull(value): worksheet.write(row, col_num, value)
+            row+=1
 
         worksheet.set_column(3,69,None,format_value)
         worksheet.set_column(0,2,30.0)
@@ -2310,7 +3003,12 @@ class RunResults:
 
         bc_metrics_withNPV = collections.OrderedDict()
 
+        # the proxies worksheet row for each benefit, matched by category
+        proxy_rows = self.streamProxyRows(self.readStreamProxies(),
+                                          [(key[0],key[1],key[2]) for key in bc_metrics_annual_benefit.keys()])
+
         for key,val in bc_metrics_annual_benefit.iteritems():
+            proxy_row = RunResults.PROXIES_HEADER_ROW + 1 + proxy_rows.pop(0)
 
             # insert first few columns as categories and labels from bc_metrics
             worksheet.write(row, 0, key[0])
@@ -2325,16 +3023,13 @@ class RunResults:
             bc_metrics_withNPV[(key[0],key[1],key[2],'NPV2025-60cell')] = xl_rowcol_to_cell(row,4)
             bc_metrics_withNPV[(key[0],key[1],key[2],'NPV2025-80cell')] = xl_rowcol_to_cell(row,5)
 
-            col = 6
-            while col<(6+imp_years):            # zero benefit until project is implemented
-                worksheet.write(row, col, 0, format_ann_ben)
-                col = col+1
-
-            col = 6 + imp_years
-            while col<=61:     #multiplying annual horizon year benefit times proxies from year 2025-2080
-                worksheet.write(row, col, '=%s*proxies!%s' % (xl_rowcol_to_cell(row,3), xl_rowcol_to_cell(row,col+7)), \
-                  format_2060 if (col in [41,61]) else format_ann_ben)
-                col = col+1
+            # zero benefit until project is implemented, then multiplying annual horizon year benefit times
+            # proxies from year 2025-2080.  Written as one range, with 2060 and 2080 highlighted
+            streams = [0]*imp_years
+            streams.extend(['=%s*proxies!%s' % (xl_rowcol_to_cell(row,3), xl_rowcol_to_cell(proxy_row,col+7)) for col in range(6+imp_years,62)])
+            worksheet.write_row(row, 6, streams, format_ann_ben)
+            for col in [41,61]:
+                if col >= 6+imp_years: worksheet.write(row, col, streams[col-6], format_2060)
             row+=1
 
 
@@ -2348,9 +3043,9 @@ class RunResults:
         return bc_metrics_withNPV
 
 
-    def writeCostsWorksheet(self, workbook, bc_metrics, scen_minus_baseline=True):
+    def writeCostsWorksheet(self, workbook, bc_metrics, scen_minus_baseline=True, discount_rate=None):
         """
-        Writes the costs into the workbook
+        Writes the costs into the workbook, discounted at discount_rate (default DISCOUNT_RATE)
         Writes another worksheet into the workbook, to calculate the benefits streams and their present values
         """
         format_header = workbook.add_format({'bg_color':'#1F497D',
@@ -2387,7 +3082,7 @@ class RunResults:
         IMP_YEAR_ROW = row
         row+=1
         worksheet.write(row,0,'Discount rate', format_basicstats)
-        worksheet.write(row,1, RunResults.DISCOUNT_RATE, format_basicstats)
+        worksheet.write(row,1, discount_rate if discount_rate != None else RunResults.DISCOUNT_RATE, format_basicstats)
         DISCOUNT_RATE_ROW = row
         row+=1
         worksheet.write(row,0,'All costs are in 2019$', format_basicstats)
@@ -2658,32 +3353,268 @@ class RunResults:
 
 
 
+# baselines shared by the projects run in a batch worker process; see runProjects()
+BATCH_BASE_RESULTS = None
+
+def loadBaseResults(project_dirs):
+    """
+    Reads each distinct baseline of the given project dirs once.  The baseline inputs are only
+    read if one of its projects doesn't have current daily metrics persisted.
+    Returns a dict of base_dir => RunResults for passing to RunResults.createBaseRunResults().
+    """
+    configs_df   = RunResults.readConfigs(RunResults.PPA_MASTER_INPUT, base=False)
+    base_results = collections.OrderedDict()
+    for project_dir in project_dirs:
+        config   = configs_df[[project_dir]].iloc[:,0]
+        base_dir = config.get('base_dir')
+        if not isinstance(base_dir, basestring) or not base_dir: continue
+
+        if base_dir not in base_results:
+            print("")
+            print("BASE for batch:")
+            base_results[base_dir] = RunResults(rundir = base_dir,
+                                                overwrite_config={'Project Mode':config.loc['Project Mode']},
+                                                read_inputs=False)
+        if base_results[base_dir].inputs_read: continue
+
+        rr = RunResults(project_dir, read_inputs=False)
+        rr.createBaseRunResults(base_results)
+        if not rr.readDailyMetrics():
+            base_results[base_dir].readInputs()
+    return base_results
+
+def initBatchWorker(base_results, discount_rate):
+    """
+    Pool initializer: keeps the baselines for the projects run in this process.
+    """
+    global BATCH_BASE_RESULTS
+    BATCH_BASE_RESULTS      = base_results
+    RunResults.DISCOUNT_RATE = discount_rate
+
+def loadProject(project_dir):
+    """
+    Returns the RunResults for the given project dir, with the base results from BATCH_BASE_RESULTS.
+    The daily metrics are read from those persisted if current, and calculated (and persisted) otherwise.
+    """
+    rr = RunResults(project_dir, read_inputs=False)
+    rr.createBaseRunResults(BATCH_BASE_RESULTS)
+
+    # the daily metrics only need to be calculated if the inputs changed
+    if not rr.readDailyMetrics():
+        rr.calculateDailyMetrics()
+
+        if rr.base_results:
+            rr.base_results.calculateDailyMetrics()
+            rr.updateDailyMetrics()
+
+        rr.writeDailyMetrics()
+    return rr
+
+def revalueBenefits(run_results, discount_rates, valuation_set=None):
+    """
+    Re-values the lifecycle benefits of the given project RunResults (with their base results calculated)
+    under each of the given discount rates, with the valuations for valuation_set (one of VALUATION_SETS)
+    if passed.  The benefit streams of all the projects are stacked into one (category x year) matrix so
+    they're all discounted in one call.
+
+    Returns a tidy DataFrame with columns Project ID, category1, category2, category3, discount_rate and
+    the lifecycle benefits for each of LIFECYCLE_YEARS.
+    """
+    project_ids = []
+    keys        = []
+    streams     = []
+    for rr in run_results:
+        benefit_valuation = None
+        if valuation_set: benefit_valuation = RunResults.readValuations(rr.ppa_master_input, valuation_set)
+        (project_keys, project_streams) = rr.benefitStreams(benefit_valuation=benefit_valuation)
+        project_ids.extend([rr.config.loc['Project ID']]*len(project_keys))
+        keys.extend(project_keys)
+        streams.append(project_streams)
+
+    present_values = RunResults.presentValues(numpy.vstack(streams), discount_rates)
+
+    benefits_df = pd.DataFrame(keys, columns=['category1','category2','category3'])
+    benefits_df.insert(0, 'Project ID', project_ids)
+    benefits_dfs = []
+    for (num, discount_rate) in enumerate(discount_rates):
+        rate_df = benefits_df.copy()
+        rate_df['discount_rate'] = discount_rate
+        for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+            rate_df['Lifecycle Benefits %d (PV 2019$)' % lifecycle_year] = present_values[lifecycle_year][:,num]
+        benefits_dfs.append(rate_df)
+    return pd.concat(benefits_dfs, ignore_index=True)
+
+def sensitivityBenefitCosts(rr, discount_rates, valuation_sets):
+    """
+    Evaluates the lifecycle benefits, costs and B/C ratios of the given project RunResults (with its base results)
+    over the grid of discount rates and valuation sets, from its daily metrics.
+    Returns a tidy DataFrame with a row per valuation set and discount rate.
+    """
+    lifecycle_costs = rr.lifecycleCosts(discount_rates)
+    bc_categories   = rr.bcCategories()
+
+    bc_dfs = []
+    for valuation_set in valuation_sets:
+        benefits_df = revalueBenefits([rr], discount_rates, valuation_set)
+        benefits_df = benefits_df.loc[benefits_df['category1'].isin(bc_categories)]
+        bc_df = benefits_df.groupby(['Project ID','discount_rate']).sum().reindex(discount_rates, level='discount_rate', fill_value=0)
+        bc_df = bc_df[['Lifecycle Benefits %d (PV 2019$)' % lifecycle_year for lifecycle_year in RunResults.LIFECYCLE_YEARS]].reset_index()
+        bc_df.insert(1, 'valuation_set', valuation_set)
+        for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+            bc_df['Lifecycle Costs %d (PV 2019$)' % lifecycle_year] = lifecycle_costs[lifecycle_year]
+        for lifecycle_year in RunResults.LIFECYCLE_YEARS:
+            bc_df['B/C Ratio %d' % lifecycle_year] = bc_df['Lifecycle Benefits %d (PV 2019$)' % lifecycle_year] / \
+                                                     bc_df['Lifecycle Costs %d (PV 2019$)' % lifecycle_year]
+        bc_dfs.append(bc_df)
+    return pd.concat(bc_dfs, ignore_index=True)
+
+def runSensitivityProject(project_dir, discount_rates, valuation_sets):
+    """
+    Runs sensitivityBenefitCosts() for the given project dir.  Returns (project_dir, DataFrame or None, error or None).
+    """
+    try:
+        rr = loadProject(project_dir)
+        if not rr.base_results:
+            return (project_dir, None, None)
+        return (project_dir, sensitivityBenefitCosts(rr, discount_rates, valuation_sets), None)
+
+    except (Exception, SystemExit):
+        return (project_dir, None, traceback.format_exc())
+
+def runSensitivity(project_dirs, all_projects_dir, processes, discount_rates, valuation_sets):
+    """
+    Evaluates the B/C of all the given project dirs over the grid of discount rates and valuation sets using
+    a pool of processes, re-using the persisted daily metrics.  Writes the tidy B/C table
+    sensitivity_bc_metrics.csv into all_projects_dir and returns it.
+    """
+    base_results = loadBaseResults(project_dirs)
+    print("Read %d baselines for %d projects" % (len(base_results), len(project_dirs)))
+
+    worker = functools.partial(runSensitivityProject, discount_rates=discount_rates, valuation_sets=valuation_sets)
+    if processes > 1:
+        pool    = multiprocessing.Pool(processes, initializer=initBatchWorker,
+                                       initargs=(base_results, RunResults.DISCOUNT_RATE))
+        results = pool.map(worker, project_dirs)
+        pool.close()
+        pool.join()
+    else:
+        initBatchWorker(base_results, RunResults.DISCOUNT_RATE)
+        results = [worker(project_dir) for project_dir in project_dirs]
+
+    bc_dfs = []
+    for (project_dir, bc_df, error) in results:
+        if error:
+            print("Failed project %s:\n%s" % (project_dir, error))
+            continue
+        if bc_df is None: continue
+        bc_df.insert(0, 'project_dir', project_dir)
+        bc_dfs.append(bc_df)
+
+    if len(bc_dfs) == 0: return None
+    sensitivity_df = pd.concat(bc_dfs, ignore_index=True)
+    sensitivity_filename = os.path.join(os.getcwd(), all_projects_dir, "sensitivity_bc_metrics.csv")
+    sensitivity_df.to_csv(sensitivity_filename, index=False)
+    print("Wrote the sensitivity bc metrics csv %s" % sensitivity_filename)
+    return sensitivity_df
+
+def runProject(project_dir, all_projects_dir, write_workbook=True):
+    """
+    Runs the benefit/cost calculation for the given project dir, writing the quick summary,
+    BC workbook (if write_workbook) and BC csv.  Returns (project_dir, BC csv filename or None, error or None).
+    """
+    try:
+        rr = loadProject(project_dir)
+
+        # save the quick summary
+        if rr.base_dir:
+            quicksummary_csv = os.path.join(os.getcwd(),all_projects_dir, "quicksummary_%s_base%s.csv"  % (rr.config.loc['Project ID'], rr.config.loc['base_dir']))
+        else:
+            quicksummary_csv = os.path.join(os.getcwd(),all_projects_dir, "quicksummary_base%s.csv"  % rr.config.loc['Project ID'])
+
+        rr.quick_summary.to_csv(quicksummary_csv, float_format='%.5f')
+        #print rr.quick_summary
+
+        bc_csv = rr.calculateBenefitCosts(project_dir, all_projects_dir, write_workbook)
+        return (project_dir, bc_csv, None)
+
+    except (Exception, SystemExit):
+        return (project_dir, None, traceback.format_exc())
+
+def runProjects(project_dirs, all_projects_dir, processes, write_workbook=True):
+    """
+    Runs the benefit/cost calculation for all the given project dirs using a pool of processes,
+    reading each distinct baseline once up front.  Writes batch_bc_metrics.csv into all_projects_dir,
+    rolling up the BC csvs of the projects that succeeded.  Returns the list of results from runProject().
+    """
+    base_results = loadBaseResults(project_dirs)
+    print("Read %d baselines for %d projects" % (len(base_results), len(project_dirs)))
+
+    if processes > 1:
+        pool    = multiprocessing.Pool(processes, initializer=initBatchWorker,
+                                  initargs=(base_results, RunResults.DISCOUNT_RATE))
+        results = pool.map(functools.partial(runProject, all_projects_dir=all_projects_dir,
+                                             write_workbook=write_workbook), project_dirs)
+        pool.close()
+        pool.join()
+    else:
+        initBatchWorker(base_results, RunResults.DISCOUNT_RATE)
+        results = [runProject(project_dir, all_projects_dir, write_workbook) for project_dir in project_dirs]
+
+    bc_metrics_dfs = []
+    for (project_dir, bc_csv, error) in results:
+        if error:
+            print("Failed project %s:\n%s" % (project_dir, error))
+            continue
+        if not bc_csv: continue
+        bc_metrics_df = pd.read_csv(bc_csv)
+        bc_metrics_df['project_dir'] = project_dir
+        bc_metrics_dfs.append(bc_metrics_df)
+
+    if len(bc_metrics_dfs) > 0:
+        rollup_filename = os.path.join(os.getcwd(), all_projects_dir, "batch_bc_metrics.csv")
+        pd.concat(bc_metrics_dfs, axis="index").to_csv(rollup_filename, index=False)
+        print("Wrote the batch bc metrics csv %s" % rollup_filename)
+
+    print("%d of %d projects succeeded" % (len([result for result in results if result[2] is None]), len(results)))
+    return results
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(usage=USAGE)
     parser.add_argument('--discount_rate', help="The discount rate.", type=float, default=0.03)
-    parser.add_argument('project_dir',
-                        help="The directory with the run results csvs.")
+    parser.add_argument('--all_projects', action="store_true",
+                        help="Run every project in the configs_projects sheet of the master input rather than project_dir")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of processes to use when running more than one project")
+    parser.add_argument('--csv_only', action="store_true",
+                        help="Only write the BC csvs for rolling up; skip the BC workbooks")
+    parser.add_argument('--sensitivity', action="store_true",
+                        help="Write sensitivity_bc_metrics.csv with the B/C over the discount rates and valuation sets below")
+    parser.add_argument('--discount_rates', type=lambda rates: [float(rate) for rate in rates.split(",")], default="0.03",
+                        help="Discount rates for --sensitivity, comma-delimited")
+    parser.add_argument('--valuation_sets', default=",".join(RunResults.VALUATION_SETS[1:]),
+                        help="Valuation sets (columns of the valuations sheet) for --sensitivity, comma-delimited")
+    parser.add_argument('project_dir', nargs='*',
+                        help="The directory (or directories) with the run results csvs.")
     parser.add_argument('all_projects_dir',
                         help="The directory in which to write the Benefit/Cost summary Series")
     args = parser.parse_args(sys.argv[1:])
     RunResults.DISCOUNT_RATE = args.discount_rate
 
-    rr = RunResults(args.project_dir)
-    rr.createBaseRunResults()
-
-    rr.calculateDailyMetrics()
+    project_dirs = args.project_dir
+    if args.all_projects:
+        project_dirs = list(RunResults.readConfigs(RunResults.PPA_MASTER_INPUT, base=False).columns)
 
-    if rr.base_results:
-        rr.base_results.calculateDailyMetrics()
-        rr.updateDailyMetrics()
+    if len(project_dirs) == 0:
+        parser.error("Specify project_dir or --all_projects")
 
-    # save the quick summary
-    if rr.base_dir:
-        quicksummary_csv = os.path.join(os.getcwd(),args.all_projects_dir, "quicksummary_%s_base%s.csv"  % (rr.config.loc['Project ID'], rr.config.loc['base_dir']))
+    if args.sensitivity:
+        runSensitivity(project_dirs, args.all_projects_dir, args.processes,
+                       args.discount_rates, args.valuation_sets.split(","))
+    elif len(project_dirs) == 1:
+        (project_dir, bc_csv, error) = runProject(project_dirs[0], args.all_projects_dir, not args.csv_only)
+        if error:
+            print(error)
+            sys.exit(2)
     else:
-        quicksummary_csv = os.path.join(os.getcwd(),args.all_projects_dir, "quicksummary_base%s.csv"  % rr.config.loc['Project ID'])
-
-    rr.quick_summary.to_csv(quicksummary_csv, float_format='%.5f')
-    #print rr.quick_summary
-
-    rr.calculateBenefitCosts(args.project_dir, args.all_projects_dir)
+        runProjects(project_dirs, args.all_projects_dir, args.processes, not args.csv_only)
@@ -26,9 +26,11 @@ DESCRIPTION = """
 
 """
 import logging,os,shutil,subprocess,sys
-import pysal
 import numpy, pandas
 
+import loadednet
+import transitlinks
+
 CODE_DIR = r"C:\Users\lzorn\Documents\travel-model-one-v05\utilities\PBA40\metrics"
 
 TIMEPERIODS = [
@@ -62,20 +64,6 @@ ROAD_SGR_RUNS = [
     ("2040_05_503_1503",   "model2-b", "1503_HighwaySGR_idealIRI"       ),
 ]
 
-def read_dbf(dbf_fullpath):
-    """
-    Returns the pandas DataFrame
-    """
-    import pysal
-    dbfin = pysal.open(dbf_fullpath)
-    vars = dbfin.header
-    data = dict([(var, dbfin.by_col(var)) for var in vars])
-
-    table_df = pandas.DataFrame(data)
-
-    print "  Read %d lines from %s" % (len(table_df), dbf_fullpath)
-
-    return table_df
 
 def runCubeScript(workingdir, script_filename):
     """
@@ -116,15 +104,14 @@ if __name__ == '__main__':
         roadnet_file = os.path.join(MODEL_MACHINES_TO_MAPPED_DRIVES[model_machine],
                                     "Projects", model_machine_dir,
                                     "hwy","iter%d" % ITERATION, "avgload5period_vehclasses.csv")
-        roadnet_df = pandas.read_table(roadnet_file, sep=",")
-        print "  Read %s" % roadnet_file
+        roadnet_df = loadednet.read_loaded_network(roadnet_file)
 
         if 'busopc' not in roadnet_df.columns.values:
             # 1) if out of date, rerun net2csv_avgload5period.job
             runCubeScript(workingdir=os.path.join(MODEL_MACHINES_TO_MAPPED_DRIVES[model_machine],
                                                   "Projects", model_machine_dir),
                           script_filename=os.path.join(CODE_DIR, "net2csv_avgload5period.JOB"))
-            roadnet_df = pandas.read_table(roadnet_file, sep=",")
+            roadnet_df = loadednet.read_loaded_network(roadnet_file)
             assert('busopc' in roadnet_df.columns.values)
 
             # 2) copy to extractor
@@ -150,15 +137,18 @@ if __name__ == '__main__':
 
         else:
 
+            # 4) calculate bus operating cost by reading the transit assignment files
+            trn_links_df = transitlinks.read_transit_links(os.path.join(MODEL_MACHINES_TO_MAPPED_DRIVES[model_machine],
+                                                           "Projects",model_machine_dir,"trn","trnlink{}_wlk_exp_wlk.dbf"),
+                                                           timeperiods=[timeperiod_tuple[0] for timeperiod_tuple in TIMEPERIODS])
+
             trn_busopc_df_init = False
             for timeperiod_tuple in TIMEPERIODS:
     
                 timeperiod          = timeperiod_tuple[0]
                 timeperiod_duration = timeperiod_tuple[1]
     
-                # 4) calculate bus operating cost by reading the transit assignment files
-                trn_asgn_df = read_dbf(os.path.join(MODEL_MACHINES_TO_MAPPED_DRIVES[model_machine],
-                                                    "Projects",model_machine_dir,"trn","trnlink%s_wlk_exp_wlk.dbf" % timeperiod))
+                trn_asgn_df = trn_links_df.loc[trn_links_df.period == timeperiod]
     
                 # we only want bus lines
                 trn_asgn_df = trn_asgn_df.loc[(trn_asgn_df.MODE >= 10)&(trn_asgn_df.MODE<100)]
@@ -10,7 +10,7 @@ USAGE = """
   * main\[indiv,joint]TripDataIncome_%ITER%.csv and
   * main\jointTourData_%ITER%.csv (for the person ids for joint trips)
   * main\personData_%ITER%.csv (for person ages)
-  * database\ActiveTimeSkimsDatabase[timeperiod].csv (for active times)
+  * database\ActiveTimeSkimsDatabase[timeperiod].csv (for active times; cached as database\ActiveTimeSkims.npy)
 
   and tallies the trips by timeperiod, income category and trip mode.
   Household income is $2000; see http://analytics.mtc.ca.gov/foswiki/Main/Household
@@ -36,6 +36,9 @@ USAGE = """
   mortality reduction metrics, and is a sum of the number of unique persons
   doing the traveling.
 
+  The trip lists are read TRIP_CHUNKSIZE rows at a time, with just the columns in TRIP_DTYPES,
+  and the outputs are summed up chunk by chunk so memory is bounded by the size of the outputs.
+
   Note: this script DOES factor the trips by SAMPLESHARE.
 """
 
@@ -54,87 +57,263 @@ COLUMNS = ['orig_taz','dest_taz',
            'taxi', 'tnc', 'tnc_shared',
            'da_av_notoll', 'da_av_toll',  'sr2_av_notoll',  'sr2_av_toll', 'sr3_av_notoll', 'sr3_av_toll']
 
+TIMEPERIODS = ['EA','AM','MD','PM','EV']
+# depart_hour bins for pandas.cut() and the time period of each bin
+TIMEPERIOD_HOUR_BINS  = [-numpy.inf, 3, 6, 10, 15, 19, numpy.inf]
+TIMEPERIOD_HOUR_CODES = numpy.array([4, 0, 1, 2, 3, 4])  # EV, EA, AM, MD, PM, EV
+
+# income bins for pandas.cut() for income categories 1-4
+INCOME_BINS = [-numpy.inf, 30000, 60000, 100000, numpy.inf]
+
+# trip_mode -> trip_mode_str, or (avAvailable=0, avAvailable=1) for auto modes, or (inbound=0, inbound=1) for drive-transit modes
+TRIP_MODE_STRINGS = {
+     1:{'avAvailable':('da',      'da_av_notoll' )},
+     2:{'avAvailable':('da_toll', 'da_av_toll'   )},
+     3:{'avAvailable':('sr2',     'sr2_av_notoll')},
+     4:{'avAvailable':('sr2_toll','sr2_av_toll'  )},
+     5:{'avAvailable':('sr3',     'sr3_av_notoll')},
+     6:{'avAvailable':('sr3_toll','sr3_av_toll'  )},
+     7:'walk',
+     8:'bike',
+     9:'wlk_loc_wlk',
+    10:'wlk_lrf_wlk',
+    11:'wlk_exp_wlk',
+    12:'wlk_hvy_wlk',
+    13:'wlk_com_wlk',
+    14:{'inbound':('drv_loc_wlk','wlk_loc_drv')},
+    15:{'inbound':('drv_lrf_wlk','wlk_lrf_drv')},
+    16:{'inbound':('drv_exp_wlk','wlk_exp_drv')},
+    17:{'inbound':('drv_hvy_wlk','wlk_hvy_drv')},
+    18:{'inbound':('drv_com_wlk','wlk_com_drv')},
+    19:'taxi',
+    20:'tnc',
+    21:'tnc_shared',
+}
+TRIP_MODES = COLUMNS[2:]
+
+# simplified trip modes for the active time skims
+ACTIVE_MODES = ['walk','bike','wTrnW','dTrnW','wTrnD']
+TRIP_MODE_TO_ACTIVE_MODE = {
+    'walk':'walk', 'bike':'bike',
+    'wlk_loc_wlk':'wTrnW', 'wlk_lrf_wlk':'wTrnW', 'wlk_exp_wlk':'wTrnW', 'wlk_hvy_wlk':'wTrnW', 'wlk_com_wlk':'wTrnW',
+    'drv_loc_wlk':'dTrnW', 'drv_lrf_wlk':'dTrnW', 'drv_exp_wlk':'dTrnW', 'drv_hvy_wlk':'dTrnW', 'drv_com_wlk':'dTrnW',
+    'wlk_loc_drv':'wTrnD', 'wlk_lrf_drv':'wTrnD', 'wlk_exp_drv':'wTrnD', 'wlk_hvy_drv':'wTrnD', 'wlk_com_drv':'wTrnD',
+}
+
 ACTIVE_MINUTES_THRESHOLD = 30
 
-def find_number_of_active_adults(trips_df):
+# the trip list columns used and their dtypes; joint trips have no person_id or person_num
+TRIP_DTYPES = {'hh_id'           :numpy.int32,
+               'person_id'       :numpy.int32,
+               'person_num'      :numpy.int8,
+               'tour_id'         :numpy.int16,
+               'orig_taz'        :numpy.int16,
+               'dest_taz'        :numpy.int16,
+               'trip_mode'       :numpy.int8,
+               'depart_hour'     :numpy.int8,
+               'inbound'         :numpy.int8,
+               'avAvailable'     :numpy.int8,
+               'num_participants':numpy.int8,
+               'income'          :numpy.float32}  # float in case of NA
+PERSON_DTYPES = {'hh_id'     :numpy.int32,
+                 'person_id' :numpy.int32,
+                 'person_num':numpy.int8,
+                 'age'       :numpy.int8}
+
+# rows of trip list to read at a time
+TRIP_CHUNKSIZE = 1000000
+
+# dense (timeperiod, active mode, orig_taz-1, dest_taz-1) float32 array of the active time skims, as written by
+# numpy.save() and read memory-mapped; rewritten if it's older than any of the ActiveTimeSkimsDatabase csvs
+ACTIVE_SKIMS_CACHE = os.path.join("database", "ActiveTimeSkims.npy")
+
+def trip_mode_lookup():
+    """
+    Returns TRIP_MODE_STRINGS as an array of TRIP_MODES codes indexed by [trip_mode, avAvailable, inbound],
+    where the avAvailable and inbound indices are 0, 1 or 2 for anything else.  Unknown combinations are -1.
+    """
+    lookup = numpy.full((max(TRIP_MODE_STRINGS.keys())+1, 3, 3), -1, dtype=numpy.int16)
+    for trip_mode, trip_mode_str in TRIP_MODE_STRINGS.items():
+        if not isinstance(trip_mode_str, dict):
+            lookup[trip_mode, :, :] = TRIP_MODES.index(trip_mode_str)
+        elif 'avAvailable' in trip_mode_str:
+            for av_available in [0,1]:
+                lookup[trip_mode, av_available, :] = TRIP_MODES.index(trip_mode_str['avAvailable'][av_available])
+        else:
+            for inbound in [0,1]:
+                lookup[trip_mode, :, inbound] = TRIP_MODES.index(trip_mode_str['inbound'][inbound])
+    return lookup
+
+def flag_index(series):
+    """
+    Returns the given 0/1 flag series as a numpy array of indices for trip_mode_lookup(): 0, 1 or 2 for anything else.
+    """
+    return numpy.where(series.values==0, 0, numpy.where(series.values==1, 1, 2))
+
+def classify_trips(trips_df):
+    """
+    Sets the categorical time_period (from depart_hour) and trip_mode_str (from trip_mode, avAvailable and inbound)
+    columns of trips_df, and the income_cat (1-4, from income) column.
+    """
+    hour_bin = pandas.cut(trips_df['depart_hour'], bins=TIMEPERIOD_HOUR_BINS, right=False, labels=False)
+    assert(hour_bin.notnull().all())
+    trips_df['time_period'] = pandas.Categorical.from_codes(TIMEPERIOD_HOUR_CODES[hour_bin.values.astype(int)], categories=TIMEPERIODS)
+
+    trip_mode = trips_df['trip_mode'].values
+    assert(((trip_mode >= 0)&(trip_mode < len(TRIP_MODE_LOOKUP))).all())
+    trip_mode_codes = TRIP_MODE_LOOKUP[trip_mode.astype(int), flag_index(trips_df['avAvailable']), flag_index(trips_df['inbound'])]
+    assert((trip_mode_codes >= 0).all())
+    trips_df['trip_mode_str'] = pandas.Categorical.from_codes(trip_mode_codes, categories=TRIP_MODES)
+
+    income_bin = pandas.cut(trips_df['income'], bins=INCOME_BINS, right=False, labels=False)
+    assert(income_bin.notnull().all())
+    trips_df['income_cat'] = (income_bin.values + 1).astype(numpy.int8)
+
+TRIP_MODE_LOOKUP = trip_mode_lookup()
+
+def read_trips(iteration, sampleshare, chunksize=TRIP_CHUNKSIZE):
+    """
+    Generator that reads main\[indiv,joint]TripDataIncome_[iteration].csv chunksize rows at a time, with just
+    the TRIP_DTYPES columns, and yields (trip_type, trips_df) for each chunk, where trip_type is 'indiv' or 'joint'.
+
+    num_participants is set for individual trips and scaled by sampleshare, and the trips are classified
+    via classify_trips().
+    """
+    for trip_type in ['indiv', 'joint']:
+        filename = os.path.join("main", "%sTripDataIncome_%d.csv" % (trip_type, iteration))
+        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), filename)
+        num_trips = 0
+        for trips_df in pandas.read_csv(filename, sep=",", usecols=lambda column: column in TRIP_DTYPES,
+                                        dtype=TRIP_DTYPES, chunksize=chunksize):
+            if trip_type == 'indiv':
+                # each row is a trip; scale by sampleshare
+                trips_df['num_participants'] = 1.0/sampleshare
+            else:
+                # scale by sample share
+                trips_df['num_participants'] = trips_df['num_participants']/sampleshare
+
+            # set time period, mode string and income category
+            classify_trips(trips_df)
+            num_trips += len(trips_df)
+            yield (trip_type, trips_df)
+        print "%s Done reading %d %s trips" % (datetime.datetime.now().strftime("%x %X"), num_trips, trip_type)
+
+def add_grouped_sums(sums, chunk_sums):
+    """
+    Returns the sum of two grouped sums (Series or DataFrames with the same index levels), aligned on the index.
+    sums may be None for the first chunk.
+    """
+    if sums is None or len(sums) == 0: return chunk_sums
+    if len(chunk_sums) == 0: return sums
+    return pandas.concat([sums, chunk_sums]).groupby(level=list(range(sums.index.nlevels))).sum()
+
+def add_unique(values, chunk_values):
+    """
+    Returns the unique values of the numpy array values and the given Series chunk_values.
+    """
+    return pandas.unique(numpy.concatenate([values, chunk_values.values]))
+
+def read_active_time_skims():
+    """
+    Returns the active time skims in database\ActiveTimeSkimsDatabase[timeperiod].csv as a memory-mapped
+    (timeperiod, active mode, orig_taz-1, dest_taz-1) float32 numpy array, with NaN for missing values.
+    Timeperiods are in TIMEPERIODS order and active modes in ACTIVE_MODES order.
+
+    Reads ACTIVE_SKIMS_CACHE if it's up to date and otherwise (re)writes it from the csvs.
+    """
+    skim_files = [os.path.join("database", "ActiveTimeSkimsDatabase%s.csv" % time_period) for time_period in TIMEPERIODS]
+    if os.path.exists(ACTIVE_SKIMS_CACHE) and \
+       os.path.getmtime(ACTIVE_SKIMS_CACHE) >= max([os.path.getmtime(skim_file) for skim_file in skim_files]):
+        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), ACTIVE_SKIMS_CACHE)
+        return numpy.load(ACTIVE_SKIMS_CACHE, mmap_mode='r')
+
+    temp_file = ACTIVE_SKIMS_CACHE + ".tmp"
+    skims     = None
+    for time_period_code, skim_file in enumerate(skim_files):
+        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), skim_file)
+        skim_df = pandas.read_table(skim_file, sep=",", usecols=['orig','dest']+ACTIVE_MODES)
+
+        if skims is None:
+            num_zones = max(skim_df['orig'].max(), skim_df['dest'].max())
+            # open_memmap writes the npy header so the file can be loaded directly
+            skims = numpy.lib.format.open_memmap(temp_file, mode='w+', dtype=numpy.float32,
+                                                 shape=(len(TIMEPERIODS), len(ACTIVE_MODES), num_zones, num_zones))
+            skims[:] = numpy.nan
+        assert(max(skim_df['orig'].max(), skim_df['dest'].max()) <= num_zones)
+
+        orig = skim_df['orig'].values - 1
+        dest = skim_df['dest'].values - 1
+        for active_mode_code, active_mode in enumerate(ACTIVE_MODES):
+            skims[time_period_code, active_mode_code, orig, dest] = skim_df[active_mode].values
+
+    skims.flush()
+    del skims
+    if os.path.exists(ACTIVE_SKIMS_CACHE): os.remove(ACTIVE_SKIMS_CACHE)
+    os.rename(temp_file, ACTIVE_SKIMS_CACHE)
+    print "%s Wrote %s" % (datetime.datetime.now().strftime("%x %X"), ACTIVE_SKIMS_CACHE)
+    return numpy.load(ACTIVE_SKIMS_CACHE, mmap_mode='r')
+
+def count_active_minutes(trips_df, active_skims):
     """
     For update on morbidity calculation:
-    Calculates the number of adults (18+ year olds) that have more than ACTIVE_MINUTES_THRESHOLD
-    minutes of active travel per day and returns it.
+    Looks up the minutes of active travel for the adult (18+ year old) trips in trips_df in the active_skims
+    returned by read_active_time_skims().
 
-    Reads database\ActiveTimeSkimsDatabase[timeperiod].csv
+    Returns (number of adult trips, active_counts_df), where active_counts_df is the num_participants,
+    num_trips and active_minutes of the adult trips with active minutes, summed by hh_id, person_id.
     """
     # active adult trips -- filter out youths and driving trips
     active_adult_trips_df = trips_df.loc[trips_df['age']>=18,
-                            ['hh_id','person_id','age','orig_taz','dest_taz','trip_mode_str','time_period','num_participants']].copy()
-
-    # map modes to simplified mode for skim
-    active_adult_trips_df.loc[:,'active_mode'] = active_adult_trips_df['trip_mode_str']
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_loc_wlk', 'active_mode'] = 'wTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_lrf_wlk', 'active_mode'] = 'wTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_exp_wlk', 'active_mode'] = 'wTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_hvy_wlk', 'active_mode'] = 'wTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_com_wlk', 'active_mode'] = 'wTrnW'
-
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='drv_loc_wlk', 'active_mode'] = 'dTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='drv_lrf_wlk', 'active_mode'] = 'dTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='drv_exp_wlk', 'active_mode'] = 'dTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='drv_hvy_wlk', 'active_mode'] = 'dTrnW'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='drv_com_wlk', 'active_mode'] = 'dTrnW'
-
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_loc_drv', 'active_mode'] = 'wTrnD'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_lrf_drv', 'active_mode'] = 'wTrnD'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_exp_drv', 'active_mode'] = 'wTrnD'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_hvy_drv', 'active_mode'] = 'wTrnD'
-    active_adult_trips_df.loc[active_adult_trips_df['trip_mode_str']=='wlk_com_drv', 'active_mode'] = 'wTrnD'
-
-    active_adult_trips_df.loc[:,'active_minutes'] = 0.0
-
-    # print active_adult_trips_df['active_mode'].value_counts()
-    # print active_adult_trips_df['time_period'].value_counts()
+                            ['hh_id','person_id','orig_taz','dest_taz','trip_mode_str','time_period','num_participants']].copy()
+
+    # map modes to simplified mode for skim; other modes have no active time
+    active_adult_trips_df['active_mode'] = pandas.Categorical(
+        active_adult_trips_df['trip_mode_str'].map(TRIP_MODE_TO_ACTIVE_MODE), categories=ACTIVE_MODES)
+
     active_adult_trips_df_len = len(active_adult_trips_df)
+    active_minutes            = numpy.zeros(active_adult_trips_df_len)
+    active_mode_codes         = active_adult_trips_df['active_mode'].cat.codes.values
+
+    # figure out how many minutes of activity per trip: look them up in the activeTimeSkims
+    # by time period, active mode, origin and destination
+    num_zones    = active_skims.shape[2]
+    orig         = active_adult_trips_df['orig_taz'].values.astype(numpy.int64) - 1
+    dest         = active_adult_trips_df['dest_taz'].values.astype(numpy.int64) - 1
+    trip_rows    = numpy.flatnonzero((active_mode_codes >= 0) & (orig >= 0) & (orig < num_zones) & (dest >= 0) & (dest < num_zones))
+    minutes      = active_skims[active_adult_trips_df['time_period'].cat.codes.values[trip_rows],
+                                active_mode_codes[trip_rows], orig[trip_rows], dest[trip_rows]]
+    active_minutes[trip_rows] = numpy.where(numpy.isnan(minutes), 0.0, minutes)
+    active_adult_trips_df['active_minutes'] = active_minutes
 
-    # figure out how many minutes of activity per trip: join with activeTimeSkims
-    for time_period in ['EA','AM','MD','PM','EV']:
-        filename = os.path.join("database", "ActiveTimeSkimsDatabase%s.csv" % time_period)
-        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), filename)
-        skim_df  = pandas.read_table(filename, sep=",")
-        skim_df.loc[:, 'time_period'] = time_period
-
-        for active_mode in ['walk','bike','wTrnW','dTrnW','wTrnD']:
-            # get the skim for this mode
-            skim_tp_df = skim_df.loc[:,['orig','dest','time_period',active_mode]]
-            skim_tp_df.loc[:,'active_mode']=active_mode
-            skim_tp_df.rename(columns={'orig':'orig_taz','dest':'dest_taz'}, inplace=True)
-
-            # join it, adding active_mode-named column
-            active_adult_trips_df = pandas.merge(left    =active_adult_trips_df,
-                                                 right   =skim_tp_df,
-                                                 on      =['orig_taz','dest_taz','time_period','active_mode'],
-                                                 how     ='left')
-            # set those minutes
-            active_adult_trips_df.loc[active_adult_trips_df[active_mode].notnull(), 'active_minutes'] = active_adult_trips_df[active_mode]
-            # drop the new column
-            active_adult_trips_df.drop(active_mode, axis=1, inplace=True)
-
-    # make sure we didn't lose anyone
-    assert(active_adult_trips_df_len == len(active_adult_trips_df))
     # keep only the successful joins
     active_adult_trips_df = active_adult_trips_df.loc[active_adult_trips_df['active_minutes']>0]
-    # see how many trips had failed joins
-    percent_fail = 100.0*len(active_adult_trips_df)/active_adult_trips_df_len
-    print "%s Have %d valid active times out of %d, or %.2f%% join successes" % \
-      (datetime.datetime.now().strftime("%x %X"),
-       len(active_adult_trips_df),
-       active_adult_trips_df_len,
-       percent_fail)
 
     # each row is 1 trip
     active_adult_trips_df['num_trips'] = 1
     # count active minutes for people
     active_counts_df = active_adult_trips_df[['hh_id','person_id','num_participants','num_trips','active_minutes']]\
-        .groupby(['hh_id','person_id'])\
-        .agg({'num_participants':numpy.mean, 'num_trips':numpy.sum, 'active_minutes':numpy.sum})
+        .groupby(['hh_id','person_id']).sum()
+    return (active_adult_trips_df_len, active_counts_df)
+
+def find_number_of_active_adults(active_counts_df, num_adult_trips):
+    """
+    For update on morbidity calculation:
+    Given the sum of the active_counts_df from count_active_minutes() over all the trips, and the total number of
+    adult trips, calculates the number of adults (18+ year olds) that have more than ACTIVE_MINUTES_THRESHOLD
+    minutes of active travel per day and returns it.
+    """
+    # see how many trips had failed joins
+    num_active_trips = active_counts_df['num_trips'].sum()
+    percent_fail = 100.0*num_active_trips/num_adult_trips
+    print "%s Have %d valid active times out of %d, or %.2f%% join successes" % \
+      (datetime.datetime.now().strftime("%x %X"),
+       num_active_trips,
+       num_adult_trips,
+       percent_fail)
+
+    # num_participants is per trip
+    active_counts_df = active_counts_df.copy()
+    active_counts_df['num_participants'] = active_counts_df['num_participants']/active_counts_df['num_trips']
     print active_counts_df.describe()
 
     # filter to just active persons (above ACTIVE_MINUTES_THRESHOLD)
@@ -148,43 +327,47 @@ def find_number_of_active_adults(trips_df):
     print active_counts_df.describe()
     return active_counts_df['num_participants'].sum()
 
-def write_trips_by_od(trips_df, by_income_cat, outsuffix):
+def count_trips_by_od(trips_df, by_income_cat):
     """
-    Groups up the trip list by time_period, income_cat (if by_income_cat=true), orig_taz, dest_taz, trip_mode_str
-    And then unstacks so the trip_mode_str form columns.
+    Returns the num_participants of the trip list summed by time_period code, income_cat (if by_income_cat=true),
+    orig_taz, dest_taz and trip_mode_str code, as a Series.  Chunks are combined with add_grouped_sums().
+    """
+    # group on the category codes of time_period and trip_mode_str -- they're small ints
+    trip_counts = collections.OrderedDict()
+    trip_counts['time_period'] = trips_df['time_period'].cat.codes.values
+    if by_income_cat:
+        trip_counts['income_cat'] = trips_df['income_cat'].values
+    trip_counts['orig_taz'        ] = trips_df['orig_taz'].values
+    trip_counts['dest_taz'        ] = trips_df['dest_taz'].values
+    trip_counts['trip_mode_str'   ] = trips_df['trip_mode_str'].cat.codes.values
+    trip_counts['num_participants'] = trips_df['num_participants'].values
+    trip_counts = pandas.DataFrame(trip_counts)
+
+    return trip_counts.groupby(list(trip_counts.columns[:-1]))['num_participants'].sum()
+
+def write_trips_by_od(trip_counts, by_income_cat, outsuffix):
+    """
+    Given the trip counts from count_trips_by_od(), unstacks them so the trip_mode_str form columns.
     Writes it out to main \ trips[timeperiod]inc[1-4][outsuffix].dat (inc part dropped if by_income_cat=false)
     """
-    income_list = []
     if by_income_cat:
-        # group it and then unstack to index = time_period, income_cat, orig_taz, dest_taz, trip_mode_str
-        trip_counts = trips_df[['time_period','income_cat','orig_taz','dest_taz','trip_mode_str','num_participants']].groupby(['time_period','income_cat','orig_taz','dest_taz','trip_mode_str']).sum()
-        trip_counts = trip_counts.unstack().fillna(0)
         income_list = range(1,5)
     else:
-        trip_counts = trips_df[['time_period',             'orig_taz','dest_taz','trip_mode_str','num_participants']].groupby(['time_period',             'orig_taz','dest_taz','trip_mode_str']).sum()
-        trip_counts = trip_counts.unstack().fillna(0)
         income_list = [0]
 
-    for timeperiod in ['EA','AM','MD','PM','EV']:
+    # unstack to index = time_period, [income_cat,] orig_taz, dest_taz and columns = trip_mode_str
+    trip_counts = trip_counts.unstack()
+    # some modes may not be here; put them in
+    trip_counts = trip_counts.reindex(columns=range(len(TRIP_MODES))).fillna(0)
+    trip_counts.columns = TRIP_MODES
+
+    for timeperiod in TIMEPERIODS:
         for income_cat in income_list:
 
             # select the specific ones
-            trip_counts_tpinc = trip_counts.loc[timeperiod, income_cat] if by_income_cat else trip_counts.loc[timeperiod]
-            trip_counts_tpinc.reset_index(inplace=True)
-            # rename columns which we can't do with rename() I guess, because we have multiindex columns
-            cols     = trip_counts_tpinc.columns.tolist()
-            new_cols = []
-            for col in cols:
-                if   col == ('orig_taz',''): new_cols.append( ('orig_taz','orig_taz'))
-                elif col == ('dest_taz',''): new_cols.append( ('dest_taz','dest_taz'))
-                else: new_cols.append(col)
-            trip_counts_tpinc.columns = pandas.MultiIndex.from_tuples(new_cols)
-            trip_counts_tpinc.columns = trip_counts_tpinc.columns.droplevel()
-
-            # some modes may not be here; put it in
-            for col in COLUMNS[2:]:
-                if col not in trip_counts_tpinc.columns.tolist():
-                    trip_counts_tpinc[col] = 0
+            timeperiod_code   = TIMEPERIODS.index(timeperiod)
+            trip_counts_tpinc = trip_counts.loc[(timeperiod_code, income_cat)] if by_income_cat else trip_counts.loc[timeperiod_code]
+            trip_counts_tpinc = trip_counts_tpinc.reset_index()
 
             trip_counts_tpinc = trip_counts_tpinc[COLUMNS]
             trip_counts_tpinc = trip_counts_tpinc.astype(int)
@@ -204,104 +387,11 @@ if __name__ == '__main__':
     sampleshare   = float(os.environ['SAMPLESHARE'])
     # (mode,time period,income,orig,dest) -> count
 
-    trips_df = None
-    for trip_type in ['indiv', 'joint']:
-        filename = os.path.join("main", "%sTripDataIncome_%d.csv" % (trip_type, iteration))
-        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), filename)
-        temp_trips_df = pandas.read_table(filename, sep=",")
-        print "%s Done reading %d %s trips" % (datetime.datetime.now().strftime("%x %X"), len(temp_trips_df), trip_type)
-
-        if trip_type == 'indiv':
-            # each row is a trip; scale by sampleshare
-            temp_trips_df['num_participants'] = 1.0/sampleshare
-
-            trips_df = temp_trips_df
-        else:
-            # scale by sample share
-            temp_trips_df['num_participants'] = temp_trips_df['num_participants']/sampleshare
-            trips_df = pandas.concat([trips_df, temp_trips_df], axis=0)
-
-    print "%s Read %d lines total" % (datetime.datetime.now().strftime("%x %X"), len(trips_df))
-    # print trips_df.head()
-
-    # set time period
-    trips_df['time_period'] = "unknown"
-    trips_df.loc[(trips_df['depart_hour']>= 3)&(trips_df['depart_hour']< 6), 'time_period'] = 'EA'
-    trips_df.loc[(trips_df['depart_hour']>= 6)&(trips_df['depart_hour']<10), 'time_period'] = 'AM'
-    trips_df.loc[(trips_df['depart_hour']>=10)&(trips_df['depart_hour']<15), 'time_period'] = 'MD'
-    trips_df.loc[(trips_df['depart_hour']>=15)&(trips_df['depart_hour']<19), 'time_period'] = 'PM'
-    trips_df.loc[(trips_df['depart_hour']>=19)|(trips_df['depart_hour']< 3), 'time_period'] = 'EV'
-    assert(len(trips_df.loc[trips_df['time_period']=="unknown"])==0)
-
-    # set mode string
-    trips_df['trip_mode_str'] = "unknown"
-    trips_df.loc[(trips_df['trip_mode']== 1)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'da'
-    trips_df.loc[(trips_df['trip_mode']== 2)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'da_toll'
-    trips_df.loc[(trips_df['trip_mode']== 3)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'sr2'
-    trips_df.loc[(trips_df['trip_mode']== 4)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'sr2_toll'
-    trips_df.loc[(trips_df['trip_mode']== 5)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'sr3'
-    trips_df.loc[(trips_df['trip_mode']== 6)&(trips_df['avAvailable']==0), 'trip_mode_str'] = 'sr3_toll'
-    trips_df.loc[(trips_df['trip_mode']== 7), 'trip_mode_str'] = 'walk'
-    trips_df.loc[(trips_df['trip_mode']== 8), 'trip_mode_str'] = 'bike'
-    trips_df.loc[(trips_df['trip_mode']== 9), 'trip_mode_str'] = 'wlk_loc_wlk'
-    trips_df.loc[(trips_df['trip_mode']==10), 'trip_mode_str'] = 'wlk_lrf_wlk'
-    trips_df.loc[(trips_df['trip_mode']==11), 'trip_mode_str'] = 'wlk_exp_wlk'
-    trips_df.loc[(trips_df['trip_mode']==12), 'trip_mode_str'] = 'wlk_hvy_wlk'
-    trips_df.loc[(trips_df['trip_mode']==13), 'trip_mode_str'] = 'wlk_com_wlk'
-
-    trips_df.loc[(trips_df['trip_mode']==14)&(trips_df['inbound']==0), 'trip_mode_str'] = 'drv_loc_wlk'
-    trips_df.loc[(trips_df['trip_mode']==15)&(trips_df['inbound']==0), 'trip_mode_str'] = 'drv_lrf_wlk'
-    trips_df.loc[(trips_df['trip_mode']==16)&(trips_df['inbound']==0), 'trip_mode_str'] = 'drv_exp_wlk'
-    trips_df.loc[(trips_df['trip_mode']==17)&(trips_df['inbound']==0), 'trip_mode_str'] = 'drv_hvy_wlk'
-    trips_df.loc[(trips_df['trip_mode']==18)&(trips_df['inbound']==0), 'trip_mode_str'] = 'drv_com_wlk'
-
-    trips_df.loc[(trips_df['trip_mode']==14)&(trips_df['inbound']==1), 'trip_mode_str'] = 'wlk_loc_drv'
-    trips_df.loc[(trips_df['trip_mode']==15)&(trips_df['inbound']==1), 'trip_mode_str'] = 'wlk_lrf_drv'
-    trips_df.loc[(trips_df['trip_mode']==16)&(trips_df['inbound']==1), 'trip_mode_str'] = 'wlk_exp_drv'
-    trips_df.loc[(trips_df['trip_mode']==17)&(trips_df['inbound']==1), 'trip_mode_str'] = 'wlk_hvy_drv'
-    trips_df.loc[(trips_df['trip_mode']==18)&(trips_df['inbound']==1), 'trip_mode_str'] = 'wlk_com_drv'
-
-    trips_df.loc[(trips_df['trip_mode']==19), 'trip_mode_str'] = 'taxi'
-    trips_df.loc[(trips_df['trip_mode']==20), 'trip_mode_str'] = 'tnc'
-    trips_df.loc[(trips_df['trip_mode']==21), 'trip_mode_str'] = 'tnc_shared'
-
-    trips_df.loc[(trips_df['trip_mode']== 1)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'da_av_notoll'
-    trips_df.loc[(trips_df['trip_mode']== 2)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'da_av_toll'
-    trips_df.loc[(trips_df['trip_mode']== 3)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'sr2_av_notoll'
-    trips_df.loc[(trips_df['trip_mode']== 4)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'sr2_av_toll'
-    trips_df.loc[(trips_df['trip_mode']== 5)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'sr3_av_notoll'
-    trips_df.loc[(trips_df['trip_mode']== 6)&(trips_df['avAvailable']==1), 'trip_mode_str'] = 'sr3_av_toll'
-
-    assert(len(trips_df.loc[trips_df['trip_mode_str']=="unknown"])==0)
-
-    # set income category
-    trips_df['income_cat'] = 0
-    trips_df.loc[                             (trips_df['income']< 30000), 'income_cat'] = 1
-    trips_df.loc[(trips_df['income']>= 30000)&(trips_df['income']< 60000), 'income_cat'] = 2
-    trips_df.loc[(trips_df['income']>= 60000)&(trips_df['income']<100000), 'income_cat'] = 3
-    trips_df.loc[(trips_df['income']>=100000)                            , 'income_cat'] = 4
-    assert(len(trips_df.loc[trips_df['income_cat']==0])==0)
-
-    # write it
-    write_trips_by_od(trips_df, by_income_cat=True, outsuffix="")
-
-    # Doing active transportation - drop auto
-    trips_df = trips_df.loc[trips_df.trip_mode >= 7]
-    print "%s Filtered to non-auto trips, of which there are %d" % (datetime.datetime.now().strftime("%x %X"), len(trips_df))
-
-    # Joint trips don't have person_ids -- remove them and fill them from joint tours
-    joint_trips_df = trips_df.loc[trips_df['person_id'].isnull()]
-    trips_df       = trips_df.loc[trips_df['person_id'].notnull()]
-    num_joint_trips= joint_trips_df['num_participants'].sum()
-    print "%s => %d indiv trips, %d joint trip rows making %d joint trips" % \
-        (datetime.datetime.now().strftime("%x %X"), len(trips_df), len(joint_trips_df), num_joint_trips)
-
     # Read joint tours to get person ids for the joint trips
     joint_tours   = pandas.read_table(os.path.join("main", "jointTourData_%d.csv" % iteration),
                                       sep=",", index_col=False)
     joint_tours   = joint_tours[['hh_id','tour_id','tour_participants']]
     joint_tours['num_participants'] = (joint_tours.tour_participants.str.count(' ') + 1.0)/sampleshare
-    joint_tour_participants = joint_tours.num_participants.sum()
     # Split joint tours by space and give each its own row
     s           = joint_tours['tour_participants'].str.split(' ').apply(pandas.Series, 1).stack()
     s.index     = s.index.droplevel(-1)
@@ -309,73 +399,117 @@ if __name__ == '__main__':
     s           = s.astype(int)  # no strings
     joint_tours = joint_tours.join(s)
 
-    joint_trips_df.drop('person_num', axis=1, inplace=True) # this will come from tours
-    joint_trips_df = pandas.merge(left      = joint_trips_df,
-                                  right     = joint_tours,
-                                  how       = 'left',
-                                  left_on   = ['hh_id','tour_id','num_participants'],
-                                  right_on  = ['hh_id','tour_id','num_participants'])
-    # now each row is a single person-trip
-    joint_trips_df['num_participants'] = 1.0/sampleshare
-    # check the number of rows matches the number of joint trips we expect
-    assert(joint_trips_df['num_participants'].sum() == num_joint_trips)
-
-    # put it back together
-    trips_df = pandas.concat([trips_df, joint_trips_df], axis=0)
-    print "%s => %d total trips" % (datetime.datetime.now().strftime("%x %X"), len(trips_df))
-
-    # join trips to persons for ages
-    trips_df.drop('person_id', axis=1, inplace=True) # this will come from hh_id, person_num and persons table
+    # Read persons for ages
     filename = os.path.join("main", "personData_%d.csv" % iteration)
     print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), filename)
-    persons_df = pandas.read_table(filename, sep=",")
+    persons_df = pandas.read_csv(filename, sep=",", usecols=list(PERSON_DTYPES.keys()), dtype=PERSON_DTYPES)
     print "%s Done reading %d persons" % (datetime.datetime.now().strftime("%x %X"), len(persons_df))
-    trips_df = pandas.merge(left=trips_df,
-                            right=persons_df[['hh_id','person_num','person_id','age']],
-                            how="left",
-                            left_on=['hh_id','person_num'],
-                            right_on=['hh_id','person_num'])
+
+    active_skims = read_active_time_skims()
+
+    # everything is summed up chunk by chunk
+    trip_counts      = None
+    trip_counts_2074 = None
+    trip_counts_2064 = None
+    active_counts_df = None
+    num_trips        = collections.Counter()
+    travelers        = {'walkers_2074'  : numpy.array([]),
+                        'transiters_2074': numpy.array([]),
+                        'cyclists_2064' : numpy.array([])}
+
+    for (trip_type, trips_df) in read_trips(iteration, sampleshare):
+        num_trips['total'] += len(trips_df)
+
+        trip_counts = add_grouped_sums(trip_counts, count_trips_by_od(trips_df, by_income_cat=True))
+
+        # Doing active transportation - drop auto
+        trips_df = trips_df.loc[trips_df.trip_mode >= 7]
+        num_trips['non-auto'] += len(trips_df)
+
+        if trip_type == 'joint':
+            # Joint trips don't have person_ids -- fill them from joint tours
+            num_joint_trips = trips_df['num_participants'].sum()
+            num_trips['joint rows'] += len(trips_df)
+            num_trips['joint'     ] += num_joint_trips
+
+            trips_df = trips_df.drop(['person_id','person_num'], axis=1, errors='ignore') # this will come from tours
+            trips_df = pandas.merge(left      = trips_df,
+                                    right     = joint_tours,
+                                    how       = 'left',
+                                    left_on   = ['hh_id','tour_id','num_participants'],
+                                    right_on  = ['hh_id','tour_id','num_participants'])
+            # now each row is a single person-trip
+            trips_df['num_participants'] = 1.0/sampleshare
+            # check the number of rows matches the number of joint trips we expect
+            assert(trips_df['num_participants'].sum() == num_joint_trips)
+            num_trips['joint person'] += len(trips_df)
+        else:
+            num_trips['indiv'] += len(trips_df)
+            trips_df = trips_df.drop('person_id', axis=1) # this will come from hh_id, person_num and persons table
+
+        # join trips to persons for ages
+        trips_df = pandas.merge(left=trips_df,
+                                right=persons_df,
+                                how="left",
+                                left_on=['hh_id','person_num'],
+                                right_on=['hh_id','person_num'])
+
+        (num_adult_trips, chunk_active_counts_df) = count_active_minutes(trips_df, active_skims)
+        num_trips['adult'] += num_adult_trips
+        active_counts_df = add_grouped_sums(active_counts_df, chunk_active_counts_df)
+
+        # filter to 20-74 year olds for walking
+        trips_df = trips_df.loc[(trips_df['age']>=20)&(trips_df['age']<=74)]
+        num_trips['2074'] += len(trips_df)
+        trip_counts_2074 = add_grouped_sums(trip_counts_2074, count_trips_by_od(trips_df, by_income_cat=False))
+
+        # unique persons who walk, who transit
+        travelers['walkers_2074'   ] = add_unique(travelers['walkers_2074'   ], trips_df.loc[trips_df['trip_mode_str']=='walk', 'person_id'])
+        travelers['transiters_2074'] = add_unique(travelers['transiters_2074'], trips_df.loc[trips_df['trip_mode']>=9, 'person_id'])
+
+        # filter to 20-64 year olds for biking
+        trips_df = trips_df.loc[(trips_df['age']>=20)&(trips_df['age']<=64)]
+        num_trips['2064'] += len(trips_df)
+        trip_counts_2064 = add_grouped_sums(trip_counts_2064, count_trips_by_od(trips_df, by_income_cat=False))
+
+        # unique persons who bike
+        travelers['cyclists_2064'] = add_unique(travelers['cyclists_2064'], trips_df.loc[trips_df['trip_mode_str']=='bike', 'person_id'])
+
+    print "%s Read %d lines total" % (datetime.datetime.now().strftime("%x %X"), num_trips['total'])
+
+    # write it
+    write_trips_by_od(trip_counts, by_income_cat=True, outsuffix="")
+
+    print "%s Filtered to non-auto trips, of which there are %d" % (datetime.datetime.now().strftime("%x %X"), num_trips['non-auto'])
+    print "%s => %d indiv trips, %d joint trip rows making %d joint trips" % \
+        (datetime.datetime.now().strftime("%x %X"), num_trips['indiv'], num_trips['joint rows'], num_trips['joint'])
+    print "%s => %d total trips" % (datetime.datetime.now().strftime("%x %X"), num_trips['indiv'] + num_trips['joint person'])
 
     travelers_dict = {}
 
-    travelers_dict['number_active_adults'] = find_number_of_active_adults(trips_df)
+    travelers_dict['number_active_adults'] = find_number_of_active_adults(active_counts_df, num_trips['adult'])
 
-    # filter to 20-74 year olds for walking
-    trips_df = trips_df.loc[(trips_df['age']>=20)&(trips_df['age']<=74)]
     print "%s Filtered to %d trips between 20-74 year olds" % \
-        (datetime.datetime.now().strftime("%x %X"), len(trips_df))
+        (datetime.datetime.now().strftime("%x %X"), num_trips['2074'])
 
     # write it
-    write_trips_by_od(trips_df, by_income_cat=False, outsuffix="_2074")
-
+    write_trips_by_od(trip_counts_2074, by_income_cat=False, outsuffix="_2074")
 
-    # unique persons who walk
-    walking_2074 = trips_df.loc[trips_df['trip_mode_str']=='walk']
-    walking_2074 = walking_2074[['person_id']].drop_duplicates()
-    travelers_dict['unique_walkers_2074'] = len(walking_2074)/sampleshare
+    travelers_dict['unique_walkers_2074'] = len(travelers['walkers_2074'])/sampleshare
     print "%s => made by %d unique individuals walking" % \
         (datetime.datetime.now().strftime("%x %X"), travelers_dict['unique_walkers_2074'])
 
-    # unique persons who transit
-    transit_2074 = trips_df.loc[trips_df['trip_mode']>=9]
-    transit_2074 = transit_2074[['person_id']].drop_duplicates()
-    travelers_dict['unique_transiters_2074'] = len(transit_2074)/sampleshare
+    travelers_dict['unique_transiters_2074'] = len(travelers['transiters_2074'])/sampleshare
     print "%s => made by %d unique individuals taking transit" % \
         (datetime.datetime.now().strftime("%x %X"), travelers_dict['unique_transiters_2074'])
 
-    # filter to 20-64 year olds for biking
-    trips_df = trips_df.loc[(trips_df['age']>=20)&(trips_df['age']<=64)]
     print "%s Filtered to %d trips between 20-64 year olds" % \
-        (datetime.datetime.now().strftime("%x %X"), len(trips_df))
+        (datetime.datetime.now().strftime("%x %X"), num_trips['2064'])
 
     # write it
-    write_trips_by_od(trips_df, by_income_cat=False, outsuffix="_2064")
+    write_trips_by_od(trip_counts_2064, by_income_cat=False, outsuffix="_2064")
 
-    # unique persons who bike
-    biking_2064 = trips_df.loc[(trips_df['trip_mode_str']=='bike')]
-    biking_2064[['trip_mode_str']].describe()
-    biking_2064 = biking_2064[['person_id']].drop_duplicates()
-    travelers_dict['unique_cyclists_2064'] = len(biking_2064)/sampleshare
+    travelers_dict['unique_cyclists_2064'] = len(travelers['cyclists_2064'])/sampleshare
     print "%s => made by %d unique individuals biking" % \
         (datetime.datetime.now().strftime("%x %X"), travelers_dict['unique_cyclists_2064'])
 
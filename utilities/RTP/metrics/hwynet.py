@@ -1,8 +1,11 @@
-import argparse, itertools, optparse, os, sys
+import argparse, optparse, os, sys
 import numpy, pandas
 
+import linkmapping, loadednet
+
 USAGE = """
-  python hwynet.py --filter filter --year 2035 hwy\\iter3\\avgload5period_vehclasses.csv [--link_mapping links_mapping.csv indexcol sharecol output_suffix]
+  python hwynet.py --filter filter --year 2035 hwy\\iter3\\avgload5period_vehclasses.csv [--link_mapping links_mapping.csv indexcol sharecol output_suffix]*
+  python hwynet.py --lookup_variants PBA50:2035,PBA50:2050,... hwy\\iter3\\avgload5period_vehclasses.csv
 
  Reads the csv file of links from hwynet.csv and reports a number of
  metrics into metrics/vmt_vht_metrics by timeperiod and vehicle class.
@@ -44,11 +47,19 @@ USAGE = """
   * PM10_wear
   * PM2.5_wear
 
+  With --lookup_variants, the lookups for each filter:year variant are evaluated against the same loaded network
+  together and written in long format (filter, year, timeperiod, vehicle class, metric, value) to
+  metrics\\vmt_vht_metrics_variants.csv instead.  --link_mapping isn't supported in this mode.
+
   If optional --link_mapping parameters are specified (--link_mapping links_mapping.csv indexcol sharecol output_suffix), then
   links_mapping.csv is read and columns [A,B,(indexcol),(sharecol)] are read and assumed to cover all the links.
   The per-link metric values are then joined to this dataframe by A,B and multiplied by sharecol and aggregated by indexcol.
   The script will then output the additional file, metrics\\vmt_vht_metrics(output_suffix).csv
 
+  --link_mapping may be specified more than once (e.g. for TAZ, county and superdistrict) to output a file for each.
+  Each mapping is compiled into a sparse link x index allocation matrix and cached next to links_mapping.csv as
+  links_mapping.csv.(indexcol).(sharecol).npz; see linkmapping.py.
+
   This file additionally has two more columns:
   * road_type: 'freeway' for facility type (ft) in [1,2,3,8], 'non-freeway' otherwise
   * area_type: 'urban' for area type (at) <= 3, 'suburban' for area type == 4, 'rural' for area type == 5
@@ -75,17 +86,87 @@ USAGE = """
 pandas.options.display.width = 1000
 pandas.options.display.max_columns = 100
 
+def dense_lookup(lookup_df, key_cols, value_cols):
+    """
+    Compiles lookup_df into a dense numpy array so it can be looked up by integer-indexed gathers.
+
+    Returns (key_indexes, table) where key_indexes is a list with a pandas.Index of the key values for each of
+    the key_cols and table is indexed by [position in key_indexes[0], position in key_indexes[1], ..., value col].
+    Key combinations not in the lookup are NaN, as are positions of -1 (from Index.get_indexer() for values
+    not in the lookup), which hit a trailing slot.
+    """
+    key_indexes = [pandas.Index(sorted(lookup_df[key_col].unique())) for key_col in key_cols]
+    positions   = tuple(key_index.get_indexer(lookup_df[key_col]) for (key_index, key_col) in zip(key_indexes, key_cols))
+    assert(not lookup_df.duplicated(subset=key_cols).any())
+
+    table = numpy.full([len(key_index)+1 for key_index in key_indexes] + [len(value_cols)], numpy.nan)
+    table[positions] = lookup_df[value_cols].values
+    return (key_indexes, table)
+
+def vcratio_hundredths(vcratio):
+    """
+    Returns the given array of vcratios in [0,1] as integer hundredths, rounded the way '{:,.2f}'.format() rounds them.
+    """
+    # the smallest float that rounds up to each hundredth is the midpoint below it or the next float after that
+    midpoints  = (numpy.arange(100)*2 + 1)/200.0
+    thresholds = numpy.array([midpoint if float('{:,.2f}'.format(midpoint)) > midpoint else numpy.nextafter(midpoint, 1.0)
+                              for midpoint in midpoints])
+    return numpy.searchsorted(thresholds, vcratio, side='right')
+
+def select_variants(lookup_df, variants):
+    """
+    Returns the rows of lookup_df for the given list of (filter, year) variants, with the filter and year columns
+    replaced by variant, the position of the variant in the list, and the list of variants with no rows.
+    """
+    variants_df = pandas.DataFrame({'filter' :[variant[0] for variant in variants],
+                                    'year'   :[variant[1] for variant in variants],
+                                    'variant':numpy.arange(len(variants))})
+    lookup_df = pandas.merge(left=lookup_df, right=variants_df, how='inner', on=['filter','year'])
+    lookup_df.drop(columns=['filter','year'], inplace=True)
+    missing   = [variant for (variant_num, variant) in enumerate(variants) if variant_num not in lookup_df['variant'].values]
+    return (lookup_df, missing)
+
+def sum_by_cell(values, cell, num_cells):
+    """
+    Returns the given (timeperiod, vclass, link) values summed by cell as a (timeperiod, vclass, cell) array,
+    where cell is a (link) or (timeperiod, link) array of cell numbers in [0, num_cells).
+    """
+    (num_periods, num_vclasses, num_links) = values.shape
+    cell = numpy.broadcast_to(cell, (num_periods, num_links))[:,numpy.newaxis,:]
+    bins = numpy.arange(num_periods*num_vclasses).reshape(num_periods, num_vclasses, 1)*num_cells + cell
+    return numpy.bincount(bins.reshape(-1), weights=values.reshape(-1),
+                          minlength=num_periods*num_vclasses*num_cells).reshape(num_periods, num_vclasses, num_cells)
+
+def lookup_variants(variants):
+    """
+    Parses a comma-separated list of filter:year lookup variants into a list of (filter, year).
+    """
+    return [(variant.rsplit(":", 1)[0], int(variant.rsplit(":", 1)[1])) for variant in variants.split(",")]
+
 parser = argparse.ArgumentParser(description=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter,)
-parser.add_argument("--filter", metavar="lookup_filter", help="Filter keyword for lookup files", required=True)
-parser.add_argument("--year",   metavar="year", help="Filter keyword for lookup files", required=True, type=int)
+parser.add_argument("--filter", metavar="lookup_filter", help="Filter keyword for lookup files")
+parser.add_argument("--year",   metavar="year", help="Filter keyword for lookup files", type=int)
+parser.add_argument("--lookup_variants", metavar="filter:year,filter:year,...", type=lookup_variants,
+                    help="Instead of --filter and --year, evaluate all of these lookup variants and write them to metrics\\vmt_vht_metrics_variants.csv")
 parser.add_argument("net_csv",  metavar="avgload5period_vehclasses.csv", help="Loaded network export with vehicle classes")
-parser.add_argument("--link_mapping", metavar="link_mapping",  nargs=4,
-                    help="Optional mapping csv to summarize by another index. Four args are: links_mapping.csv indexcol sharecol output_suffix")
+parser.add_argument("--link_mapping", metavar="link_mapping",  nargs=4, action="append", default=[],
+                    help="Optional mapping csv to summarize by another index. Four args are: links_mapping.csv indexcol sharecol output_suffix. May be repeated.")
 
 args = parser.parse_args()
+if args.lookup_variants:
+  if args.filter or args.year: parser.error("--lookup_variants replaces --filter and --year")
+  if args.link_mapping:        parser.error("--link_mapping isn't supported with --lookup_variants")
+  variants = args.lookup_variants
+elif args.filter and args.year:
+  variants = [(args.filter, args.year)]
+else:
+  parser.error("--filter and --year (or --lookup_variants) are required")
+variants_str = ", ".join(["{} {}".format(variant[0], variant[1]) for variant in variants])
+
 datafile            = args.net_csv
 lookupdir           = os.path.join( "INPUT","metrics" )
 vmt_vht_outputfile  = os.path.join("metrics", "vmt_vht_metrics.csv")
+variants_outputfile = os.path.join("metrics", "vmt_vht_metrics_variants.csv")
 vclasses            = ['DA',  'S2',  'S3', 'SM', 'HV',
                        'DAT', 'S2T', 'S3T','SMT','HVT',
                        'DAAV','S2AV','S3AV']
@@ -98,87 +179,38 @@ vclassgroup         = {'DA':'auto',  'DAT':'auto', 'DAAV':'auto', # use for emis
 periods             = ['EA','AM','MD','PM','EV']
 
 # Read the link data
-link_df = pandas.read_csv(datafile)
+link_df = loadednet.read_loaded_network(datafile)
 num_links = len(link_df)
-print("Read {} links from {}".format(num_links, datafile))
-id_fields    = ['a','b']
-fields       = ['distance','lanes','at','ft','fft']
-
-link_mapping_df = pandas.DataFrame()
-if args.link_mapping:
-  link_mapping_df = pandas.read_csv(args.link_mapping[0])
-  # keep A,B,[indexcol],[sharecol]
-  link_mapping_df = link_mapping_df[[ 'A','B',args.link_mapping[1], args.link_mapping[2] ]]
-  # rename A,B to a,b
-  link_mapping_df.rename(columns={'A':'a','B':'b'}, inplace=True)
-  print("link_mapping_df read from {}; head:\n{}".format(args.link_mapping[0], link_mapping_df.head()))
-  print("link_mapping_df.{}.sum()={}".format(args.link_mapping[2], link_mapping_df[args.link_mapping[2]].sum()))
-
-# first, unstack timeperiod fields - so instead of xxEA, xxAM, xxMD, etc, we have xx with timeperiod as a column
-# so this will be link_df x 5
-link_tp_df = pandas.DataFrame()
-for tp_field in ['cspd{}','vol{}_tot','vc{}','ctim{}']:
-    tp_field_list = list(tp_field.format(tp) for tp in periods)
-    tp_field_df   = pandas.DataFrame({'timeperiod':periods, 'variable':tp_field_list})
-
-    # this will result in columns variable (with values xxEA etc) and value
-    melted_df = pandas.melt(link_df, id_vars=id_fields, value_vars=tp_field_list)
-    # add timeperiod field and rename value to tp_field without '{}', drop variable col
-    melted_df = pandas.merge(how='left', left=melted_df, right=tp_field_df)
-    melted_df.rename(columns={'value':tp_field.replace('{}','')}, inplace=True)
-    melted_df.drop(columns=['variable'], inplace=True)
-    # now we have id_fields, xx, timeperiod -- join up
-    if len(link_tp_df) == 0:
-        link_tp_df = melted_df
-    else:
-        link_tp_df = pandas.merge(left=link_tp_df, right=melted_df, how='left')
-
-# add in other link-specific non-id fields
-link_tp_df = pandas.merge(how='left', left=link_tp_df, right=link_df[id_fields + fields], on=id_fields)
-print("Melted to timeperiods to create link_tp_df: {} rows".format(len(link_tp_df)))
-print(link_tp_df.head())
-assert(len(link_tp_df) == len(periods)*num_links)
-
-# unstack so that timeperiods and vehicle classes are a column
-# first create a variable name decoder DF with timeperiod, vclass, variable
-timeperiod_list  = []
-vclass_list      = []
-tp_vc_field_list = []
-for x in itertools.product(periods, vclasses):
-    timeperiod_list.append(x[0])
-    vclass_list.append(x[1].lower())
-    tp_vc_field_list.append('vol{}_{}'.format(x[0],x[1].lower()))
-
-tp_vc_field_df = pandas.DataFrame({'timeperiod':timeperiod_list, 'vclass':vclass_list, 'variable':tp_vc_field_list})
-
-# do the melt and join with our decoder
-link_tp_vehclass_df = pandas.melt(link_df, id_vars=id_fields, value_vars=tp_vc_field_list)
-link_tp_vehclass_df = pandas.merge(how='left', left=link_tp_vehclass_df, right=tp_vc_field_df)
-link_tp_vehclass_df = link_tp_vehclass_df.rename(columns={'value':'vol'}).drop(columns='variable')
-print("Melted to timeperiods x vehclasses to createlink_tp_vehclass_df: {} rows".format(len(link_tp_vehclass_df)))
-print(link_tp_vehclass_df.head())
-assert(len(link_tp_vehclass_df) == len(vclasses)*len(periods)*num_links)
+
+# hold the link attributes as (link) arrays, the link x timeperiod attributes as (timeperiod, link) arrays
+# and the volumes as (timeperiod, vclass, link) arrays
+distance = link_df['distance'].values.astype(numpy.float64)
+fft      = link_df['fft'     ].values.astype(numpy.float64)
+lanes    = link_df['lanes'   ].values
+ft       = link_df['ft'      ].values
+at       = link_df['at'      ].values
+(cspd, vc, ctim) = [link_df[[tp_field.format(tp) for tp in periods]].values.T.astype(numpy.float64)
+                    for tp_field in ['cspd{}','vc{}','ctim{}']]
+vol      = loadednet.vehclass_volumes(link_df, timeperiods=periods, vehclasses=[vclass.lower() for vclass in vclasses])
+print("Created link x timeperiod x vehclass arrays: {}".format(vol.shape))
 
 # units: Hours delay per VMT
 # Map headers -> index for this lookup and read lookup data
 nrc_file = os.path.join(lookupdir,"nonRecurringDelayLookup.csv")
 nrclookup_df = pandas.read_csv(nrc_file)
-# filter by given filter
-nrclookup_df = nrclookup_df.loc[ (nrclookup_df['filter'] == args.filter)&
-                                 (nrclookup_df['year']   == args.year  ) ].copy()
-nrclookup_df['vcratio'] = nrclookup_df['vcratio'].map('{:,.2f}'.format) # convert to string with two decimals
+# filter by given filters
+(nrclookup_df, missing) = select_variants(nrclookup_df, variants)
+nrclookup_df['vcratio'] = numpy.rint(nrclookup_df['vcratio']*100).astype(numpy.int64) # convert to hundredths
 
-if len(nrclookup_df) == 0:
-  print("No nonRecurringDelay lookups for {} found".format(args.filter))
+if len(missing) > 0:
+  print("No nonRecurringDelay lookups for {} found".format(missing))
   sys.exit(2)
-nrclookup_df.drop(columns=['filter','year'],inplace=True)
 
-# transform so columns are: vcratio (str), lanes_24(int), nrcdelay (float)
-nrclookup_df.set_index('vcratio',inplace=True)
+# transform so columns are: variant, vcratio (hundredths), lanes_24(int), nrcdelay (float)
+nrclookup_df.set_index(['variant','vcratio'],inplace=True)
 nrclookup_df.rename(columns={'2lanes':2, '3lanes':3, '4lanes':4}, inplace=True)
-nrclookup_df = nrclookup_df.stack().reset_index().rename(columns={'level_1':'lanes_24',0:'nrcdelay'})
-print(nrclookup_df.head())
-print("Read {} and filtered by {} and year {} to create nrclookup_df:\n{}".format(nrc_file, args.filter, args.year, nrclookup_df.head()))
+nrclookup_df = nrclookup_df.stack().reset_index().rename(columns={'level_2':'lanes_24',0:'nrcdelay'})
+print("Read {} and filtered by {} to create nrclookup_df:\n{}".format(nrc_file, variants_str, nrclookup_df.head()))
 
 # Units are collisions per 1,000,000 VMT
 # Map headers -> index for this lokup and read lookup data
@@ -189,14 +221,12 @@ collision_types.remove('ft')
 collision_types.remove('at')
 collision_types.remove('filter')
 collision_types.remove('year')
-# filter by given filter
-collisionlookup_df = collisionlookup_df.loc[ (collisionlookup_df['filter'] == args.filter)&
-                                             (collisionlookup_df['year'  ] == args.year  ) ].copy()
-if len(collisionlookup_df) == 0:
-  print("No collisions lookups for {} found".format(args.filter))
+# filter by given filters
+(collisionlookup_df, missing) = select_variants(collisionlookup_df, variants)
+if len(missing) > 0:
+  print("No collisions lookups for {} found".format(missing))
   sys.exit(2)
-collisionlookup_df.drop(columns=['filter','year'],inplace=True)
-print("Read {} and filtered by {} and year {} to create collisionlookup_df:\n{}".format(collision_file, args.filter, args.year, collisionlookup_df.head()))
+print("Read {} and filtered by {} to create collisionlookup_df:\n{}".format(collision_file, variants_str, collisionlookup_df.head()))
 
 # Units are grams per mile (equivalent to metric tons per 1,000,000 VMT)
 emission_file = os.path.join(lookupdir,"emissionsLookup.csv")
@@ -211,187 +241,201 @@ else:
   emission_types.remove('speed')
   emission_types.remove('filter')
   emission_types.remove('year')
-  # filter by given filter
-  emissionslookup_df = emissionslookup_df.loc[ (emissionslookup_df['filter'] == args.filter)&
-                                               (emissionslookup_df['year'  ] == args.year  ) ].copy()
-  if len(emissionslookup_df) == 0:
-    print("No emission lookups for {} found".format(args.filter))
+  # filter by given filters; emissions are skipped unless there are lookups for every variant
+  (emissionslookup_df, missing) = select_variants(emissionslookup_df, variants)
+  if len(missing) > 0:
+    print("No emission lookups for {} found".format(missing))
+    emissionslookup_df = pandas.DataFrame()
   else:
-    emissionslookup_df.drop(columns=['filter','year'],inplace=True)
-    print("Read {} and filtered by {} and year {} to create emissionslookup_df:\n{}".format(emission_file, args.filter, args.year, emissionslookup_df.head()))
+    print("Read {} and filtered by {} to create emissionslookup_df:\n{}".format(emission_file, variants_str, emissionslookup_df.head()))
 
-# Add link x timeperiod columns
+# Look up link x timeperiod attributes
 
 # lanes_24 is lanes but capped in [2,4]
-link_tp_df['lanes_24'] = link_tp_df['lanes']
-link_tp_df.loc[ link_tp_df.lanes_24 < 2, 'lanes_24' ] = 2
-link_tp_df.loc[ link_tp_df.lanes_24 > 4, 'lanes_24' ] = 4
-
-# vcratio is used to lookup non-recurring delay; string version, capped at 1
-link_tp_df['vcratio'] = link_tp_df['vc']                         # start with VC
-link_tp_df.loc[ link_tp_df.vcratio > 1.0, 'vcratio' ] = 1.0      # cap it at 1.0
-link_tp_df['vcratio'] = link_tp_df['vcratio'].map('{:,.2f}'.format) # convert to string with two decimals
-
-# join to get non recurring delay per vmt lookup
-link_tp_df = pandas.merge(left    = link_tp_df,
-                          right   = nrclookup_df,
-                          on      = ['vcratio', 'lanes_24']).rename(columns={'nrcdelay':'nrcdelay_pervmt'})
-print("a link_tp_df len {}:\n{}".format(len(link_tp_df), link_tp_df.head()))
-assert(len(link_tp_df) == len(periods)*num_links)
+lanes_24 = numpy.clip(lanes, 2, 4)
 
-# for collision lookup
-link_tp_df['collision_ft'] = link_tp_df['ft']
-link_tp_df.loc[ link_tp_df.ft == 1,          'collision_ft'] =  2 # Freeway-to-freeway connector is like a freeway
-link_tp_df.loc[ link_tp_df.ft == 8,          'collision_ft'] =  2 # managed freeway is like a freeway
-link_tp_df.loc[ link_tp_df.ft == 6,          'collision_ft'] = -1 # skip dummy links
-link_tp_df.loc[ link_tp_df.lanes <= 0,       'collision_ft'] = -1 # or those with lanes <= 0
-link_tp_df.loc[ link_tp_df.collision_ft > 4, 'collision_ft'] = 4 # cap at 4
-
-link_tp_df['collision_at'] = link_tp_df['at']
-link_tp_df.loc[ link_tp_df.collision_at < 4, 'collision_at' ]  = 4 # min cap at 4
-
-link_tp_df = pandas.merge(how='left', left=link_tp_df, 
-                          right=collisionlookup_df.rename(columns={'ft':'collision_ft','at':'collision_at'}), 
-                          on=['collision_ft','collision_at'])
-print("b link_tp_df len {}:\n{}".format(len(link_tp_df), link_tp_df.head()))
-assert(len(link_tp_df) == len(periods)*num_links)
-
-# for emission lookup
-link_tp_df["speed"] = link_tp_df['cspd'].apply(numpy.int64)
-link_tp_df.loc[ link_tp_df.speed > 65, "speed"] = 65 # cap at 65
-
-# Transfer link x timeperiod attributes to link x timeperiod x vehicle class
-link_tp_vehclass_df = pandas.merge(left=link_tp_vehclass_df, right=link_tp_df, how='left', on=id_fields+['timeperiod'])
-
-# calculate VMT, VHT and Hypothetical FreeFlow Time
-link_tp_vehclass_df['vmt'   ] = link_tp_vehclass_df['vol'] * link_tp_vehclass_df['distance']
-link_tp_vehclass_df['vht'   ] = link_tp_vehclass_df['vol'] * link_tp_vehclass_df['ctim'] / 60.0
-link_tp_vehclass_df['hypfft'] = link_tp_vehclass_df['vol'] * link_tp_vehclass_df['fft' ] / 60.0
-
-# for this, we only care about ft=1 or ft=2 or ft==8 (freeway-to-freeway connectors, freeways, managed freeways)
-# http://analytics.mtc.ca.gov/foswiki/Main/MasterNetworkLookupTables
-link_tp_vehclass_df['nrcdelay'] = link_tp_vehclass_df['nrcdelay_pervmt']*link_tp_vehclass_df['vmt']
-# so zero out non-freeway
-link_tp_vehclass_df.loc[ ~link_tp_vehclass_df.ft.isin([1,2,8]), 'nrcdelay'] = 0.0
-print("c link_tp_vehclass_df len {}:\n{}".format(len(link_tp_vehclass_df), link_tp_vehclass_df.head()))
+# vcratio is used to lookup non-recurring delay; capped at 1, in hundredths
+vcratio = vcratio_hundredths(numpy.minimum(vc, 1.0))
 
-# collisionlookup in collisions per 1000000 VMT
-for collision_type in collision_types:
-    link_tp_vehclass_df[collision_type] = link_tp_vehclass_df[collision_type]*link_tp_vehclass_df['vmt']
+# non recurring delay per vmt lookup => positions in nrc_table for (timeperiod, link), (link)
+(nrc_keys, nrc_table) = dense_lookup(nrclookup_df, ['variant','vcratio','lanes_24'], ['nrcdelay'])
+nrc_vcratio = nrc_keys[1].get_indexer(vcratio.reshape(-1)).reshape(vcratio.shape)
+nrc_lanes   = nrc_keys[2].get_indexer(lanes_24)
+assert(not numpy.isnan(nrc_table[:len(variants), nrc_vcratio, nrc_lanes]).any())
 
-# join to vehicle class group and then emission lookup
-vclassgroup_df = pandas.DataFrame.from_dict(vclassgroup, orient='index', columns=['vclassgroup'])
-vclassgroup_df = vclassgroup_df.reset_index(drop=False).rename(columns={'index':'vclass'})
-vclassgroup_df['vclass'] = vclassgroup_df['vclass'].str.lower()
+# for collision lookup
+collision_ft = numpy.where(numpy.isin(ft, [1,8]), 2, ft)                 # Freeway-to-freeway connector, managed freeway are like a freeway
+collision_ft = numpy.where((ft == 6)|(lanes <= 0), -1, collision_ft)     # skip dummy links or those with lanes <= 0
+collision_ft = numpy.where(collision_ft > 4, 4, collision_ft)            # cap at 4
+collision_at = numpy.maximum(at, 4)                                      # min cap at 4
 
-link_tp_vehclass_df = pandas.merge(how='left', left=link_tp_vehclass_df, right=vclassgroup_df)
-null_vclassgroup = link_tp_vehclass_df.loc[ pandas.isna(link_tp_vehclass_df.vclassgroup) ]
-assert(len(null_vclassgroup) == 0)
+# collisions per 1000000 VMT lookup => positions in collision_table for (link), (link)
+(collision_keys, collision_table) = dense_lookup(collisionlookup_df, ['variant','ft','at'], collision_types)
+collision_ft = collision_keys[1].get_indexer(collision_ft)
+collision_at = collision_keys[2].get_indexer(collision_at)
 
+# for emission lookup => positions in emission_table for (timeperiod), (vclass), (timeperiod, link)
 if len(emissionslookup_df)>0:
-    link_tp_vehclass_df = pandas.merge(how='left', left=link_tp_vehclass_df,
-                                       right=emissionslookup_df.rename(columns={'period':'timeperiod'}))
-    # verify merging with lookup didn't change the number of links/vclass/periods
-    assert(len(link_tp_vehclass_df) == len(vclasses)*len(periods)*num_links)
+    speed = numpy.minimum(cspd.astype(numpy.int64), 65) # cap at 65
+    (emission_keys, emission_table) = dense_lookup(emissionslookup_df, ['variant','period','vclassgroup','speed'], emission_types)
+    emission_period = emission_keys[1].get_indexer(periods)
+    emission_group  = emission_keys[2].get_indexer([vclassgroup[vclass] for vclass in vclasses])
+    emission_speed  = emission_keys[3].get_indexer(speed.reshape(-1)).reshape(speed.shape)
 
-    # emissionlookup in grams per mile (equivalent to metric tons per 1000000 VMT)
-    for emission_type in emission_types:
-        link_tp_vehclass_df[emission_type] = link_tp_vehclass_df[emission_type]*link_tp_vehclass_df['vmt']
-
-print("d link_tp_vehclass_df len {}:\n{}".format(len(link_tp_vehclass_df), link_tp_vehclass_df.head()))
+# for this, we only care about ft=1 or ft=2 or ft==8 (freeway-to-freeway connectors, freeways, managed freeways)
+# http://analytics.mtc.ca.gov/foswiki/Main/MasterNetworkLookupTables
+freeway = numpy.isin(ft, [1,2,8])
+
+def link_metrics(variant):
+    """
+    Yields (metric, values) for each metric for the given lookup variant, where values is a (timeperiod, vclass, link)
+    array with NaN for links missing from the lookup.  Collisions and emissions are per 1000000 VMT.
+    """
+    # calculate VMT, VHT and Hypothetical FreeFlow Time
+    vmt = vol * distance
+    yield ('vmt',    vmt)
+    yield ('vht',    vol * ctim[:,numpy.newaxis,:] / 60.0)
+    yield ('hypfft', vol * fft / 60.0)
+    # so zero out non-freeway
+    nrcdelay_pervmt = nrc_table[variant, nrc_vcratio, nrc_lanes, 0]
+    yield ('nrcdelay', numpy.where(freeway, nrcdelay_pervmt[:,numpy.newaxis,:]*vmt, 0.0))
+
+    # collisionlookup in collisions per 1000000 VMT
+    collision_rates = collision_table[variant, collision_ft, collision_at]
+    for (collision_num, collision_type) in enumerate(collision_types):
+        yield (collision_type, vmt * collision_rates[:,collision_num])
 
-aggregate_dict = {'vmt'     :'sum',
-                  'vht'     :'sum',
-                  'hypfft'  :'sum',
-                  'nrcdelay':'sum'}
-for collision_type in collision_types: aggregate_dict[collision_type] = 'sum'
+    # emissionlookup in grams per mile (equivalent to metric tons per 1000000 VMT)
+    if len(emissionslookup_df)>0:
+        for (emission_num, emission_type) in enumerate(emission_types):
+            yield (emission_type, vmt * emission_table[variant, emission_period[:,numpy.newaxis,numpy.newaxis],
+                                                                emission_group[numpy.newaxis,:,numpy.newaxis],
+                                                                emission_speed[:,numpy.newaxis,:], emission_num])
+
+def variant_metrics():
+    """
+    Returns the metrics for all of the lookup variants as a (variant, timeperiod, vclass, metric) array,
+    in the order of the metric columns of the output.  Collisions and emissions are per 1000000 VMT.
+
+    Rather than looking up rates for each link, the VMT is summed by the lookup cell each link falls into
+    (vcratio x lanes_24 for freeways, ft x at, and speed), so all the variants are evaluated together by
+    multiplying those sums by the lookup tables.
+    """
+    num_variants = len(variants)
+    vmt = vol * distance
+    metrics = [numpy.nansum(vmt, axis=2),
+               numpy.nansum(vol * ctim[:,numpy.newaxis,:] / 60.0, axis=2),
+               numpy.nansum(vol * fft / 60.0, axis=2)]
+    metrics = [numpy.broadcast_to(metric[numpy.newaxis,:,:,numpy.newaxis], (num_variants,) + metric.shape + (1,)) for metric in metrics]
+
+    # non recurring delay, for freeways only
+    (num_vcratios, num_lanes) = nrc_table.shape[1:3]
+    vmt_by_cell = sum_by_cell(numpy.where(freeway, vmt, 0.0), nrc_vcratio*num_lanes + nrc_lanes, num_vcratios*num_lanes)
+    nrc_rates   = nrc_table[:num_variants].reshape(num_variants, num_vcratios*num_lanes)
+    metrics.append(numpy.einsum('pvc,kc->kpv', vmt_by_cell, numpy.nan_to_num(nrc_rates))[:,:,:,numpy.newaxis])
+
+    # missing lookups (positions -1 => the trailing NaN slot) add nothing
+    (num_fts, num_ats) = collision_table.shape[1:3]
+    vmt_by_cell     = sum_by_cell(vmt, numpy.mod(collision_ft, num_fts)*num_ats + numpy.mod(collision_at, num_ats), num_fts*num_ats)
+    collision_rates = collision_table[:num_variants].reshape(num_variants, num_fts*num_ats, len(collision_types))
+    metrics.append(numpy.einsum('pvc,kct->kpvt', vmt_by_cell, numpy.nan_to_num(collision_rates))/1000000.0)
+
+    if len(emissionslookup_df)>0:
+        num_speeds     = emission_table.shape[3]
+        vmt_by_cell    = sum_by_cell(vmt, numpy.mod(emission_speed, num_speeds), num_speeds)
+        emission_rates = emission_table[:num_variants][:, emission_period[:,numpy.newaxis], emission_group[numpy.newaxis,:]]
+        metrics.append(numpy.einsum('pvs,kpvse->kpve', vmt_by_cell, numpy.nan_to_num(emission_rates))/1000000.0)
+
+    return numpy.concatenate(metrics, axis=3)
+
+vclass_list = [vclass.lower() for vclass in vclasses]
+metric_cols = ["VMT","VHT","Hypothetical Freeflow Time", "Non-Recurring Freeway Delay"]+collision_types
 if len(emissionslookup_df)>0:
-    for emission_type  in emission_types:  aggregate_dict[emission_type]  = 'sum'
-
-# aggregate to timeperiod x vclass
-metrics_df = link_tp_vehclass_df.groupby(['timeperiod','vclass']).aggregate(aggregate_dict).reset_index()
-
-# create version with link mapping (e.g. link to TAZ)
-link_tp_vehclass_mapped_df = pandas.DataFrame()
-metrics_mapped_df          = pandas.DataFrame()
-if args.link_mapping:
-  link_tp_vehclass_mapped_df = link_tp_vehclass_df.merge(link_mapping_df, on=['a','b'], how='outer', indicator=True)
-  print("Merged with link_mapping_df to create link_tp_vehclass_mapped_df with {} rows; head:\n{}".format(
-        len(link_tp_vehclass_mapped_df), link_tp_vehclass_mapped_df.head(20)))
-
-  # for aggregating, we'll want to multiply each variable by the share
+  metric_cols = metric_cols + emission_types
+
+# write all the lookup variants in long format: filter, year, timeperiod, vehicle class, metric, value
+if args.lookup_variants:
+  variant_metrics_df = pandas.Series(variant_metrics().reshape(-1), name='value',
+                                     index=pandas.MultiIndex.from_product([range(len(variants)), periods, vclass_list, metric_cols],
+                                                                          names=['variant','timeperiod','vehicle class','metric'])).reset_index()
+  variant_metrics_df = variant_metrics_df.sort_values(['variant','timeperiod','vehicle class'], kind='mergesort')
+  variant_metrics_df['filter'] = [variants[variant][0] for variant in variant_metrics_df['variant']]
+  variant_metrics_df['year'  ] = [variants[variant][1] for variant in variant_metrics_df['variant']]
+  variant_metrics_df[['filter','year','timeperiod','vehicle class','metric','value']].to_csv(variants_outputfile, header=True, index=False)
+  print("Wrote {} for {}".format(variants_outputfile, variants_str))
+  sys.exit(0)
+
+# metrics are timeperiod x vclass
+metrics_df  = pandas.DataFrame({'timeperiod':numpy.repeat(periods, len(vclasses)),
+                                'vclass'    :numpy.tile(vclass_list, len(periods))},
+                               columns=['timeperiod','vclass'])
+
+# create versions with link mappings (e.g. link to TAZ)
+# additional groupby columns
+# facility types: https://github.com/BayAreaMetro/modeling-website/wiki/MasterNetworkLookupTables#facility-type-ft
+link_df['road_type'] = numpy.where(numpy.isin(ft, [1,2,3,8]), 'freeway', 'non-freeway')
+# area types: https://github.com/BayAreaMetro/modeling-website/wiki/MasterNetworkLookupTables#area-type-at
+link_df['area_type'] = numpy.select([at <= 3, at == 4, at == 5], ['urban','suburban','rural'], 'unset')
+
+# list of (link_mapping args, allocation, metrics_mapped_df)
+link_mappings = []
+for link_mapping in args.link_mapping:
+  # for aggregating, each variable is multiplied by the share
   # so if a link is mapped to two indices, with 0.5 in one and 0.5 in the other
   # then the metrics will be split that way as well
-  share_col = args.link_mapping[2]
-  for metric_name in aggregate_dict.keys():
-    print("  - multiplying {} by share col {}".format(metric_name, share_col))
-    link_tp_vehclass_mapped_df[metric_name] = link_tp_vehclass_mapped_df[metric_name]*link_tp_vehclass_mapped_df[share_col]
-
-  index_col = args.link_mapping[1]
-  # set missing index_col value to -1
-  link_tp_vehclass_mapped_df.fillna(value={index_col:-1}, inplace=True)
-
-  # additional groupby columns
-  # facility types: https://github.com/BayAreaMetro/modeling-website/wiki/MasterNetworkLookupTables#facility-type-ft
-  link_tp_vehclass_mapped_df['road_type'] = 'non-freeway'
-  link_tp_vehclass_mapped_df.loc[ link_tp_vehclass_mapped_df['ft'].isin([1,2,3,8]), 'road_type'] = 'freeway'
-  # area types: https://github.com/BayAreaMetro/modeling-website/wiki/MasterNetworkLookupTables#area-type-at
-  link_tp_vehclass_mapped_df['area_type'] = 'unset'
-  # note DataFrame.at is a function so can't refer to it that way
-  link_tp_vehclass_mapped_df.loc[ link_tp_vehclass_mapped_df['at'] <= 3, 'area_type'] = 'urban'
-  link_tp_vehclass_mapped_df.loc[ link_tp_vehclass_mapped_df['at'] == 4, 'area_type'] = 'suburban'
-  link_tp_vehclass_mapped_df.loc[ link_tp_vehclass_mapped_df['at'] == 5, 'area_type'] = 'rural'
-
-  # and aggregate to timeperiod x vclass x road_type x area_type x indexcol
-  metrics_mapped_df = link_tp_vehclass_mapped_df.groupby(['timeperiod','vclass','road_type','area_type',index_col]).aggregate(aggregate_dict).reset_index()
-  print("  - aggregated to timeperiod, vclass, road_type, area_type, {}; head:\n{}".format(index_col, metrics_mapped_df.head(10)))
+  (groups_df, allocation) = linkmapping.read_link_mapping(link_mapping[0], link_mapping[1], link_mapping[2], link_df,
+                                                          link_group_cols=['road_type','area_type'])
+
+  # aggregate to timeperiod x vclass x road_type x area_type x indexcol
+  metrics_mapped_df = pandas.DataFrame({'timeperiod':numpy.repeat(periods, len(vclasses)*len(groups_df)),
+                                        'vclass'    :numpy.tile(numpy.repeat(vclass_list, len(groups_df)), len(periods))},
+                                       columns=['timeperiod','vclass'])
+  for group_col in groups_df.columns:
+    metrics_mapped_df[group_col] = numpy.tile(groups_df[group_col].values, len(periods)*len(vclasses))
+  link_mappings.append( (link_mapping, allocation, metrics_mapped_df) )
+
+for (metric, values) in link_metrics(0):
+  # aggregate to timeperiod x vclass
+  metrics_df[metric] = numpy.nansum(values, axis=2).reshape(-1)
+
+  for (link_mapping, allocation, metrics_mapped_df) in link_mappings:
+    metrics_mapped_df[metric] = linkmapping.project_links(values, allocation).reshape(-1)
+
+metrics_df = metrics_df.sort_values(['timeperiod','vclass']).reset_index(drop=True)
+metrics_mapped_dfs = []
+for (link_mapping, allocation, metrics_mapped_df) in link_mappings:
+  metrics_mapped_df = metrics_mapped_df.sort_values(['timeperiod','vclass','road_type','area_type',link_mapping[1]]).reset_index(drop=True)
+  print("Aggregated to timeperiod, vclass, road_type, area_type, {}; head:\n{}".format(link_mapping[1], metrics_mapped_df.head(10)))
+  metrics_mapped_dfs.append(metrics_mapped_df)
 
 # collisionlookup in collisions per 1000000 VMT
-for collision_type in collision_types: 
-    metrics_df[collision_type] = metrics_df[collision_type]/1000000.0
+# emissionlookup in grams per mile (equivalent to metric tons per 1000000 VMT)
+per_million_vmt = list(collision_types)
+if len(emissionslookup_df)>0: per_million_vmt += emission_types
 
-    # ditto for mapped
-    if len(metrics_mapped_df)>0: metrics_mapped_df[collision_type] = metrics_mapped_df[collision_type]/1000000.0
+for metrics in [metrics_df] + metrics_mapped_dfs:
+  for metric in per_million_vmt:
+    metrics[metric] = metrics[metric]/1000000.0
 
-# emissionlookup in grams per mile (equivalent to metric tons per 1000000 VMT)
-if len(emissionslookup_df)>0:
-    for emission_type in emission_types:
-        metrics_df[emission_type] = metrics_df[emission_type]/1000000.0
-
-        # ditto for mapped
-        if len(metrics_mapped_df)>0: metrics_mapped_df[emission_type] = metrics_mapped_df[emission_type]/1000000.0
-  
-# print(metrics_df.head())
-metrics_df.rename(columns={'vclass':'vehicle class',
-                           'vmt':'VMT',
-                           'vht':'VHT',
-                           'hypfft':'Hypothetical Freeflow Time',
-                           'nrcdelay':'Non-Recurring Freeway Delay'},
-                  inplace=True)
-# ditto for mapped
-if len(metrics_mapped_df) > 0:
-  metrics_mapped_df.rename(columns={'vclass':'vehicle class',
-                           'vmt':'VMT',
-                           'vht':'VHT',
-                           'hypfft':'Hypothetical Freeflow Time',
-                           'nrcdelay':'Non-Recurring Freeway Delay'},
-                  inplace=True)
-
-output_cols = ["timeperiod","vehicle class","VMT","VHT","Hypothetical Freeflow Time", "Non-Recurring Freeway Delay"]+collision_types
-if len(emissionslookup_df)>0:
-  output_cols = output_cols + emission_types
+  metrics.rename(columns={'vclass':'vehicle class',
+                          'vmt':'VMT',
+                          'vht':'VHT',
+                          'hypfft':'Hypothetical Freeflow Time',
+                          'nrcdelay':'Non-Recurring Freeway Delay'},
+                 inplace=True)
+
+output_cols = ["timeperiod","vehicle class"] + metric_cols
 
 metrics_df[output_cols].to_csv(vmt_vht_outputfile, header=True, index=False)
 print("Wrote {}".format(vmt_vht_outputfile))
 
-# write the mapped version aggregated to its index (e.g. TAZ)
-if len(metrics_mapped_df) > 0:
-  index_col     = args.link_mapping[1]
-  output_suffix = args.link_mapping[3]
-  vmt_vht_outputfile = vmt_vht_outputfile.replace(".csv","{}.csv".format(output_suffix))
+# write the mapped versions aggregated to their index (e.g. TAZ)
+for (link_mapping, metrics_mapped_df) in zip(args.link_mapping, metrics_mapped_dfs):
+  index_col     = link_mapping[1]
+  output_suffix = link_mapping[3]
+  mapped_outputfile = vmt_vht_outputfile.replace(".csv","{}.csv".format(output_suffix))
 
-  output_cols = [index_col, 'road_type', 'area_type'] + output_cols
-  metrics_mapped_df[output_cols].to_csv(vmt_vht_outputfile, header=True, index=False)
-  print("Wrote {}".format(vmt_vht_outputfile))
+  metrics_mapped_df[[index_col, 'road_type', 'area_type'] + output_cols].to_csv(mapped_outputfile, header=True, index=False)
+  print("Wrote {}".format(mapped_outputfile))
 
 sys.exit(0)
@@ -0,0 +1,136 @@
+"""
+  Compiles a link mapping csv with columns A, B, [indexcol], [sharecol] -- e.g. network_links_TAZ.csv as written by
+  utilities\\cube-to-shapefile\\correspond_link_to_TAZ.py, with indexcol TAZ1454 and sharecol linktaz_share -- into an
+  allocation matrix from the links of the loaded network to the groups of the mapping, for the metrics scripts.
+
+  Link-level metrics (arrays with links as the last axis) are then projected to the groups (e.g. TAZs, counties,
+  superdistricts) by a sparse matrix product, with scipy.sparse if it's installed and numpy otherwise.
+
+  The allocation is cached next to the mapping csv, as [mapping csv].[indexcol].[sharecol].npz, and reused unless
+  the mapping csv has been modified since or the links (or their group columns) differ.
+
+  Usage:
+
+    import linkmapping
+    (groups_df, allocation) = linkmapping.read_link_mapping("network_links_TAZ.csv", "TAZ1454", "linktaz_share", link_df)
+    vmt_by_taz              = linkmapping.project_links(vmt, allocation)   # timeperiod x vclass x TAZ
+
+"""
+import collections, os
+import numpy, pandas
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+# one entry per mapping row: link is the position of the link in the network, group is the position in groups_df
+# and share is the share of the link allocated to the group.  matrix is the same as a scipy.sparse (group x link)
+# matrix, if scipy is installed.
+Allocation = collections.namedtuple("Allocation", ["link", "group", "share", "num_links", "num_groups", "matrix"])
+
+def read_link_mapping(mapping_csv, index_col, share_col, link_df, link_group_cols=[]):
+    """
+    Compiles the link mapping in mapping_csv for the links in link_df (with columns a, b and the link_group_cols).
+
+    Links are joined to mapping rows by A,B.  Links missing from the mapping are mapped to index_col -1 with no share,
+    and mapping rows for links not in link_df are dropped.  Rows are grouped by link_group_cols + [index_col].
+
+    Returns (groups_df, allocation) where groups_df has the group columns, sorted, and allocation is an Allocation
+    for project_links().  Reads the cache if it's current; otherwise compiles the mapping and (re)writes the cache.
+    """
+    cache_file  = "{}.{}.{}.npz".format(mapping_csv, index_col, share_col)
+    source_stat = os.stat(mapping_csv)
+    group_cols  = list(link_group_cols) + [index_col]
+    link_arrays = {}
+    for col in ["a","b"] + list(link_group_cols):
+        values = link_df[col].values
+        link_arrays["_link_" + col] = values.astype('U') if values.dtype == object else values
+
+    if os.path.exists(cache_file):
+        try:
+            with numpy.load(cache_file) as cache:
+                if cache["_source_mtime"] == source_stat.st_mtime and cache["_source_size"] == source_stat.st_size and \
+                   [str(col) for col in cache["_group_cols"]] == group_cols and \
+                   all([numpy.array_equal(cache[name], values) for (name, values) in link_arrays.items()]):
+                    groups_df  = pandas.DataFrame(collections.OrderedDict([(col, cache["group_" + col]) for col in group_cols]))
+                    allocation = make_allocation(cache["link"], cache["group"], cache["share"], len(link_df), len(groups_df))
+                    print("Read {} link mapping rows to {} groups from {}".format(len(allocation.link), len(groups_df), cache_file))
+                    return (groups_df, allocation)
+            print("Cache {} is out of date".format(cache_file))
+        except Exception as e:
+            print("Failed to read cache {}: {}".format(cache_file, e))
+
+    mapping_df = pandas.read_csv(mapping_csv, usecols=['A','B',index_col,share_col])
+    mapping_df.rename(columns={'A':'a','B':'b'}, inplace=True)
+    print("Read {} link mapping rows from {}; {}.sum()={}".format(len(mapping_df), mapping_csv, share_col, mapping_df[share_col].sum()))
+
+    rows_df = pandas.DataFrame({'a':link_df['a'].values, 'b':link_df['b'].values, 'link':numpy.arange(len(link_df))})
+    rows_df = rows_df.merge(mapping_df, on=['a','b'], how='outer', indicator=True)
+    print("  {} links missing from the mapping; {} mapping rows for links not in the network".format(
+          (rows_df['_merge']=='left_only').sum(), (rows_df['_merge']=='right_only').sum()))
+    rows_df = rows_df.loc[ rows_df['link'].notnull() ]
+
+    link  = rows_df['link'].values.astype(numpy.int64)
+    share = rows_df[share_col].fillna(0.0).values.astype(numpy.float64)
+    # set missing index_col value to -1
+    rows_df = rows_df.fillna(value={index_col:-1})
+    for col in link_group_cols:
+        rows_df[col] = link_df[col].values[link]
+
+    group     = rows_df.groupby(group_cols).ngroup().values.astype(numpy.int64)
+    groups_df = rows_df.groupby(group_cols).size().reset_index()[group_cols]
+    write_cache(groups_df, link, group, share, link_arrays, source_stat, cache_file)
+    return (groups_df, make_allocation(link, group, share, len(link_df), len(groups_df)))
+
+def make_allocation(link, group, share, num_links, num_groups):
+    """
+    Returns an Allocation for the given mapping row arrays, with the sparse matrix if scipy is installed.
+    """
+    matrix = None
+    if scipy:
+        matrix = scipy.sparse.csr_matrix((share, (group, link)), shape=(num_groups, num_links))
+    return Allocation(link, group, share, num_links, num_groups, matrix)
+
+def write_cache(groups_df, link, group, share, link_arrays, source_stat, cache_file):
+    """
+    Writes the given compiled mapping to the cache_file, noting the mapping csv mtime and size and the links for invalidation.
+    """
+    arrays = {"_group_cols"   : numpy.array([str(col) for col in groups_df.columns], dtype='U'),
+              "_source_mtime" : numpy.array(source_stat.st_mtime),
+              "_source_size"  : numpy.array(source_stat.st_size),
+              "link"          : link,
+              "group"         : group,
+              "share"         : share}
+    arrays.update(link_arrays)
+    for col in groups_df.columns:
+        values = groups_df[col].values
+        arrays["group_" + col] = values.astype('U') if values.dtype == object else values
+
+    try:
+        temp_file = cache_file + ".tmp"
+        with open(temp_file, "wb") as temp:
+            numpy.savez(temp, **arrays)
+        if os.path.exists(cache_file): os.remove(cache_file)
+        os.rename(temp_file, cache_file)
+        print("Wrote {}".format(cache_file))
+    except (IOError, OSError) as e:
+        print("Failed to write cache {}: {}".format(cache_file, e))
+
+def project_links(values, allocation):
+    """
+    Returns the given array with links as the last axis projected to the groups of the allocation,
+    so the last axis is groups.  NaN values are treated as 0.
+    """
+    shape  = values.shape
+    values = values.reshape(-1, shape[-1])
+    values = numpy.where(numpy.isnan(values), 0.0, values)
+
+    if allocation.matrix is not None:
+        projected = allocation.matrix.dot(values.T).T
+    else:
+        # bin for each leading index x mapping row
+        row_bin   = (numpy.arange(len(values))[:,numpy.newaxis]*allocation.num_groups + allocation.group).reshape(-1)
+        projected = numpy.bincount(row_bin, weights=(values[:,allocation.link]*allocation.share).reshape(-1),
+                                   minlength=len(values)*allocation.num_groups)
+    return numpy.asarray(projected).reshape(shape[:-1] + (allocation.num_groups,))
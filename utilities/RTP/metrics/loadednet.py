@@ -0,0 +1,103 @@
+"""
+  Reads the loaded roadway network, hwy\\iter%ITER%\\avgload5period_vehclasses.csv (as written by
+  net2csv_avgload5period.job), for the metrics scripts.
+
+  The csv is wide and slow to parse, so the first read converts it to a typed columnar cache next to it,
+  avgload5period_vehclasses.csv.npz, with one array per column.  Subsequent reads load the cache (or just the
+  columns they need from it) unless the csv has been modified since.
+
+  Usage:
+
+    import loadednet
+    loaded_net_df = loadednet.read_loaded_network(os.path.join("hwy","iter3","avgload5period_vehclasses.csv"))
+    volumes       = loadednet.vehclass_volumes(loaded_net_df)   # timeperiod x vehicle class x link
+
+"""
+import collections, os
+import numpy, pandas
+
+TIMEPERIODS = ['EA','AM','MD','PM','EV']
+VEHCLASSES  = ['da', 's2', 's3', 'sm', 'hv',
+               'dat','s2t','s3t','smt','hvt',
+               'daav','s2av','s3av']
+
+CACHE_SUFFIX = ".npz"
+
+def read_loaded_network(net_csv, columns=None):
+    """
+    Returns the loaded network in net_csv as a pandas DataFrame, with just the given columns if passed.
+    Reads from the columnar cache if it's current; otherwise reads the csv and (re)writes the cache.
+    """
+    cache_file  = net_csv + CACHE_SUFFIX
+    source_stat = os.stat(net_csv)
+
+    if os.path.exists(cache_file):
+        try:
+            with numpy.load(cache_file) as cache:
+                if cache["_source_mtime"] == source_stat.st_mtime and cache["_source_size"] == source_stat.st_size:
+                    loaded_net_df = read_cache(cache, columns)
+                    print("Read {} links from {}".format(len(loaded_net_df), cache_file))
+                    return loaded_net_df
+            print("Cache {} is out of date".format(cache_file))
+        except Exception as e:
+            print("Failed to read cache {}: {}".format(cache_file, e))
+
+    loaded_net_df = pandas.read_csv(net_csv, sep=",", index_col=False)
+    print("Read {} links from {}".format(len(loaded_net_df), net_csv))
+    write_cache(loaded_net_df, source_stat, cache_file)
+
+    if columns: return loaded_net_df[columns]
+    return loaded_net_df
+
+def read_cache(cache, columns=None):
+    """
+    Returns a DataFrame from the given loaded numpy npz cache, with just the given columns if passed.
+    """
+    if columns is None:
+        columns = [str(column) for column in cache["_columns"]]
+
+    column_arrays = collections.OrderedDict()
+    for column in columns:
+        column_array = cache[column]
+        # strings are stored as unicode arrays with a null mask
+        if column_array.dtype.kind == 'U':
+            null = cache["_null_" + column]
+            column_array = column_array.astype(object)
+            column_array[null] = numpy.nan
+        column_arrays[column] = column_array
+    return pandas.DataFrame(column_arrays, columns=columns)
+
+def write_cache(loaded_net_df, source_stat, cache_file):
+    """
+    Writes the given loaded network to the cache_file, noting the source csv mtime and size for invalidation.
+    Numeric columns keep the dtype the csv was parsed to; string columns are stored as unicode arrays.
+    """
+    arrays = {"_columns"     : numpy.array([str(column) for column in loaded_net_df.columns], dtype='U'),
+              "_source_mtime": numpy.array(source_stat.st_mtime),
+              "_source_size" : numpy.array(source_stat.st_size)}
+    for column in loaded_net_df.columns:
+        series = loaded_net_df[column]
+        if series.dtype.kind == "O":  # object, or pandas string dtypes
+            arrays["_null_" + column] = series.isnull().values
+            arrays[column] = series.fillna("").astype(str).values.astype('U')
+        else:
+            arrays[column] = series.values
+
+    try:
+        temp_file = "{}.{}.tmp".format(cache_file, os.getpid())  # per-process, for scripts run in parallel
+        with open(temp_file, "wb") as temp:
+            numpy.savez(temp, **arrays)
+        if os.path.exists(cache_file): os.remove(cache_file)
+        os.rename(temp_file, cache_file)
+        print("Wrote {}".format(cache_file))
+    except (IOError, OSError) as e:
+        print("Failed to write cache {}: {}".format(cache_file, e))
+
+def vehclass_volumes(loaded_net_df, timeperiods=TIMEPERIODS, vehclasses=VEHCLASSES):
+    """
+    Returns a (timeperiod x vehicle class x link) numpy array of the link volumes in the
+    vol[timeperiod]_[vehclass] columns of the given loaded network.
+    """
+    columns = ["vol{}_{}".format(timeperiod, vehclass) for timeperiod in timeperiods for vehclass in vehclasses]
+    volumes = loaded_net_df[columns].values.astype(numpy.float64).T
+    return volumes.reshape(len(timeperiods), len(vehclasses), len(loaded_net_df))
@@ -15,27 +15,8 @@ def read_accessibilities(proj_dir, mandatory, col_prefix, include_output_dir):
     """
     filename = os.path.join(proj_dir, "OUTPUT" if include_output_dir else "", "logsums",
                             "mandatoryAccessibilities.csv" if mandatory else "nonMandatoryAccessibilities.csv")
-    acc_df   = pandas.read_table(filename, sep=",")
-    acc_df.drop('destChoiceAlt', axis=1, inplace=True)
-    acc_df.set_index(['taz','subzone'], inplace=True)
-    # convert the loads of columns to two: variable, value
-    acc_df   = pandas.DataFrame(acc_df.stack())
-    acc_df.reset_index(inplace=True)
-    # split the income/autosufficiency label
-    acc_df['incQ_label']     = acc_df['level_2'].str.split('_',n=1).str.get(0)
-    acc_df['autoSuff_label'] = acc_df['level_2'].str.split('_',n=1).str.get(1)
-    acc_df['hasAV']          = -1
-    acc_df.loc[ acc_df['autoSuff_label'].str.endswith('_noAV'), 'hasAV'] = 0
-    acc_df.loc[ acc_df['autoSuff_label'].str.endswith('_noAV'), 'autoSuff_label'] = acc_df['autoSuff_label'].str[:-5]
-    acc_df.loc[ acc_df['autoSuff_label'].str.endswith('_AV'),   'hasAV'] = 1
-    acc_df.loc[ acc_df['autoSuff_label'].str.endswith('_AV'),   'autoSuff_label'] = acc_df['autoSuff_label'].str[:-3]
-
-    # remove the now extraneous 'level_2'
-    acc_df.drop('level_2', axis=1, inplace=True)
-    acc_df.rename(columns={0:'%s_dclogsum' % col_prefix,
-                           'subzone':'walk_subzone'},
-                  inplace=True)
-    return acc_df
+    # keep columns without an _AV/_noAV suffix whole, with hasAV=-1
+    return RunResults.RunResults.readAccessibilities(filename, col_prefix, av_suffix_only=True)
 
 def read_markets(proj_dir, col_prefix, include_output_dir):
     """
@@ -12,11 +12,34 @@ USAGE = """
 
   Metrics are:
 
+  Also writes accessibility curves and gravity measures by equity segment to metrics\jobacc_curves.csv
+  (see tally_access_to_jobs_curves()).
+
 """
 
 import datetime, os, sys
 import numpy, pandas
 
+TIME_SKIMS       = os.path.join("database", "TimeSkimsDatabaseAM.csv")
+# dense copy of TIME_SKIMS written by read_time_skims()
+TIME_SKIMS_CACHE = os.path.join("database", "TimeSkimsDatabaseAM.npy")
+TIME_SKIM_MODES  = ['da','daToll','wTrnW','bike','walk']
+
+# thresholds (minutes) for the cumulative accessibility curves and decay parameters (per minute)
+# for the negative exponential gravity measures of tally_access_to_jobs_curves()
+CURVE_MINUTES    = range(5, 95, 5)
+GRAVITY_DECAYS   = [0.05, 0.1, 0.2]
+
+# (metric suffix, tazdata column, value) for the equity segments of the accessibility metrics; "" is all TAZs
+EQUITY_SEGMENTS  = [(""         , None    , None      ),
+                    ("_coc"     , "in_coc", 1         ),
+                    ("_noncoc"  , "in_coc", 0         ),
+                    ("_hra"     , "in_hra", 1         ),
+                    ("_nonhra"  , "in_hra", 0         ),
+                    ("_urban"   , "U_S_R" , "urban"   ),
+                    ("_suburban", "U_S_R" , "suburban"),
+                    ("_rural"   , "U_S_R" , "rural"   )]
+
 def tally_travel_cost(iteration, sampleshare, metrics_dict):
     """
     Adds the following keys to metrics_dict:
@@ -58,9 +81,112 @@ def tally_travel_cost(iteration, sampleshare, metrics_dict):
         metrics_dict['total_households_inc%d' % inc_level] = household_df.loc[household_df.income_cat==inc_level, 'num_hhs'].sum()
         metrics_dict['total_hh_inc_inc%d'     % inc_level] = household_df.loc[household_df.income_cat==inc_level, 'income' ].sum()
 
+def read_time_skims():
+    """
+    Returns the time skims in TIME_SKIMS as a memory-mapped (mode, orig_taz-1, dest_taz-1) float32 numpy array,
+    with modes in TIME_SKIM_MODES order and NaN for no-access (-999) and missing O/D pairs.
+
+    Reads TIME_SKIMS_CACHE if it's up to date and otherwise (re)writes it from the csv.
+    """
+    if os.path.exists(TIME_SKIMS_CACHE) and os.path.getmtime(TIME_SKIMS_CACHE) >= os.path.getmtime(TIME_SKIMS):
+        print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), TIME_SKIMS_CACHE)
+        return numpy.load(TIME_SKIMS_CACHE, mmap_mode='r')
+
+    print "%s Reading %s" % (datetime.datetime.now().strftime("%x %X"), TIME_SKIMS)
+    skim_df   = pandas.read_csv(TIME_SKIMS, sep=",", usecols=['orig','dest']+TIME_SKIM_MODES)
+    num_zones = max(skim_df['orig'].max(), skim_df['dest'].max())
+    orig      = skim_df['orig'].values - 1
+    dest      = skim_df['dest'].values - 1
+
+    temp_file = TIME_SKIMS_CACHE + ".tmp"
+    # open_memmap writes the npy header so the file can be loaded directly
+    skims = numpy.lib.format.open_memmap(temp_file, mode='w+', dtype=numpy.float32,
+                                         shape=(len(TIME_SKIM_MODES), num_zones, num_zones))
+    skims[:] = numpy.nan
+    for mode_code, mode in enumerate(TIME_SKIM_MODES):
+        minutes = skim_df[mode].values.astype(numpy.float32)
+        # -999 is really no-access
+        minutes[minutes == -999.0] = numpy.nan
+        skims[mode_code, orig, dest] = minutes
+
+    skims.flush()
+    del skims
+    if os.path.exists(TIME_SKIMS_CACHE): os.remove(TIME_SKIMS_CACHE)
+    os.rename(temp_file, TIME_SKIMS_CACHE)
+    print "%s Wrote %s" % (datetime.datetime.now().strftime("%x %X"), TIME_SKIMS_CACHE)
+    return numpy.load(TIME_SKIMS_CACHE, mmap_mode='r')
+
+def zone_array(tazdata_df, column, num_zones):
+    """
+    Returns the given tazdata_df column as a (taz-1) float64 numpy array, with 0 for TAZs not in tazdata_df.
+    """
+    values = numpy.zeros(num_zones)
+    values[tazdata_df['ZONE'].values - 1] = tazdata_df[column].values
+    return values
+
+def jobs_within(time_skims, measures, jobs):
+    """
+    Returns the jobs accessible from each origin for each of the given measures as a (measure, orig_taz-1) array,
+    where time_skims is returned by read_time_skims() and jobs is a (dest_taz-1) array of jobs.  jobs can also be
+    a (dest_taz-1, n) array, in which case the result is (measure, orig_taz-1, n).
+
+    Each measure is a list of (mode, minutes) conditions, all of which must be met for a destination
+    to be accessible, e.g. [('wTrnW',45),('da',30)] for accessible by both transit and driving.
+    No-access is never within any number of minutes.
+    """
+    num_zones = time_skims.shape[1]
+    within    = numpy.ones((len(measures), num_zones, num_zones), dtype=bool)
+    with numpy.errstate(invalid='ignore'):
+        for measure_num, conditions in enumerate(measures):
+            for (mode, minutes) in conditions:
+                within[measure_num] &= (time_skims[TIME_SKIM_MODES.index(mode)] <= minutes)
+    # one masked matrix-vector product for all the measures
+    accessible = within.reshape(len(measures)*num_zones, num_zones).dot(jobs)
+    return accessible.reshape((len(measures), num_zones) + jobs.shape[1:])
+
+def read_taz_equity_segments(tazdata_df):
+    """
+    Joins the communities of concern (in_coc), high resource areas (in_hra) and urban/suburban/rural categories (U_S_R)
+    to the given tazdata_df and returns it.  TAZs missing from any of these are dropped.
+    """
+    # read communities of concern
+    coc_df = pandas.read_csv(os.path.join("metrics", "CommunitiesOfConcern.csv"), sep=",")
+    tazdata_df = pandas.merge(left=tazdata_df, right=coc_df, left_on="ZONE", right_on="taz")
+    tazdata_df.rename(columns={"in_set":"in_coc"}, inplace=True)
+    print("  Read {} TAZs in communities of concern".format(tazdata_df["in_coc"].sum()))
+
+    # read hra
+    hra_df = pandas.read_csv(os.path.join("INPUT", "metrics", "taz_hra_crosswalk.csv"))
+    hra_df.loc[ pandas.isnull(hra_df["taz_hra"]), "taz_hra"] = 0  # make it 0 or 1
+    hra_df["taz_hra"] = hra_df["taz_hra"].astype(int)
+    print("  Read {} TAZs in HRAs".format(hra_df["taz_hra"].sum()))
+    tazdata_df = pandas.merge(left=tazdata_df, right=hra_df[["taz1454","taz_hra"]], left_on="ZONE", right_on="taz1454")
+    tazdata_df.rename(columns={"taz_hra":"in_hra"}, inplace=True)
+
+    # read urban/suburban categories
+    urban_suburban_df = pandas.read_csv(os.path.join("INPUT","metrics", "taz_urban_suburban.csv"))
+    urban_suburban_df.rename(columns={"area_type":"U_S_R"}, inplace=True)  # Urban Suburban Rural
+    print("  Read urban_suburban_df:\n{}".format(urban_suburban_df["U_S_R"].value_counts()))
+    tazdata_df = pandas.merge(left=tazdata_df, right=urban_suburban_df, left_on="ZONE", right_on="TAZ1454")
+    tazdata_df.drop(columns=["taz","taz1454","TAZ1454"], inplace=True)
+    print("  => tazdata_df head:\n{}".format(tazdata_df.head()))
+    return tazdata_df
+
+def equity_segment_indicators(tazdata_df, num_zones):
+    """
+    Returns a (taz-1, segment) array with 1 for the TAZs in each of the EQUITY_SEGMENTS and 0 otherwise,
+    where tazdata_df is returned by read_taz_equity_segments().
+    """
+    indicators = numpy.zeros((num_zones, len(EQUITY_SEGMENTS)))
+    zone_index = tazdata_df['ZONE'].values - 1
+    for segment_num, (suffix, column, value) in enumerate(EQUITY_SEGMENTS):
+        in_segment = numpy.ones(len(tazdata_df), dtype=bool) if column is None else (tazdata_df[column] == value).values
+        indicators[zone_index[in_segment], segment_num] = 1.0
+    return indicators
+
 def tally_access_to_jobs(iteration, sampleshare, metrics_dict):
     """
-    Reads in database\TimeSkimsDatabaseAM.csv and filters it to O/Ds with
+    Reads in database\TimeSkimsDatabaseAM.csv (see read_time_skims()) and finds the O/Ds with
     da time <= 30 minutes OR wTrnW time <= 45 minutes.
 
     Joining the dest TAZs to jobs, we find the number of jobs accessible from each TAZ
@@ -79,117 +205,38 @@ def tally_access_to_jobs(iteration, sampleshare, metrics_dict):
 
     """
     print "Tallying access to jobs"
-    traveltime_df = pandas.read_csv(os.path.join("database","TimeSkimsDatabaseAM.csv"),
-                                    sep=",")
-    traveltime_df = traveltime_df[['orig','dest','da','wTrnW']]
-    # -999 is really no-access
-    traveltime_df.replace(to_replace=[-999.0], value=[None], inplace=True)
-    len_traveltime_df = len(traveltime_df)
-
-    # look at only those O/D pairs with wTrnW <= 45 OR da <= 30
-    traveltime_df = traveltime_df.loc[(traveltime_df.wTrnW <=45)|(traveltime_df.da <=30)]
-    print "  Out of %d O/D pairs, %d are accessible within 45 min wTrnW or 30 min da" % (len_traveltime_df, len(traveltime_df))
-
-    # separate the three disjoint sets
-    traveltime_df['trn_only'] = 0
-    traveltime_df['drv_only'] = 0
-    traveltime_df['trn_drv' ] = 0
-    traveltime_df.loc[ (traveltime_df.wTrnW <=45)&((traveltime_df.da  >30)|pandas.isnull(traveltime_df.da)), 'trn_only'] = 1
-    traveltime_df.loc[((traveltime_df.wTrnW > 45)|pandas.isnull(traveltime_df.wTrnW))&(traveltime_df.da <=30), 'drv_only'] = 1
-    traveltime_df.loc[ (traveltime_df.wTrnW <=45)&(traveltime_df.da <=30), 'trn_drv' ] = 1
-    assert(traveltime_df.trn_only.sum() + traveltime_df.drv_only.sum() + traveltime_df.trn_drv.sum() == len(traveltime_df))
+    time_skims = read_time_skims()
+    num_zones  = time_skims.shape[1]
 
-    # destinations are jobs => find number of jobs accessible from each TAZ within the travel time windows
     tazdata_df = pandas.read_csv(os.path.join("landuse", "tazData.csv"), sep=",")
     tazdata_df = tazdata_df[['ZONE','TOTHH','TOTPOP','EMPRES','TOTEMP']]
     total_emp  = tazdata_df['TOTEMP'].sum()
     total_pop  = tazdata_df['TOTPOP'].sum()
 
-    traveltime_df = pandas.merge(left=traveltime_df, right=tazdata_df[['ZONE','TOTEMP']],
-                                 left_on="dest",     right_on="ZONE",
-                                 how="left")
-    traveltime_df.drop('ZONE', axis=1, inplace=True)  # ZONE == dest
-    # make these total employment
-    traveltime_df.trn_only = traveltime_df.trn_only*traveltime_df.TOTEMP
-    traveltime_df.drv_only = traveltime_df.drv_only*traveltime_df.TOTEMP
-    traveltime_df.trn_drv  = traveltime_df.trn_drv *traveltime_df.TOTEMP
-    # make these numeric
-    traveltime_df["da"   ] = pandas.to_numeric(traveltime_df["da"   ])
-    traveltime_df["wTrnW"] = pandas.to_numeric(traveltime_df["wTrnW"])
-    # print traveltime_df.head()
-
-    # aggregate to origin
-    traveltime_df_grouped = traveltime_df.groupby(['orig'])
-    accessiblejobs_df = traveltime_df_grouped.agg({'da':numpy.mean, 'wTrnW':numpy.mean,
-                                                  'TOTEMP':numpy.sum, 'trn_only':numpy.sum, 'drv_only':numpy.sum, 'trn_drv':numpy.sum})
-    # print accessiblejobs_df.head()
+    # destinations are jobs => find number of jobs (and O/D pairs) accessible from each TAZ within the travel time windows
+    jobs_pairs = numpy.column_stack([zone_array(tazdata_df, 'TOTEMP', num_zones), numpy.ones(num_zones)])
+    (trn, drv, trn_drv) = jobs_within(time_skims, [[('wTrnW',45)], [('da',30)], [('wTrnW',45),('da',30)]], jobs_pairs)
 
-    # read communities of concern
-    coc_df = pandas.read_csv(os.path.join("metrics", "CommunitiesOfConcern.csv"), sep=",")
-    tazdata_df = pandas.merge(left=tazdata_df, right=coc_df, left_on="ZONE", right_on="taz")
-    tazdata_df.rename(columns={"in_set":"in_coc"}, inplace=True)
-    print("  Read {} TAZs in communities of concern".format(tazdata_df["in_coc"].sum()))
+    # separate the three disjoint sets; TOTEMP is accessible by either
+    accessible = numpy.array([trn + drv - trn_drv, trn - trn_drv, drv - trn_drv, trn_drv])
+    print "  Out of %d O/D pairs, %d are accessible within 45 min wTrnW or 30 min da" % (num_zones*num_zones, accessible[0,:,1].sum())
 
-    # read hra
-    hra_df = pandas.read_csv(os.path.join("INPUT", "metrics", "taz_hra_crosswalk.csv"))
-    hra_df.loc[ pandas.isnull(hra_df["taz_hra"]), "taz_hra"] = 0  # make it 0 or 1
-    hra_df["taz_hra"] = hra_df["taz_hra"].astype(int)
-    print("  Read {} TAZs in HRAs".format(hra_df["taz_hra"].sum()))
-    tazdata_df = pandas.merge(left=tazdata_df, right=hra_df[["taz1454","taz_hra"]], left_on="ZONE", right_on="taz1454")
-    tazdata_df.rename(columns={"taz_hra":"in_hra"}, inplace=True)
+    # join persons to origin, by equity segment
+    tazdata_df  = read_taz_equity_segments(tazdata_df)
+    segment_pop = equity_segment_indicators(tazdata_df, num_zones)*zone_array(tazdata_df, 'TOTPOP', num_zones)[:,numpy.newaxis]
+    # (measure, segment)
+    weighted    = accessible[:,:,0].dot(segment_pop)
 
-    # read urban/suburban categories
-    urban_suburban_df = pandas.read_csv(os.path.join("INPUT","metrics", "taz_urban_suburban.csv"))
-    urban_suburban_df.rename(columns={"area_type":"U_S_R"}, inplace=True)  # Urban Suburban Rural
-    print("  Read urban_suburban_df:\n{}".format(urban_suburban_df["U_S_R"].value_counts()))
-    tazdata_df = pandas.merge(left=tazdata_df, right=urban_suburban_df, left_on="ZONE", right_on="TAZ1454")
-    tazdata_df.drop(columns=["taz","taz1454","TAZ1454"], inplace=True)
-    print("  => tazdata_df head:\n{}".format(tazdata_df.head()))
-
-    # join persons to origin
-    accessiblejobs_df = pandas.merge(left=accessiblejobs_df, right=tazdata_df[['ZONE','TOTPOP','in_coc','in_hra','U_S_R']],
-                                     left_index=True,         right_on="ZONE",
-                                     how="left")
-    accessiblejobs_df[  'TOTEMP_weighted'] = accessiblejobs_df[  'TOTEMP']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['trn_only_weighted'] = accessiblejobs_df['trn_only']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['drv_only_weighted'] = accessiblejobs_df['drv_only']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df[ 'trn_drv_weighted'] = accessiblejobs_df[ 'trn_drv']*accessiblejobs_df['TOTPOP']
-    # print accessiblejobs_df.head()
-
-    for suffix in ["", "_coc","_noncoc","_hra","_nonhra","_urban","_suburban","_rural"]:
-
-        # restrict to suffix if necessary
-        accjob_subset_df = accessiblejobs_df
-        totalpop_subset  = total_pop
-        if suffix == "_coc":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_coc"]==1]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_coc"]==1, "TOTPOP"].sum()
-        elif suffix == "_noncoc":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_coc"]==0]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_coc"]==0, "TOTPOP"].sum()
-        elif suffix == "_hra":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_hra"]==1]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_hra"]==1, "TOTPOP"].sum()
-        elif suffix == "_nonhra":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_hra"]==0]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_hra"]==0, "TOTPOP"].sum()
-        elif suffix == "_urban":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="urban"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="urban", "TOTPOP"].sum()
-        elif suffix == "_suburban":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="suburban"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="suburban", "TOTPOP"].sum()
-        elif suffix == "_rural":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="rural"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="rural", "TOTPOP"].sum()
+    for segment_num, (suffix, column, value) in enumerate(EQUITY_SEGMENTS):
+        totalpop_subset = total_pop if column is None else segment_pop[:,segment_num].sum()
 
         # numerator = accessible jobs weighted by persons
         #  e.g. sum over TAZs of (totpop at TAZ x totemp jobs accessible)
         # denominator = total jobs weighted by persons
-        metrics_dict['jobacc_acc_jobs_weighted_persons%s'          % suffix] = accjob_subset_df[  'TOTEMP_weighted'].sum()
-        metrics_dict['jobacc_trn_only_acc_jobs_weighted_persons%s' % suffix] = accjob_subset_df['trn_only_weighted'].sum()
-        metrics_dict['jobacc_drv_only_acc_jobs_weighted_persons%s' % suffix] = accjob_subset_df['drv_only_weighted'].sum()
-        metrics_dict['jobacc_trn_drv_acc_jobs_weighted_persons%s'  % suffix] = accjob_subset_df[ 'trn_drv_weighted'].sum()
+        metrics_dict['jobacc_acc_jobs_weighted_persons%s'          % suffix] = weighted[0, segment_num]
+        metrics_dict['jobacc_trn_only_acc_jobs_weighted_persons%s' % suffix] = weighted[1, segment_num]
+        metrics_dict['jobacc_drv_only_acc_jobs_weighted_persons%s' % suffix] = weighted[2, segment_num]
+        metrics_dict['jobacc_trn_drv_acc_jobs_weighted_persons%s'  % suffix] = weighted[3, segment_num]
         metrics_dict['jobacc_total_jobs_weighted_persons%s'        % suffix] = total_emp*totalpop_subset
         metrics_dict['jobacc_accessible_job_share%s'               % suffix] = float(metrics_dict['jobacc_acc_jobs_weighted_persons%s'          % suffix]) / float(metrics_dict['jobacc_total_jobs_weighted_persons%s' % suffix])
         metrics_dict['jobacc_trn_only_acc_accessible_job_share%s'  % suffix] = float(metrics_dict['jobacc_trn_only_acc_jobs_weighted_persons%s' % suffix]) / float(metrics_dict['jobacc_total_jobs_weighted_persons%s' % suffix])
@@ -200,7 +247,7 @@ def tally_access_to_jobs_v2(iteration, sampleshare, metrics_dict):
     """
     v2 of tally_access_to_jobs() for Blueprint (see Update and expand accessibility metrics @ https://app.asana.com/0/403262763383022/1174396999538101/f)
 
-    Reads in database\TimeSkimsDatabaseAM.csv and outputs accessible jobs weighted by persons for the following:
+    Reads in database\TimeSkimsDatabaseAM.csv (see read_time_skims()) and outputs accessible jobs weighted by persons for the following:
     * wTrnW time   <= 45 minutes
     * da time      <= 30 minutes
     * da toll time <= 30 minutes
@@ -233,25 +280,16 @@ def tally_access_to_jobs_v2(iteration, sampleshare, metrics_dict):
 
     """
     print "Tallying access to jobs v2"
-    traveltime_df = pandas.read_csv(os.path.join("database","TimeSkimsDatabaseAM.csv"),
-                                    sep=",")
-    traveltime_df = traveltime_df[['orig','dest','da','daToll','wTrnW','bike','walk']]
-    # -999 is really no-access
-    traveltime_df.replace(to_replace=[-999.0], value=[None], inplace=True)
-    len_traveltime_df = len(traveltime_df)
-
-    traveltime_df['wtrn_45'] = 0
-    traveltime_df['wtrn_30'] = 0
-    traveltime_df['da_30'  ] = 0
-    traveltime_df['dat_30' ] = 0
-    traveltime_df['bike_20'] = 0
-    traveltime_df['walk_20'] = 0
-    traveltime_df.loc[ (traveltime_df.wTrnW  <=45) , 'wtrn_45'] = 1
-    traveltime_df.loc[ (traveltime_df.wTrnW  <=30) , 'wtrn_30'] = 1
-    traveltime_df.loc[ (traveltime_df.da     <=30) , 'da_30'  ] = 1
-    traveltime_df.loc[ (traveltime_df.daToll <=30) , 'dat_30' ] = 1
-    traveltime_df.loc[ (traveltime_df.bike   <=20) , 'bike_20'] = 1
-    traveltime_df.loc[ (traveltime_df.walk   <=20) , 'walk_20'] = 1
+    time_skims = read_time_skims()
+    num_zones  = time_skims.shape[1]
+
+    # measure name -> conditions for jobs_within()
+    measures = [('wtrn_45', [('wTrnW' ,45)]),
+                ('wtrn_30', [('wTrnW' ,30)]),
+                ('da_30'  , [('da'    ,30)]),
+                ('dat_30' , [('daToll',30)]),
+                ('bike_20', [('bike'  ,20)]),
+                ('walk_20', [('walk'  ,20)])]
 
     # destinations are jobs => find number of jobs accessible from each TAZ within the travel time windows
     tazdata_df = pandas.read_csv(os.path.join("landuse", "tazData.csv"), sep=",")
@@ -259,175 +297,136 @@ def tally_access_to_jobs_v2(iteration, sampleshare, metrics_dict):
     total_emp  = tazdata_df['TOTEMP'].sum()
     total_pop  = tazdata_df['TOTPOP'].sum()
 
-    traveltime_df = pandas.merge(left=traveltime_df, right=tazdata_df[['ZONE','TOTEMP']],
-                                 left_on="dest",     right_on="ZONE",
-                                 how="left")
-    traveltime_df.drop('ZONE', axis=1, inplace=True)  # ZONE == dest
-    # make these total employment
-    traveltime_df.wtrn_45  = traveltime_df.wtrn_45 *traveltime_df.TOTEMP
-    traveltime_df.wtrn_30  = traveltime_df.wtrn_30 *traveltime_df.TOTEMP
-    traveltime_df.da_30    = traveltime_df.da_30   *traveltime_df.TOTEMP
-    traveltime_df.dat_30   = traveltime_df.dat_30  *traveltime_df.TOTEMP
-    traveltime_df.bike_20  = traveltime_df.bike_20 *traveltime_df.TOTEMP
-    traveltime_df.walk_20  = traveltime_df.walk_20 *traveltime_df.TOTEMP
-    # make these numeric
-    traveltime_df['wTrnW' ] = pandas.to_numeric(traveltime_df['wTrnW' ])
-    traveltime_df['da'    ] = pandas.to_numeric(traveltime_df['da'    ])
-    traveltime_df['daToll'] = pandas.to_numeric(traveltime_df['daToll'])
-    traveltime_df['bike'  ] = pandas.to_numeric(traveltime_df['bike'  ])
-    traveltime_df['walk'  ] = pandas.to_numeric(traveltime_df['walk'  ])
-    # print traveltime_df.head()
-
-    # aggregate to origin
-    traveltime_df_grouped = traveltime_df.groupby(['orig'])
-    accessiblejobs_df = traveltime_df_grouped.agg({'wTrnW'  :numpy.mean,
-                                                   'da'     :numpy.mean,
-                                                   'daToll' :numpy.mean,
-                                                   'bike'   :numpy.mean,
-                                                   'walk'   :numpy.mean,
-                                                   'TOTEMP' :numpy.sum,
-                                                   'wtrn_45':numpy.sum,
-                                                   'wtrn_30':numpy.sum,
-                                                   'da_30'  :numpy.sum,
-                                                   'dat_30' :numpy.sum,
-                                                   'bike_20':numpy.sum,
-                                                   'walk_20':numpy.sum})
-    # print accessiblejobs_df.head()
+    jobs       = zone_array(tazdata_df, 'TOTEMP', num_zones)
+    accessible = jobs_within(time_skims, [conditions for (name, conditions) in measures], jobs)
+    # the skims cover every O/D pair, so TOTEMP (all jobs, whatever the time) is the same for every origin
+    accessible = numpy.vstack([numpy.full((1, num_zones), jobs.sum()), accessible])
 
-    # read communities of concern
-    coc_df = pandas.read_csv(os.path.join("metrics", "CommunitiesOfConcern.csv"), sep=",")
-    tazdata_df = pandas.merge(left=tazdata_df, right=coc_df, left_on="ZONE", right_on="taz")
-    tazdata_df.rename(columns={"in_set":"in_coc"}, inplace=True)
-    print("  Read {} TAZs in communities of concern".format(tazdata_df["in_coc"].sum()))
-
-    # read hra
-    hra_df = pandas.read_csv(os.path.join("INPUT","metrics", "taz_hra_crosswalk.csv"))
-    hra_df.loc[ pandas.isnull(hra_df["taz_hra"]), "taz_hra"] = 0  # make it 0 or 1
-    hra_df["taz_hra"] = hra_df["taz_hra"].astype(int)
-    print("  Read {} TAZs in HRAs".format(hra_df["taz_hra"].sum()))
-    tazdata_df = pandas.merge(left=tazdata_df, right=hra_df[["taz1454","taz_hra"]], left_on="ZONE", right_on="taz1454")
-    tazdata_df.rename(columns={"taz_hra":"in_hra"}, inplace=True)
-
-    # read urban/suburban categories
-    urban_suburban_df = pandas.read_csv(os.path.join("INPUT", "metrics", "taz_urban_suburban.csv"))
-    urban_suburban_df.rename(columns={"area_type":"U_S_R"}, inplace=True)  # Urban Suburban Rural
-    print("  Read urban_suburban_df:\n{}".format(urban_suburban_df["U_S_R"].value_counts()))
-    tazdata_df = pandas.merge(left=tazdata_df, right=urban_suburban_df, left_on="ZONE", right_on="TAZ1454")
-    tazdata_df.drop(columns=["taz","taz1454","TAZ1454"], inplace=True)
-    print("  => tazdata_df head:\n{}".format(tazdata_df.head()))
-
-    # join persons to origin
-    accessiblejobs_df = pandas.merge(left=accessiblejobs_df, right=tazdata_df[['ZONE','TOTPOP','TOTHH','HHINCQ1','HHINCQ2','HHINCQ3','HHINCQ4',
-                                                                               'in_coc',"in_hra","U_S_R"]],
-                                     left_index=True,         right_on="ZONE",
-                                     how="left")
+    # join persons (by equity segment) and households (by income) to origin
+    tazdata_df  = read_taz_equity_segments(tazdata_df)
+    segment_pop = equity_segment_indicators(tazdata_df, num_zones)*zone_array(tazdata_df, 'TOTPOP', num_zones)[:,numpy.newaxis]
+    households  = numpy.column_stack([zone_array(tazdata_df, 'TOTHH', num_zones),
+                                      zone_array(tazdata_df, 'HHINCQ1', num_zones) + zone_array(tazdata_df, 'HHINCQ2', num_zones),
+                                      zone_array(tazdata_df, 'HHINCQ3', num_zones) + zone_array(tazdata_df, 'HHINCQ4', num_zones)])
+    # (TOTEMP + measure, segment + household income)
+    weighted    = accessible.dot(numpy.column_stack([segment_pop, households]))
 
     # population version
-    accessiblejobs_df[ 'TOTEMP_weighted'] = accessiblejobs_df[ 'TOTEMP']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['wtrn_45_weighted'] = accessiblejobs_df['wtrn_45']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['wtrn_30_weighted'] = accessiblejobs_df['wtrn_30']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df[  'da_30_weighted'] = accessiblejobs_df[  'da_30']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df[ 'dat_30_weighted'] = accessiblejobs_df[ 'dat_30']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['bike_20_weighted'] = accessiblejobs_df['bike_20']*accessiblejobs_df['TOTPOP']
-    accessiblejobs_df['walk_20_weighted'] = accessiblejobs_df['walk_20']*accessiblejobs_df['TOTPOP']
-
-
-    # print accessiblejobs_df.head()
-
-    for suffix in ["", "_coc","_noncoc","_hra","_nonhra","_urban","_suburban","_rural"]:
-
-        # restrict to suffix if necessary
-        accjob_subset_df = accessiblejobs_df
-        totalpop_subset  = total_pop
-        if suffix == "_coc":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_coc"]==1]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_coc"]==1, "TOTPOP"].sum()
-        elif suffix == "_noncoc":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_coc"]==0]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_coc"]==0, "TOTPOP"].sum()
-        elif suffix == "_hra":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_hra"]==1]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_hra"]==1, "TOTPOP"].sum()
-        elif suffix == "_nonhra":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["in_hra"]==0]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["in_hra"]==0, "TOTPOP"].sum()
-        elif suffix == "_urban":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="urban"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="urban", "TOTPOP"].sum()
-        elif suffix == "_suburban":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="suburban"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="suburban", "TOTPOP"].sum()
-        elif suffix == "_rural":
-            accjob_subset_df = accessiblejobs_df.loc[accessiblejobs_df["U_S_R"]=="rural"]
-            totalpop_subset  = tazdata_df.loc[tazdata_df["U_S_R"]=="rural", "TOTPOP"].sum()
+    for segment_num, (suffix, column, value) in enumerate(EQUITY_SEGMENTS):
+        totalpop_subset = total_pop if column is None else segment_pop[:,segment_num].sum()
 
         # numerator = accessible jobs weighted by persons
         #  e.g. sum over TAZs of (totpop at TAZ x totemp jobs accessible)
         # denominator = total jobs weighted by persons
-        metrics_dict['jobacc2_acc_jobs_weighted_persons%s'          % suffix] = accjob_subset_df[  'TOTEMP_weighted'].sum()
-        metrics_dict['jobacc2_wtrn_45_acc_jobs_weighted_persons%s'  % suffix] = accjob_subset_df[ 'wtrn_45_weighted'].sum()
-        metrics_dict['jobacc2_wtrn_30_acc_jobs_weighted_persons%s'  % suffix] = accjob_subset_df[ 'wtrn_30_weighted'].sum()
-        metrics_dict['jobacc2_da_30_acc_jobs_weighted_persons%s'    % suffix] = accjob_subset_df[   'da_30_weighted'].sum()
-        metrics_dict['jobacc2_dat_30_acc_jobs_weighted_persons%s'   % suffix] = accjob_subset_df[  'dat_30_weighted'].sum()
-        metrics_dict['jobacc2_bike_20_acc_jobs_weighted_persons%s'  % suffix] = accjob_subset_df[ 'bike_20_weighted'].sum()
-        metrics_dict['jobacc2_walk_20_acc_jobs_weighted_persons%s'  % suffix] = accjob_subset_df[ 'walk_20_weighted'].sum()
-
+        metrics_dict['jobacc2_acc_jobs_weighted_persons%s'          % suffix] = weighted[0, segment_num]
         metrics_dict['jobacc2_total_jobs_weighted_persons%s'        % suffix] = total_emp*totalpop_subset
 
-        metrics_dict['jobacc2_wtrn_45_acc_accessible_job_share%s'  % suffix] = float(metrics_dict['jobacc2_wtrn_45_acc_jobs_weighted_persons%s' % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-        metrics_dict['jobacc2_wtrn_30_acc_accessible_job_share%s'  % suffix] = float(metrics_dict['jobacc2_wtrn_30_acc_jobs_weighted_persons%s' % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-        metrics_dict['jobacc2_da_30_acc_accessible_job_share%s'    % suffix] = float(metrics_dict['jobacc2_da_30_acc_jobs_weighted_persons%s'   % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-        metrics_dict['jobacc2_dat_30_acc_accessible_job_share%s'   % suffix] = float(metrics_dict['jobacc2_dat_30_acc_jobs_weighted_persons%s'  % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-        metrics_dict['jobacc2_bike_20_acc_accessible_job_share%s'  % suffix] = float(metrics_dict['jobacc2_bike_20_acc_jobs_weighted_persons%s' % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-        metrics_dict['jobacc2_walk_20_acc_accessible_job_share%s'  % suffix] = float(metrics_dict['jobacc2_walk_20_acc_jobs_weighted_persons%s' % suffix]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
-
-        # reset so these don't get used accidentally
-        accjob_subset_df = None
-        totalpop_subset  = None
+        for measure_num, (name, conditions) in enumerate(measures):
+            metrics_dict['jobacc2_%s_acc_jobs_weighted_persons%s'   % (name, suffix)] = weighted[measure_num+1, segment_num]
+            metrics_dict['jobacc2_%s_acc_accessible_job_share%s'    % (name, suffix)] = float(metrics_dict['jobacc2_%s_acc_jobs_weighted_persons%s' % (name, suffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_persons%s' % suffix])
 
     # household version
-    accessiblejobs_df[ 'TOTEMP_weightedhh'] = accessiblejobs_df[ 'TOTEMP']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df['wtrn_45_weightedhh'] = accessiblejobs_df['wtrn_45']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df['wtrn_30_weightedhh'] = accessiblejobs_df['wtrn_30']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df[  'da_30_weightedhh'] = accessiblejobs_df[  'da_30']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df[ 'dat_30_weightedhh'] = accessiblejobs_df[ 'dat_30']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df['bike_20_weightedhh'] = accessiblejobs_df['bike_20']*accessiblejobs_df['TOTHH']
-    accessiblejobs_df['walk_20_weightedhh'] = accessiblejobs_df['walk_20']*accessiblejobs_df['TOTHH']
-
-    accessiblejobs_df[ 'TOTEMP_weightedhhq1q2'] = accessiblejobs_df[ 'TOTEMP']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df['wtrn_45_weightedhhq1q2'] = accessiblejobs_df['wtrn_45']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df['wtrn_30_weightedhhq1q2'] = accessiblejobs_df['wtrn_30']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df[  'da_30_weightedhhq1q2'] = accessiblejobs_df[  'da_30']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df[ 'dat_30_weightedhhq1q2'] = accessiblejobs_df[ 'dat_30']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df['bike_20_weightedhhq1q2'] = accessiblejobs_df['bike_20']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-    accessiblejobs_df['walk_20_weightedhhq1q2'] = accessiblejobs_df['walk_20']*(accessiblejobs_df['HHINCQ1']+accessiblejobs_df['HHINCQ2'])
-
-    accessiblejobs_df[ 'TOTEMP_weightedhhq3q4'] = accessiblejobs_df[ 'TOTEMP']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df['wtrn_45_weightedhhq3q4'] = accessiblejobs_df['wtrn_45']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df['wtrn_30_weightedhhq3q4'] = accessiblejobs_df['wtrn_30']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df[  'da_30_weightedhhq3q4'] = accessiblejobs_df[  'da_30']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df[ 'dat_30_weightedhhq3q4'] = accessiblejobs_df[ 'dat_30']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df['bike_20_weightedhhq3q4'] = accessiblejobs_df['bike_20']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-    accessiblejobs_df['walk_20_weightedhhq3q4'] = accessiblejobs_df['walk_20']*(accessiblejobs_df['HHINCQ3']+accessiblejobs_df['HHINCQ4'])
-
-    for hhsuffix in ["", "q1q2","q3q4"]:
-        metrics_dict['jobacc2_acc_jobs_weighted_hh{}'        .format(hhsuffix)] = accessiblejobs_df[  'TOTEMP_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_wtrn_45_acc_jobs_weighted_hh{}'.format(hhsuffix)] = accessiblejobs_df[ 'wtrn_45_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_wtrn_30_acc_jobs_weighted_hh{}'.format(hhsuffix)] = accessiblejobs_df[ 'wtrn_30_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_da_30_acc_jobs_weighted_hh{}'  .format(hhsuffix)] = accessiblejobs_df[   'da_30_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_dat_30_acc_jobs_weighted_hh{}' .format(hhsuffix)] = accessiblejobs_df[  'dat_30_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_bike_20_acc_jobs_weighted_hh{}'.format(hhsuffix)] = accessiblejobs_df[ 'bike_20_weightedhh{}'.format(hhsuffix)].sum()
-        metrics_dict['jobacc2_walk_20_acc_jobs_weighted_hh{}'.format(hhsuffix)] = accessiblejobs_df[ 'walk_20_weightedhh{}'.format(hhsuffix)].sum()
-
-        metrics_dict['jobacc2_total_jobs_weighted_hh{}'      .format(hhsuffix)] = metrics_dict['jobacc2_acc_jobs_weighted_hh{}'.format(hhsuffix)]
-
-        metrics_dict['jobacc2_wtrn_45_acc_accessible_job_share_hh{}'.format(hhsuffix)] = float(metrics_dict['jobacc2_wtrn_45_acc_jobs_weighted_hh{}'.format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
-        metrics_dict['jobacc2_wtrn_30_acc_accessible_job_share_hh{}'.format(hhsuffix)] = float(metrics_dict['jobacc2_wtrn_30_acc_jobs_weighted_hh{}'.format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
-        metrics_dict['jobacc2_da_30_acc_accessible_job_share_hh{}'  .format(hhsuffix)] = float(metrics_dict['jobacc2_da_30_acc_jobs_weighted_hh{}'  .format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
-        metrics_dict['jobacc2_dat_30_acc_accessible_job_share_hh{}' .format(hhsuffix)] = float(metrics_dict['jobacc2_dat_30_acc_jobs_weighted_hh{}' .format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
-        metrics_dict['jobacc2_bike_20_acc_accessible_job_share_hh{}'.format(hhsuffix)] = float(metrics_dict['jobacc2_bike_20_acc_jobs_weighted_hh{}'.format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
-        metrics_dict['jobacc2_walk_20_acc_accessible_job_share_hh{}'.format(hhsuffix)] = float(metrics_dict['jobacc2_walk_20_acc_jobs_weighted_hh{}'.format(hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
- 
+    for hh_num, hhsuffix in enumerate(["", "q1q2","q3q4"]):
+        hh_col = len(EQUITY_SEGMENTS) + hh_num
+        metrics_dict['jobacc2_acc_jobs_weighted_hh{}'  .format(hhsuffix)] = weighted[0, hh_col]
+        metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)] = metrics_dict['jobacc2_acc_jobs_weighted_hh{}'.format(hhsuffix)]
+
+        for measure_num, (name, conditions) in enumerate(measures):
+            metrics_dict['jobacc2_{}_acc_jobs_weighted_hh{}'         .format(name, hhsuffix)] = weighted[measure_num+1, hh_col]
+            metrics_dict['jobacc2_{}_acc_accessible_job_share_hh{}'  .format(name, hhsuffix)] = float(metrics_dict['jobacc2_{}_acc_jobs_weighted_hh{}'.format(name, hhsuffix)]) / float(metrics_dict['jobacc2_total_jobs_weighted_hh{}'.format(hhsuffix)])
+
+def cumulative_jobs(time_skims, jobs, minutes):
+    """
+    Returns the jobs accessible from each origin within each of the given minutes as a (mode, minutes, orig_taz-1) array,
+    where time_skims is returned by read_time_skims() and jobs is a (dest_taz-1) array of jobs.
+
+    Each origin's destinations are sorted by time once per mode, and the cumulative sum of their jobs is then
+    read off at every threshold, so the number of thresholds hardly matters.  No-access sorts last and is
+    never within any number of minutes.
+    """
+    num_zones = time_skims.shape[1]
+    minutes   = numpy.array(minutes)
+    accessible = numpy.zeros((len(TIME_SKIM_MODES), len(minutes), num_zones))
+    for mode_code in range(len(TIME_SKIM_MODES)):
+        order        = numpy.argsort(time_skims[mode_code], axis=1)
+        sorted_times = numpy.take_along_axis(time_skims[mode_code], order, axis=1)
+        # leading 0 column for no destinations within the threshold
+        sorted_jobs  = numpy.zeros((num_zones, num_zones+1))
+        numpy.cumsum(jobs[order], axis=1, out=sorted_jobs[:,1:])
+        for orig in range(num_zones):
+            num_within = numpy.searchsorted(sorted_times[orig], minutes, side='right')
+            accessible[mode_code, :, orig] = sorted_jobs[orig, num_within]
+    return accessible
+
+def gravity_jobs(time_skims, jobs, decays):
+    """
+    Returns the gravity accessibility of each origin for each of the given decays as a (mode, decay, orig_taz-1) array,
+    where time_skims is returned by read_time_skims() and jobs is a (dest_taz-1) array of jobs.
+
+    That's the jobs at each destination weighted by exp(-decay x minutes), summed; no-access destinations count for nothing.
+    """
+    num_zones = time_skims.shape[1]
+    accessible = numpy.zeros((len(TIME_SKIM_MODES), len(decays), num_zones))
+    for mode_code in range(len(TIME_SKIM_MODES)):
+        minutes = numpy.asarray(time_skims[mode_code], dtype=numpy.float64)
+        for decay_num, decay in enumerate(decays):
+            weights = numpy.exp(-decay*minutes)
+            weights[numpy.isnan(weights)] = 0.0
+            accessible[mode_code, decay_num] = weights.dot(jobs)
+    return accessible
+
+def tally_access_to_jobs_curves(iteration, sampleshare):
+    """
+    Extends tally_access_to_jobs_v2() from its fixed thresholds to full accessibility curves for every mode in
+    TIME_SKIM_MODES: jobs accessible within each of CURVE_MINUTES (see cumulative_jobs()), plus negative exponential
+    gravity measures for each of GRAVITY_DECAYS (see gravity_jobs()), weighted by persons for each of the EQUITY_SEGMENTS.
+
+    Writes metrics\jobacc_curves.csv with columns
+    * mode                        : one of TIME_SKIM_MODES
+    * measure                     : cumulative or gravity
+    * parameter                   : minutes for cumulative, decay (per minute) for gravity
+    * segment                     : all, coc, noncoc, hra, nonhra, urban, suburban or rural
+    * acc_jobs_weighted_persons   : accessible jobs weighted by persons
+    * total_jobs_weighted_persons : total jobs x total persons
+    * accessible_job_share        : acc_jobs_weighted_persons/total_jobs_weighted_persons
+    """
+    print "Tallying access to jobs curves"
+    time_skims = read_time_skims()
+    num_zones  = time_skims.shape[1]
+
+    tazdata_df = pandas.read_csv(os.path.join("landuse", "tazData.csv"), sep=",")
+    tazdata_df = tazdata_df[['ZONE','TOTPOP','TOTEMP']]
+    total_emp  = tazdata_df['TOTEMP'].sum()
+    total_pop  = tazdata_df['TOTPOP'].sum()
+
+    jobs       = zone_array(tazdata_df, 'TOTEMP', num_zones)
+    # (mode, measure x parameter, orig)
+    accessible = numpy.concatenate([cumulative_jobs(time_skims, jobs, CURVE_MINUTES),
+                                    gravity_jobs(time_skims, jobs, GRAVITY_DECAYS)], axis=1)
+    measures   = [("cumulative", minutes) for minutes in CURVE_MINUTES] + [("gravity", decay) for decay in GRAVITY_DECAYS]
+
+    # join persons to origin, by equity segment
+    tazdata_df  = read_taz_equity_segments(tazdata_df)
+    segment_pop = equity_segment_indicators(tazdata_df, num_zones)*zone_array(tazdata_df, 'TOTPOP', num_zones)[:,numpy.newaxis]
+    # (mode, measure x parameter, segment)
+    weighted    = accessible.dot(segment_pop)
+    total_jobs_weighted_persons = total_emp*numpy.array(
+        [total_pop if column is None else segment_pop[:,segment_num].sum() for segment_num, (suffix, column, value) in enumerate(EQUITY_SEGMENTS)])
+
+    curves_df = pandas.DataFrame({
+        "mode"                       : numpy.repeat(TIME_SKIM_MODES, len(measures)*len(EQUITY_SEGMENTS)),
+        "measure"                    : numpy.tile(numpy.repeat([measure for (measure, parameter) in measures], len(EQUITY_SEGMENTS)), len(TIME_SKIM_MODES)),
+        "parameter"                  : numpy.tile(numpy.repeat([parameter for (measure, parameter) in measures], len(EQUITY_SEGMENTS)), len(TIME_SKIM_MODES)),
+        "segment"                    : numpy.tile([suffix.lstrip("_") if suffix else "all" for (suffix, column, value) in EQUITY_SEGMENTS], len(TIME_SKIM_MODES)*len(measures)),
+        "acc_jobs_weighted_persons"  : weighted.reshape(-1),
+        "total_jobs_weighted_persons": numpy.tile(total_jobs_weighted_persons, len(TIME_SKIM_MODES)*len(measures))})
+    curves_df["accessible_job_share"] = curves_df["acc_jobs_weighted_persons"]/curves_df["total_jobs_weighted_persons"]
+    curves_df = curves_df[["mode","measure","parameter","segment","acc_jobs_weighted_persons","total_jobs_weighted_persons","accessible_job_share"]]
+
+    out_filename = os.path.join("metrics","jobacc_curves.csv")
+    curves_df.to_csv(out_filename, index=False, float_format='%.5f')
+    print "Wrote %s" % out_filename
+
 
 def tally_goods_movement_delay(iteration, sampleshare, metrics_dict):
     """
@@ -566,6 +565,7 @@ if __name__ == '__main__':
     tally_travel_cost(iteration, sampleshare, metrics_dict)
     tally_access_to_jobs(iteration, sampleshare, metrics_dict)
     tally_access_to_jobs_v2(iteration, sampleshare, metrics_dict)
+    tally_access_to_jobs_curves(iteration, sampleshare)
     tally_goods_movement_delay(iteration, sampleshare, metrics_dict)
     tally_nonauto_mode_share(iteration, sampleshare, metrics_dict)
     tally_road_cost_vmt(iteration, sampleshare, metrics_dict)
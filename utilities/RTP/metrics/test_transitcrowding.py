@@ -0,0 +1,45 @@
+"""
+  Tests for the pseudo line handling in transitcrowding.py.  Run with
+
+    python -m pytest test_transitcrowding.py
+
+"""
+import unittest
+import pandas as pd
+
+import transitcrowding
+
+def line_links(mode, name, boards, exits, period="AM"):
+    """
+    Returns the links of a transit line with the given boards and exits by SEQ.
+    """
+    return pd.DataFrame({"MODE"   :mode,
+                         "NAME"   :name,
+                         "period" :period,
+                         "SEQ"    :range(1, len(boards)+1),
+                         "AB_BRDA":boards,
+                         "AB_XITB":exits,
+                         "AB_VOL" :[0.0]*len(boards)})
+
+class FindPseudoLinesTest(unittest.TestCase):
+
+    def test_regional_rail_line_is_not_pseudo(self):
+        # an ordinary regional rail line boarding at its first stop and exiting at its last,
+        # alongside a configured pseudo line, so move_pseudo_line_ridership() doesn't exit over it
+        trn_link_df = pd.concat([line_links(130, "130_ACE",     [50.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 50.0]),
+                                 line_links(130, "130_RR_PSEU", [10.0, 5.0, 0.0, 0.0], [0.0, 0.0, 5.0, 10.0])])
+        pseudo_lines_df = transitcrowding.find_pseudo_lines(trn_link_df)
+        self.assertEqual(list(pseudo_lines_df["NAME"]), ["130_RR_PSEU"])
+
+    def test_mapped_regional_rail_line_is_pseudo(self):
+        trn_link_df = line_links(130, "130_RR_PSEU", [10.0, 5.0, 0.0, 0.0], [0.0, 0.0, 5.0, 10.0])
+        pseudo_lines_df = transitcrowding.find_pseudo_lines(trn_link_df)
+        self.assertEqual(list(pseudo_lines_df["NAME"]), ["130_RR_PSEU"])
+
+    def test_bart_line_is_pseudo(self):
+        trn_link_df = line_links(120, "120_OR_YEL", [10.0, 5.0, 0.0, 0.0], [0.0, 0.0, 5.0, 10.0])
+        pseudo_lines_df = transitcrowding.find_pseudo_lines(trn_link_df)
+        self.assertEqual(list(pseudo_lines_df["NAME"]), ["120_OR_YEL"])
+
+if __name__ == '__main__':
+    unittest.main()
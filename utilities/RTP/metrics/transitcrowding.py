@@ -1,6 +1,8 @@
-import argparse, copy, csv, logging, os, sys
+import argparse, collections, copy, csv, json, logging, os, re, sys
+import numpy as np
 import pandas as pd
-import simpledbf
+
+import transitlinks
 
 USAGE="""
 
@@ -14,12 +16,16 @@ followed by exit-only stops), then the script allocates those boards, alights an
 they represent.  The pseudo lines must be mapped to actual lines via the PSEUDO_LINE_MAPPING.  This funcionality
 may be suppressed with the arg --no_pseudo_move but it is on by default.
 
+The crowding factors are calculated for each of the CROWDING_VARIANTS -- combinations of a crowding curve
+and seated capacity assumptions.  Additional variants for sensitivity tests may be specified in a json file
+with --crowding_variants, e.g. [{"name":"metrolinx_seats90", "curve":"metrolinx", "seatcap_scale":0.9}]
+
 transitcrowding.py is run with the proj folder as an argument. eg:
 projects root dir\python transitcrowding.py 1_CaltrainMod\\2050_TM150_BF_00_1_CaltrainMod_00
 
 Input:
 * TransitSeatCap.csv, containing VEHTYPE, seatcap and standcap
-* [project dir]\\OUTPUT?\\trn\\trnlink[ea,am,md,pm,ev]_ALLMSA.dbf
+* [project dir]\\OUTPUT?\\trn\\trnlink[ea,am,md,pm,ev]_ALLMSA.dbf (or csv/parquet equivalents; see transitlinks.py)
 
 Output:
 * [project_dir]\\OUTPUT?\\metrics\\transit_crowding_complete.csv
@@ -56,130 +62,185 @@ PSEUDO_LINE_MAPPING = {
     "130_RR_PSEU" :("130_RR_SACR$", "130_RR_F_EXP-", 14648), # RR_Sacr/Martinez - Jack London - Fremont (along easy bay)
     "130_RR_PSEUR":("130_RR_F_EXP$","130_RR_SACR-",  14648), # reverse
 }
+# modes to check for pseudo lines: BART and Reg Rail
+PSEUDO_LINE_MODES = [120, 130]
+# Reg Rail lines often just board at their first stops and exit at their last, so for these modes
+# only the lines configured in PSEUDO_LINE_MAPPING are pseudo lines
+PSEUDO_LINE_MAPPED_ONLY_MODES = [130]
+
+# UK DFT crowding multipliers for seated and standing passengers: (minimum load_seatcap, sit, stand)
+UKDFT_STEPS = [
+    (1.0, 1.08, 1.50),
+    (1.2, 1.23, 1.67),
+    (1.4, 1.38, 1.85),
+    (1.6, 1.53, 2.02),
+    (1.8, 1.68, 2.20),
+    (2.0, 1.83, 2.37),
+]
+# Metrolinx crowding multipliers for seated and standing passengers: a + b*(load_seatcap^c) as (a, b, c)
+METROLINX_PARAMS = {
+    "seated"  :(1.0, 0.1, 1.4),
+    "standing":(1.4, 0.2, 3.4),
+}
+CROWDING_CURVES = ["ukdft", "metrolinx"]
+
+# Each variant results in crowdingfactor_[name], effective_ivtt_[name] and crowding_penalty_hrs_[name] columns.
+#   name:          column suffix
+#   curve:         one of CROWDING_CURVES
+#   params:        optional curve parameters; {"steps":UKDFT_STEPS} or METROLINX_PARAMS-style
+#   max_factor:    optional cap on the crowding factor
+#   seatcap:       optional {veh_type_updated: seats per vehicle} overriding TransitSeatCap.csv
+#   seatcap_scale: optional factor applied to the seated capacity
+CROWDING_VARIANTS = [
+    {"name":"ukdft",             "curve":"ukdft"    },
+    {"name":"metrolinx",         "curve":"metrolinx"},
+    {"name":"metrolinx_max2pt5", "curve":"metrolinx", "max_factor":2.5},
+]
 
 def find_pseudo_lines(trn_link_df):
     """
     Find lines that look like pseudo lines -- 
     e.g. there's a sequence of board-only stops followed by a sequence of alight-only stops
 
-    Return a list of tuples: [(MODE, NAME, period, seq_last_board, seq_first_exit)]
-    """
-    # add temp columns
-    # seq with brda > 0
-    trn_link_df["seq_brda"] = trn_link_df["SEQ"]
-    trn_link_df.loc[ trn_link_df["AB_BRDA"] == 0, "seq_brda"] = 0
-    # seq with xitb > 0
-    trn_link_df["seq_xitb"] = trn_link_df["SEQ"]
-    trn_link_df.loc[ trn_link_df["AB_XITB"] == 0, "seq_xitb"] = 100
-
-    line_group = trn_link_df.groupby(by=["MODE","NAME","period"])
-    pseudo_lines = []
-
-    for group_id, line in line_group:
-        if group_id[0] not in [120]: continue   #  ie do this only for BART and Reg Rail
-        if len(line) < 3: continue      # pseudo lines must have board + transfer + exit  
+    Only lines with a mode in PSEUDO_LINE_MODES are considered, and for PSEUDO_LINE_MAPPED_ONLY_MODES,
+    only those in PSEUDO_LINE_MAPPING.
 
-        seq_last_board = line["seq_brda"].max()
-        seq_first_exit = line["seq_xitb"].min()
-
-        # board / transfer / exit
-        if seq_last_board < seq_first_exit:
-            pseudo_line_name = group_id[1]
-            # logging.info("Found pseudo line {} (last board: {}  first exit: {})".format(str(group_id), seq_last_board, seq_first_exit))
-            # print(line[["A","B","SEQ","AB_BRDA","AB_XITB","seq_brda","seq_xitb"]])
-
-            pseudo_lines.append( (group_id[0], group_id[1], group_id[2], seq_last_board, seq_first_exit) )
-
-    # remove temp columns
-    trn_link_df.drop(columns=["seq_brda","seq_xitb"], inplace=True)
-
-    return pseudo_lines
-
-def move_pseudo_line_ridership(trn_link_df, pseudo_lines):
+    Return a DataFrame with columns MODE, NAME, period, seq_last_board, seq_first_exit
+    """
+    rail_link_df = trn_link_df.loc[ trn_link_df["MODE"].isin(PSEUDO_LINE_MODES), ["MODE","NAME","period","SEQ","AB_BRDA","AB_XITB"]]
+    rail_link_df = rail_link_df.assign(
+        seq_last_board = rail_link_df["SEQ"].where(rail_link_df["AB_BRDA"] != 0, 0),    # seq with brda > 0
+        seq_first_exit = rail_link_df["SEQ"].where(rail_link_df["AB_XITB"] != 0, 100))  # seq with xitb > 0
+
+    line_df = rail_link_df.groupby(by=["MODE","NAME","period"], observed=True).agg(
+        {"SEQ":"count", "seq_last_board":"max", "seq_first_exit":"min"}).reset_index()
+
+    # pseudo lines must have board + transfer + exit
+    # board / transfer / exit
+    pseudo_lines_df = line_df.loc[ (line_df["SEQ"] >= 3) & (line_df["seq_last_board"] < line_df["seq_first_exit"]) ]
+
+    not_pseudo = pseudo_lines_df["MODE"].isin(PSEUDO_LINE_MAPPED_ONLY_MODES) & ~pseudo_lines_df["NAME"].isin(list(PSEUDO_LINE_MAPPING.keys()))
+    if not_pseudo.any():
+        logging.warning("Skipping lines that look like pseudo lines but aren't configured in PSEUDO_LINE_MAPPING: {}".format(
+                        ", ".join(sorted(set(pseudo_lines_df.loc[not_pseudo, "NAME"])))))
+        pseudo_lines_df = pseudo_lines_df.loc[ ~not_pseudo ]
+    return pseudo_lines_df.drop(columns=["SEQ"]).reset_index(drop=True)
+
+def move_pseudo_line_ridership(trn_link_df, pseudo_lines_df):
     """
-    Moves the ridership from the given pseudo lines to their actual counterparts
+    Moves the ridership from the given pseudo lines (as returned by find_pseudo_lines()) to their actual counterparts
     Configuration of those counterparts is in PSEUDO_LINE_MAPPING
     Updates the AB_BRDA, AB_XITB and AB_VOL columns for the actual lines and deletes the pseudo line rows from the table.
 
+    All pseudo lines and periods are handled together: the pseudo links are joined to the actual links
+    whose names match the PSEUDO_LINE_MAPPING regexes in one merge.
+
     Returns updated trn_link_df.
     """
+    unmapped = set(pseudo_lines_df["NAME"]) - set(PSEUDO_LINE_MAPPING.keys())
+    if len(unmapped) > 0:
+        logging.fatal("{} is not configured in PSEUDO_LINE_MAPPING".format(", ".join(sorted(unmapped))))
+        sys.exit(2)
+
+    # the merges below need a unique index
+    trn_link_df = trn_link_df.reset_index(drop=True)
+
     # add run_per_hr to make things easier
     trn_link_df["run_per_hr"] = 0.0
     trn_link_df.loc[ trn_link_df["FREQ"] > 0, "run_per_hr" ] = 60.0/trn_link_df["FREQ"]
 
-    orig_cols = list(trn_link_df.columns.values)
-
-    for pseudo_line in pseudo_lines:
-        mode_num         = pseudo_line[0]
-        pseudo_line_name = pseudo_line[1]
-        period           = pseudo_line[2]
-        seq_last_board   = pseudo_line[3]
-        seq_first_exit   = pseudo_line[4]
-
-        if pseudo_line_name not in PSEUDO_LINE_MAPPING:
-            logging.fatal("{} is not configured in PSEUDO_LINE_MAPPING".format(pseudo_line_name))
-            sys.exit(2)
-
-        # Look it up in the mapping
-        start_line_re = PSEUDO_LINE_MAPPING[pseudo_line_name][0]
-        end_line_re   = PSEUDO_LINE_MAPPING[pseudo_line_name][1]
-
-        pseudo_line_df = trn_link_df.loc[ (trn_link_df["NAME"]==pseudo_line_name)&(trn_link_df["period"]==period), 
-            ["NAME","SEQ","period","FREQ","run_per_hr","A","B","AB_BRDA","AB_XITB","AB_VOL"]]
-        pseudo_run_per_hr = pseudo_line_df["run_per_hr"].mean()
-
+    mapping_df = pd.DataFrame.from_dict(dict((name, (mapping + (None,))[:3]) for name, mapping in PSEUDO_LINE_MAPPING.items()),
+                                        orient="index", columns=["start_line_re","end_line_re","transfer_stop"])
+    pseudo_lines_df = pd.merge(left    =pseudo_lines_df,
+                               right   =mapping_df,
+                               left_on ="NAME",
+                               right_index=True,
+                               how     ="left")
+
+    pseudo_link_df = pd.merge(left =trn_link_df[["NAME","SEQ","period","FREQ","run_per_hr","A","B","AB_BRDA","AB_XITB","AB_VOL"]],
+                              right=pseudo_lines_df[["NAME","period","seq_last_board","seq_first_exit","start_line_re","end_line_re","transfer_stop"]],
+                              on   =["NAME","period"],
+                              how  ="inner")
+    pseudo_link_df["pseudo_run_per_hr"] = pseudo_link_df.groupby(["NAME","period"], observed=True)["run_per_hr"].transform("mean")
+
+    # Multiple possible transfer stops -- see if one is specified
+    multiple_transfer = pseudo_lines_df["seq_last_board"] < pseudo_lines_df["seq_first_exit"]-1
+    if (multiple_transfer & pseudo_lines_df["transfer_stop"].isnull()).any():
+        logging.fatal("Multiple possible transfer stops; specify the transfer stop in PSEUDO_LINE_MAPPING:\n{}".format(
+                      pseudo_lines_df.loc[multiple_transfer & pseudo_lines_df["transfer_stop"].isnull()]))
+    if (multiple_transfer & pseudo_lines_df["transfer_stop"].notnull()).any():
+        transfer_df = pseudo_link_df.loc[ pseudo_link_df["seq_last_board"] < pseudo_link_df["seq_first_exit"]-1 ]
+        transfer_df = pd.concat([
+            transfer_df.loc[ transfer_df["B"]==transfer_df["transfer_stop"] ].groupby(["NAME","period"], observed=True)["SEQ"].first().rename("seq_last_board"),
+            transfer_df.loc[ transfer_df["A"]==transfer_df["transfer_stop"] ].groupby(["NAME","period"], observed=True)["SEQ"].first().rename("seq_first_exit")],
+            axis=1).reset_index()
+        logging.debug("Multiple possible transfer stops; PSEUDO_LINE_MAPPING lookup used to determine last board/first exit:\n{}".format(transfer_df))
+
+        pseudo_link_df = pd.merge(left=pseudo_link_df, right=transfer_df, on=["NAME","period"], how="left", suffixes=["","_transfer"])
+        for seq_col in ["seq_last_board","seq_first_exit"]:
+            pseudo_link_df[seq_col] = pseudo_link_df[seq_col+"_transfer"].fillna(pseudo_link_df[seq_col])
+            pseudo_link_df.drop(columns=[seq_col+"_transfer"], inplace=True)
+
+    for pseudo_line in pseudo_link_df.groupby(["NAME","period"], observed=True).first().reset_index().itertuples():
         logging.info("Moving ridership for pseudo line {} period {} run_per_hr {} last board {}/first exit {}".format(
-              pseudo_line_name, period, pseudo_run_per_hr, seq_last_board, seq_first_exit))
-        logging.info("  Start line regex: {}".format(start_line_re))
-        logging.info("  End line regex: {}".format(end_line_re))
-
-        # Multiple possible transfer stops -- see if one is specified
-        if seq_last_board < seq_first_exit-1:
-            if len(PSEUDO_LINE_MAPPING[pseudo_line_name])>2:
-                transfer_stop = PSEUDO_LINE_MAPPING[pseudo_line_name][2]
-                seq_last_board = pseudo_line_df.loc[ pseudo_line_df["B"]==transfer_stop].iloc[0]["SEQ"]
-                seq_first_exit = pseudo_line_df.loc[ pseudo_line_df["A"]==transfer_stop].iloc[0]["SEQ"]
-                logging.debug("Multiple possible transfer stops; PSEUDO_LINE_MAPPING lookup used to determine last board {}/first exit {}".format(seq_last_board, seq_first_exit))
-            else:
-                logging.fatal("Multiple possible transfer stops; specify the transfer stop in PSEUDO_LINE_MAPPING")
-
-        # preparing for join -- everybody gets off at transfer point and on at transfer point
-        pseudo_line_df.loc[ pseudo_line_df["SEQ"] == seq_last_board, "AB_XITB" ] = pseudo_line_df["AB_VOL"]
-        pseudo_line_df.loc[ pseudo_line_df["SEQ"] == seq_first_exit, "AB_BRDA" ] = pseudo_line_df["AB_VOL"]
-
-        # create column that contains start_line_re for board stops, end_line_re for exit stops
-        pseudo_line_df["name_re"] = ""
-        pseudo_line_df.loc[ pseudo_line_df["SEQ"] <= seq_last_board, "name_re"] = start_line_re
-        pseudo_line_df.loc[ pseudo_line_df["SEQ"] >= seq_first_exit, "name_re"] = end_line_re
-        pseudo_line_df.sort_values(by="SEQ", inplace=True)
-        logging.debug("\n{}".format(pseudo_line_df))
-
-        # create column that contains start_line_re if name matches, end_line_re if name matches, "" otherwise
-        trn_link_df["name_re"] = ""
-        trn_link_df.loc[ trn_link_df["NAME"].str.match(start_line_re)==True, "name_re"] = start_line_re
-        trn_link_df.loc[ trn_link_df["NAME"].str.match(  end_line_re)==True, "name_re"] = end_line_re
-        
-        # join it on the pseudo line
-        trn_link_df = pd.merge(left     =trn_link_df,
-                               right    =pseudo_line_df[["period","run_per_hr","name_re","A","B","SEQ","AB_BRDA","AB_XITB","AB_VOL"]],
-                               on       =["period","name_re","A","B"],
-                               how      ="outer",
-                               suffixes =["","_pseudo"],
-                               indicator=True)
-
-        debug_df = trn_link_df.loc[trn_link_df["_merge"] != "left_only",
-              ["NAME","period","SEQ","FREQ","run_per_hr","A","B","AB_BRDA","AB_XITB","AB_VOL",
-               "run_per_hr_pseudo","SEQ_pseudo","AB_BRDA_pseudo","AB_XITB_pseudo","AB_VOL_pseudo","_merge"]].sort_values(by="SEQ_pseudo")
-        logging.debug("BEFORE\n{}".format(debug_df))
-
-        # count the matches for each link
-        match_group = trn_link_df.loc[ trn_link_df["_merge"] != "left_only" ].groupby(["A","B"])
-        match_agg_df = match_group.agg({"NAME":"count", "run_per_hr":"sum"})
-
-        logging.debug("match_agg_df:\n{}".format(match_agg_df))
-
+              pseudo_line.NAME, pseudo_line.period, pseudo_line.pseudo_run_per_hr, pseudo_line.seq_last_board, pseudo_line.seq_first_exit))
+        logging.info("  Start line regex: {}".format(pseudo_line.start_line_re))
+        logging.info("  End line regex: {}".format(pseudo_line.end_line_re))
+
+    # preparing for join -- everybody gets off at transfer point and on at transfer point
+    pseudo_link_df.loc[ pseudo_link_df["SEQ"] == pseudo_link_df["seq_last_board"], "AB_XITB" ] = pseudo_link_df["AB_VOL"]
+    pseudo_link_df.loc[ pseudo_link_df["SEQ"] == pseudo_link_df["seq_first_exit"], "AB_BRDA" ] = pseudo_link_df["AB_VOL"]
+
+    # create column that contains start_line_re for board stops, end_line_re for exit stops
+    pseudo_link_df["name_re"] = ""
+    pseudo_link_df.loc[ pseudo_link_df["SEQ"] <= pseudo_link_df["seq_last_board"], "name_re"] = pseudo_link_df["start_line_re"]
+    pseudo_link_df.loc[ pseudo_link_df["SEQ"] >= pseudo_link_df["seq_first_exit"], "name_re"] = pseudo_link_df["end_line_re"]
+    pseudo_link_df.sort_values(by=["NAME","period","SEQ"], inplace=True)
+    logging.debug("\n{}".format(pseudo_link_df))
+
+    # match each pseudo line's regexes against the line names once -- end_line_re wins if both match
+    line_names = trn_link_df["NAME"].dropna().unique()
+    name_match_list = []
+    for pseudo_line_name in pseudo_lines_df["NAME"].unique():
+        for name_re_col in ["start_line_re","end_line_re"]:
+            name_re  = PSEUDO_LINE_MAPPING[pseudo_line_name][0 if name_re_col=="start_line_re" else 1]
+            matcher  = re.compile(name_re)
+            matched  = [line_name for line_name in line_names if matcher.match(line_name)]
+            name_match_list.append(pd.DataFrame({"pseudo_NAME":pseudo_line_name, "name_re":name_re, "NAME":matched,
+                                                 "end_match":name_re_col=="end_line_re"}))
+    name_match_df = pd.concat(name_match_list, ignore_index=True)
+    name_match_df = name_match_df.sort_values(by="end_match").drop_duplicates(subset=["pseudo_NAME","NAME"], keep="last")
+    logging.debug("name_match_df:\n{}".format(name_match_df))
+
+    # the actual links for those names, joined to the pseudo links on period, name_re, A and B
+    actual_link_df = pd.merge(left =trn_link_df[["NAME","period","A","B","run_per_hr"]].reset_index().rename(columns={"index":"link_index"}),
+                              right=name_match_df[["pseudo_NAME","name_re","NAME"]],
+                              on   ="NAME",
+                              how  ="inner")
+    match_df = pd.merge(left     =pseudo_link_df.rename(columns={"NAME":"pseudo_NAME"}),
+                        right    =actual_link_df,
+                        on       =["pseudo_NAME","period","name_re","A","B"],
+                        how      ="left",
+                        suffixes =["_pseudo",""],
+                        indicator=True)
+    logging.debug("BEFORE\n{}".format(match_df.sort_values(by=["pseudo_NAME","period","SEQ"])))
+
+    # count the matches for each pseudo link
+    match_agg_df = match_df.groupby(["pseudo_NAME","period","A","B"], observed=True).agg(
+        {"NAME":"count", "run_per_hr":"sum", "pseudo_run_per_hr":"first"}).reset_index()
+    logging.debug("match_agg_df:\n{}".format(match_agg_df))
+
+    if match_agg_df["NAME"].max() > 1:
+        logging.fatal("TODO: NAME count > 1 not implemented\n{}".format(match_agg_df.loc[ match_agg_df["NAME"] > 1 ]))
+        sys.exit()
+
+    # check that the actual links have the same runs per hour as the pseudo links
+    match_agg_df["run_per_hr_diff"] = match_agg_df["run_per_hr"] - match_agg_df["pseudo_run_per_hr"]
+    match_agg_df.loc[ abs(match_agg_df["run_per_hr_diff"]) < 0.01, "run_per_hr_diff"] = 0
+
+    for (pseudo_line_name, period), pseudo_agg_df in match_agg_df.groupby(["pseudo_NAME","period"], observed=True):
         # check that we found actual links for every pseudo link
-        pseudo_link_with_missing_actual = match_agg_df.loc[match_agg_df["NAME"] < 1].reset_index()
+        pseudo_link_with_missing_actual = pseudo_agg_df.loc[pseudo_agg_df["NAME"] < 1]
         if len(pseudo_link_with_missing_actual) > 0:
             # let a few link slide
             if len(pseudo_link_with_missing_actual) <= 5:
@@ -188,16 +249,8 @@ def move_pseudo_line_ridership(trn_link_df, pseudo_lines):
             else:
                 logging.fatal("TODO: NAME count < 0 shouldn't happen")
                 sys.exit()
-        if match_agg_df["NAME"].max() != 1:
-            logging.fatal("TODO: NAME count > 1 not implemented")
-            sys.exit()
-
-        # check that the actual links have the same runs per hour as the pseudo links
-        match_agg_df["run_per_hr_diff"] = match_agg_df["run_per_hr"] - pseudo_run_per_hr
-        match_agg_df.loc[ abs(match_agg_df["run_per_hr_diff"]) < 0.01, "run_per_hr_diff"] = 0
-        logging.debug("match_agg_df:\n{}".format(match_agg_df))
 
-        mismatch_run_per_hr = match_agg_df.loc[ match_agg_df["run_per_hr_diff"] != 0 ].reset_index()
+        mismatch_run_per_hr = pseudo_agg_df.loc[ pseudo_agg_df["run_per_hr_diff"] != 0 ]
         if len(mismatch_run_per_hr) > 0:
             # let a few links slide
             if len(mismatch_run_per_hr) <= 5:
@@ -210,23 +263,91 @@ def move_pseudo_line_ridership(trn_link_df, pseudo_lines):
                 logging.fatal("Mismatch run_per_hr between pseudo line and matching line\n{}".format(mismatch_run_per_hr))
                 sys.exit()
 
-        # add psuedo line boards, exits and volums to other line
-        trn_link_df.loc[trn_link_df["_merge"]=="both", "AB_BRDA"] = trn_link_df["AB_BRDA"] + trn_link_df["AB_BRDA_pseudo"]
-        trn_link_df.loc[trn_link_df["_merge"]=="both", "AB_XITB"] = trn_link_df["AB_XITB"] + trn_link_df["AB_XITB_pseudo"]
-        trn_link_df.loc[trn_link_df["_merge"]=="both", "AB_VOL" ] = trn_link_df["AB_VOL" ] + trn_link_df["AB_VOL_pseudo" ]
+    # add psuedo line boards, exits and volums to other line
+    # pseudo links without an actual link are errors that we're ignoring
+    match_df = match_df.loc[ match_df["_merge"]=="both" ]
+    pseudo_ridership_df = match_df.groupby("link_index")[["AB_BRDA","AB_XITB","AB_VOL"]].sum()
+    trn_link_df.loc[pseudo_ridership_df.index, ["AB_BRDA","AB_XITB","AB_VOL"]] += pseudo_ridership_df.values
 
-        debug_df = trn_link_df.loc[trn_link_df["_merge"] != "left_only",
-              ["NAME","period","SEQ","FREQ","run_per_hr","A","B","AB_BRDA","AB_XITB","AB_VOL",
-               "run_per_hr_pseudo","SEQ_pseudo","AB_BRDA_pseudo","AB_XITB_pseudo","AB_VOL_pseudo","_merge"]].sort_values(by="SEQ_pseudo")
-        logging.debug("AFTER\n{}".format(debug_df))
-
-        # drop the links that are right_only -- those are errors that we're ignoring
-        trn_link_df = trn_link_df.loc[ trn_link_df["_merge"] != "right_only" ]
-        # done with the pseudo line for this time period -- remove it, and go back to original columns
-        trn_link_df = trn_link_df.loc[(trn_link_df["NAME"]!=pseudo_line_name)|(trn_link_df["period"]!=period), orig_cols]
+    # done with the pseudo lines -- remove them
+    pseudo_line_keys = pd.MultiIndex.from_frame(pseudo_lines_df[["NAME","period"]])
+    trn_link_df = trn_link_df.loc[ ~pd.MultiIndex.from_frame(trn_link_df[["NAME","period"]]).isin(pseudo_line_keys) ]
 
     return trn_link_df
 
+def crowding_factor(variant, vol, period_seatcap):
+    """
+    Returns the crowding factor for the given variant (see CROWDING_VARIANTS) as a numpy array,
+    given numpy arrays of link volumes and seated capacities over the time period.
+    Links that aren't over seated capacity have a crowding factor of 1.0
+    """
+    params = variant.get("params", {})
+    with np.errstate(divide="ignore", invalid="ignore"):
+        load_seatcap = vol/period_seatcap
+        seated       = np.minimum(period_seatcap, vol)
+        standing     = np.maximum(vol-period_seatcap, 0)
+
+        if variant["curve"] == "ukdft":
+            # cf_ukdft = ((period_seatcap*sit) + ((ab_vol-period_seatcap)*stand)) / ab_vol
+            sit   = np.ones(len(vol))
+            stand = np.ones(len(vol))
+            for (min_load, sit_multiplier, stand_multiplier) in params.get("steps", UKDFT_STEPS):
+                sit  [ load_seatcap >= min_load ] = sit_multiplier
+                stand[ load_seatcap >= min_load ] = stand_multiplier
+            crowded_factor = ((seated*sit) + (standing*stand)) / vol
+
+        elif variant["curve"] == "metrolinx":
+            (seated_a,   seated_b,   seated_c  ) = params.get("seated",   METROLINX_PARAMS["seated"  ])
+            (standing_a, standing_b, standing_c) = params.get("standing", METROLINX_PARAMS["standing"])
+            crowded_factor = (((seated_a   + (seated_b  *np.power(load_seatcap, seated_c  ))) * seated) + \
+                              ((standing_a + (standing_b*np.power(load_seatcap, standing_c))) * standing)) / vol
+
+        else:
+            raise ValueError("Unknown crowding curve {}; expected one of {}".format(variant["curve"], CROWDING_CURVES))
+
+        factor = np.where(vol > period_seatcap, crowded_factor, 1.0)
+
+    if "max_factor" in variant:
+        factor = np.minimum(factor, variant["max_factor"])
+    return factor
+
+def calculate_crowding(trn_link_df, variants):
+    """
+    Calculates the crowding factor, effective in-vehicle time and crowding penalty for each of the given variants
+    (see CROWDING_VARIANTS) over all links.  Requires columns AB_VOL, PERIODCAP, VEHCAP, veh_type_updated, seatcap and ivtt_hours.
+
+    Returns trn_link_df with columns crowdingfactor_[name], effective_ivtt_[name] and crowding_penalty_hrs_[name]
+    added for each variant, plus period_seatcap_[name] for variants with seated capacity assumptions.
+    """
+    vol        = trn_link_df["AB_VOL"].values.astype(np.float64)
+    ivtt_hours = trn_link_df["ivtt_hours"].values
+    vehicles   = (trn_link_df["PERIODCAP"]/trn_link_df["VEHCAP"]).values  # vehicles in time period
+
+    new_columns = collections.OrderedDict()
+    factors     = collections.OrderedDict()
+    for variant in variants:
+        seatcap = trn_link_df["seatcap"]
+        if "seatcap" in variant:
+            seatcap = trn_link_df["veh_type_updated"].map(variant["seatcap"]).fillna(seatcap)
+        period_seatcap = vehicles*seatcap.values
+        if "seatcap_scale" in variant:
+            period_seatcap = period_seatcap*variant["seatcap_scale"]
+        if "seatcap" in variant or "seatcap_scale" in variant:
+            new_columns["period_seatcap_{}".format(variant["name"])] = period_seatcap
+
+        factors[variant["name"]] = crowding_factor(variant, vol, period_seatcap)
+        logging.debug("Calculated crowding factors for {}".format(variant))
+
+    # calculating effective ivtt = ivtt * crowding factor
+    for name, factor in factors.items():
+        new_columns["crowdingfactor_{}".format(name)] = factor
+    for name, factor in factors.items():
+        new_columns["effective_ivtt_{}".format(name)] = ivtt_hours*factor
+    for name, factor in factors.items():
+        new_columns["crowding_penalty_hrs_{}".format(name)] = new_columns["effective_ivtt_{}".format(name)] - ivtt_hours
+
+    return pd.concat([trn_link_df, pd.DataFrame(new_columns, index=trn_link_df.index)], axis=1)
+
 
 if __name__ == '__main__':
     pd.options.display.width = 1000
@@ -237,6 +358,7 @@ if __name__ == '__main__':
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('project_dir', type=str, help="Project directory")
     parser.add_argument('--no_pseudo_move', action='store_true', help="Don't move pseudo line ridership into real lines")
+    parser.add_argument('--crowding_variants', type=str, help="json file with a list of crowding variants to add to CROWDING_VARIANTS")
     my_args = parser.parse_args()
 
     metrics_dir = os.path.join(my_args.project_dir, "OUTPUT", "metrics")
@@ -275,16 +397,9 @@ if __name__ == '__main__':
     transit_seatcap_df.rename(columns={"VEHTYPE":"veh_type_updated", "100pctCapacity":"standcap"},inplace=True)
     logging.info("Read {}\n{}".format(SEATCAP_FILE, transit_seatcap_df.head()))
 
-    # read the transit files
-    all_trn_df = pd.DataFrame()
-    for timeperiod in ['AM','EA','EV','MD','PM']:
-        trn_file = os.path.join(trn_dir, 'trnlink{}_ALLMSA.dbf'.format(timeperiod))
-        dbf      = simpledbf.Dbf5(trn_file)
-        trn_df   = dbf.to_dataframe()
-        trn_df["period"] = timeperiod
-        logging.info("Read {} links from {}".format(len(trn_df), trn_file))
-        # print(trn_df.head())
-        all_trn_df = pd.concat([all_trn_df, trn_df])
+    # read the transit files -- period categories are in alphabetical order so the outputs sort as before
+    all_trn_df = transitlinks.read_transit_links(os.path.join(trn_dir, "trnlink{}_ALLMSA.dbf"),
+                                                 timeperiods=['AM','EA','EV','MD','PM'])
     logging.info("Read {} total links".format(len(all_trn_df)))
 
     # drop columns we won't be updating/using so they don't cause confusion
@@ -293,10 +408,11 @@ if __name__ == '__main__':
     # sort by mode, line name, time period, sequence
     all_trn_df.sort_values(by=["MODE","NAME","period","SEQ"], inplace=True)
 
-    pseudo_lines = find_pseudo_lines(all_trn_df)
+    pseudo_lines_df = find_pseudo_lines(all_trn_df)
+    logging.info("Found {} pseudo lines\n{}".format(len(pseudo_lines_df), pseudo_lines_df))
     if my_args.no_pseudo_move:
         logging.info("Moving pseudo line ridership into actual lines suppressed by argument")
-    elif len(pseudo_lines) > 0:
+    elif len(pseudo_lines_df) > 0:
 
         # custom override for project
         if "7000_Resilience_BARTCaldecott" in my_args.project_dir:
@@ -306,7 +422,7 @@ if __name__ == '__main__':
         if os.path.basename(my_args.project_dir).startswith("2025"):
             PSEUDO_LINE_MAPPING["120_OR_YER"] = ("120_YELLOW[1E]?$","120_ORANGE[A]?$")   # Yellow/SFO - MacArthur - Orange/Richmond
 
-        all_trn_df = move_pseudo_line_ridership(all_trn_df, pseudo_lines)
+        all_trn_df = move_pseudo_line_ridership(all_trn_df, pseudo_lines_df)
 
     # vehicle type overrides
 
@@ -391,50 +507,25 @@ if __name__ == '__main__':
     all_trn_df["load_standcap"]  = all_trn_df["AB_VOL"]/all_trn_df["period_standcap"]                  # standing load over time period
     all_trn_df["ivtt_hours"]     = all_trn_df["AB_VOL"]*(all_trn_df["TIME"]/100)/60                    # number of trips * time per trip
 
-    # setting default crowding factors
-    
-    # calculating crowding factors based on methodologies from UK DFT and Metrolinx
-    all_trn_df["crowdingfactor_metrolinx"        ] = 1.0
-
-    # temp variable: max(0, AB_VOL-period_seatcap)
-    all_trn_df["vol_minus_seatcap"] = all_trn_df["AB_VOL"]-all_trn_df["period_seatcap"]
-    all_trn_df.loc[ all_trn_df["vol_minus_seatcap"]<0, "vol_minus_seatcap"] = 0
-
-    all_trn_df.loc[ all_trn_df["AB_VOL"] > all_trn_df["period_seatcap"], "crowdingfactor_metrolinx"] = \
-        (((1.0 + (0.1*all_trn_df["load_seatcap"].pow(1.4))) * all_trn_df[["period_seatcap", "AB_VOL"]].min(axis=1)) + \
-         ((1.4 + (0.2*all_trn_df["load_seatcap"].pow(3.4))) * all_trn_df["vol_minus_seatcap"])) / all_trn_df["AB_VOL"]
-
-    
-    # cf_metrolinx_max2pt5 = min(cf_metrolinx,2.5)
-    all_trn_df["crowdingfactor_metrolinx_max2pt5"] = all_trn_df["crowdingfactor_metrolinx"]
-    all_trn_df.loc[ all_trn_df["crowdingfactor_metrolinx"] > 2.5, "crowdingfactor_metrolinx_max2pt5"] = 2.5
-
-    all_trn_df["sit"  ] = 1.0
-    all_trn_df["stand"] = 1.0
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 1.0, ["sit","stand"]] = [1.08, 1.50]
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 1.2, ["sit","stand"]] = [1.23, 1.67]
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 1.4, ["sit","stand"]] = [1.38, 1.85]
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 1.6, ["sit","stand"]] = [1.53, 2.02]
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 1.8, ["sit","stand"]] = [1.68, 2.20]
-    all_trn_df.loc[ all_trn_df["load_seatcap"] >= 2.0, ["sit","stand"]] = [1.83, 2.37]
-
-    # cf_ukdft = ((period_seatcap*sit) + ((ab_vol-period_seatcap)*stand)) / ab_vol
-    all_trn_df["crowdingfactor_ukdft"] = 1.0
-    all_trn_df.loc[ all_trn_df["AB_VOL"] > all_trn_df["period_seatcap"], "crowdingfactor_ukdft"] = \
-        ((all_trn_df["period_seatcap"]*all_trn_df["sit"]) + \
-         ((all_trn_df["AB_VOL"]-all_trn_df["period_seatcap"])*all_trn_df["stand"])) / all_trn_df["AB_VOL"]
-    
-    # calculating effective ivtt = ivtt * crowding factor
-    all_trn_df["effective_ivtt_ukdft"            ] = all_trn_df["ivtt_hours"]*all_trn_df["crowdingfactor_ukdft"            ]
-    all_trn_df["effective_ivtt_metrolinx"        ] = all_trn_df["ivtt_hours"]*all_trn_df["crowdingfactor_metrolinx"        ]
-    all_trn_df["effective_ivtt_metrolinx_max2pt5"] = all_trn_df["ivtt_hours"]*all_trn_df["crowdingfactor_metrolinx_max2pt5"]
+    # calculating crowding factors based on methodologies from UK DFT and Metrolinx, plus any additional variants
+    crowding_variants = list(CROWDING_VARIANTS)
+    if my_args.crowding_variants:
+        with open(my_args.crowding_variants) as variants_file:
+            crowding_variants.extend(json.load(variants_file))
+        logging.info("Read {} crowding variants from {}".format(len(crowding_variants)-len(CROWDING_VARIANTS), my_args.crowding_variants))
+    variant_names = [variant["name"] for variant in crowding_variants]
+    if len(set(variant_names)) < len(variant_names):
+        logging.fatal("Crowding variant names must be unique: {}".format(variant_names))
+        sys.exit(2)
+    for variant in crowding_variants:
+        if variant.get("curve") not in CROWDING_CURVES:
+            logging.fatal("Crowding variant {} curve must be one of {}".format(variant, CROWDING_CURVES))
+            sys.exit(2)
 
-    all_trn_df["crowding_penalty_hrs_ukdft"            ] = all_trn_df["effective_ivtt_ukdft"]             - all_trn_df["ivtt_hours"]
-    all_trn_df["crowding_penalty_hrs_metrolinx"        ] = all_trn_df["effective_ivtt_metrolinx"]         - all_trn_df["ivtt_hours"]
-    all_trn_df["crowding_penalty_hrs_metrolinx_max2pt5"] = all_trn_df["effective_ivtt_metrolinx_max2pt5"] - all_trn_df["ivtt_hours"]
+    all_trn_df = calculate_crowding(all_trn_df, crowding_variants)
 
     # drop these to be consistent with previous output
-    # all_trn_df.drop(columns=["veh_type_updated", "vol_minus_seatcap"], inplace=True)
+    # all_trn_df.drop(columns=["veh_type_updated"], inplace=True)
 
     # sort by mode, line name, time period, sequence
     all_trn_df = all_trn_df.astype(dtype={"MODE":"int16","PLOT":"int16","COLOR":"int16","STOP_A":"int16","STOP_B":"int16","SEQ":"int16"})
@@ -447,9 +538,9 @@ if __name__ == '__main__':
 
     # writing essential columns into output\metrics folder of the project
     transit_crowding_filename = os.path.join(metrics_dir, "transit_crowding.csv")
-    all_trn_df[['NAME', 'SYSTEM','SEQ','A','B','AB_BRDA','period','ivtt_hours',\
-                'effective_ivtt_ukdft','effective_ivtt_metrolinx', 'effective_ivtt_metrolinx_max2pt5',\
-                'crowding_penalty_hrs_ukdft', 'crowding_penalty_hrs_metrolinx', 'crowding_penalty_hrs_metrolinx_max2pt5'
-              ]].to_csv(transit_crowding_filename, header=True, index=False)
+    all_trn_df[['NAME', 'SYSTEM','SEQ','A','B','AB_BRDA','period','ivtt_hours'] + \
+               ['effective_ivtt_{}'.format(name) for name in variant_names] + \
+               ['crowding_penalty_hrs_{}'.format(name) for name in variant_names]
+              ].to_csv(transit_crowding_filename, header=True, index=False)
     logging.info("Wrote {} lines to {}".format(len(all_trn_df), transit_crowding_filename))
 
@@ -0,0 +1,136 @@
+"""
+  Reads the transit assignment link files, trn\\trnlink[timeperiod]_[suffix].dbf (e.g. trnlinkAM_ALLMSA.dbf or
+  trnlinkam_wlk_exp_wlk.dbf), for the metrics scripts.
+
+  The files for the timeperiods are read at the same time by a pool of processes and returned as one
+  DataFrame with a categorical period column.  If a csv or parquet equivalent of a dbf exists
+  (e.g. trnlinkAM_ALLMSA.parquet), that's read instead.  dbfs are read with pyogrio if it's installed
+  and otherwise decoded with numpy.
+
+  Usage:
+
+    import transitlinks
+    trn_link_df = transitlinks.read_transit_links(os.path.join("trn", "trnlink{}_ALLMSA.dbf"))
+
+"""
+import collections, multiprocessing, os, struct
+import numpy, pandas
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+TIMEPERIODS = ['EA','AM','MD','PM','EV']
+
+# in order of preference
+FILE_EXTENSIONS = [".parquet", ".csv", ".dbf"]
+
+def find_transit_link_file(link_file):
+    """
+    Returns the preferred existing file of link_file and its equivalents with the other FILE_EXTENSIONS.
+    Raises IOError if none exist.
+    """
+    file_base = os.path.splitext(link_file)[0]
+    for extension in FILE_EXTENSIONS:
+        if os.path.exists(file_base + extension): return file_base + extension
+    raise IOError("No transit link file found for {} (tried {})".format(file_base, ", ".join(FILE_EXTENSIONS)))
+
+def read_dbf(dbf_file, columns=None):
+    """
+    Returns the given dbf file as a pandas DataFrame, with just the given columns if passed.
+    The records are decoded a column at a time with numpy: numeric fields become int64 (no decimals)
+    or float64, logical fields become bool and everything else becomes stripped strings.
+    """
+    with open(dbf_file, "rb") as dbf:
+        num_records, header_len, record_len = struct.unpack("<4xIHH20x", dbf.read(32))
+        fields = []  # (name, type, offset, length, decimals)
+        offset = 1   # the first byte of a record is the deletion flag
+        while True:
+            descriptor = dbf.read(32)
+            if descriptor[0:1] in [b"\r", b""]: break
+            name     = str(descriptor[:11].split(b"\0")[0].decode("ascii"))
+            length, decimals = struct.unpack("<BB", descriptor[16:18])
+            fields.append((name, descriptor[11:12].decode("ascii"), offset, length, decimals))
+            offset += length
+        dbf.seek(header_len)
+        records = numpy.frombuffer(dbf.read(num_records*record_len), dtype=numpy.dtype({
+            "names"   : ["_deleted"] + [field[0] for field in fields],
+            "formats" : ["S1"] + ["S{}".format(field[3]) for field in fields],
+            "offsets" : [0] + [field[2] for field in fields],
+            "itemsize": record_len}), count=num_records)
+    records = records[ records["_deleted"] != b"*" ]
+
+    column_arrays = collections.OrderedDict()
+    for (name, field_type, offset, length, decimals) in fields:
+        if columns and name not in columns: continue
+        raw = numpy.char.strip(records[name])
+        if field_type in ["N","F"]:
+            blank  = (raw == b"")
+            values = numpy.where(blank, b"nan", raw).astype(numpy.float64)
+            if field_type == "N" and decimals == 0 and not blank.any():
+                values = values.astype(numpy.int64)
+        elif field_type == "L":
+            values = numpy.isin(raw, [b"T",b"t",b"Y",b"y"])
+        else:
+            values = numpy.char.decode(raw, "latin-1").astype(object)
+        column_arrays[name] = values
+    return pandas.DataFrame(column_arrays, columns=columns if columns else list(column_arrays.keys()))
+
+def read_transit_link_file(link_file, columns=None):
+    """
+    Returns the given transit link file (parquet, csv or dbf) as a pandas DataFrame, with just the given columns if passed.
+    """
+    extension = os.path.splitext(link_file)[1].lower()
+    if extension == ".parquet":
+        return pandas.read_parquet(link_file, columns=columns)
+    if extension == ".csv":
+        return pandas.read_csv(link_file, usecols=columns)
+
+    if pyogrio:
+        link_df = pyogrio.read_dataframe(link_file, columns=columns, read_geometry=False)
+        # match the numpy decoder
+        for column in link_df.select_dtypes(include=["integer"]).columns:
+            link_df[column] = link_df[column].astype(numpy.int64)
+        return link_df
+    return read_dbf(link_file, columns)
+
+def _read_period(args):
+    """
+    Pool worker for read_transit_links(): reads the transit link file for one timeperiod.
+    """
+    (link_file, columns) = args
+    link_df = read_transit_link_file(link_file, columns)
+    print("  Read {} links from {}".format(len(link_df), link_file))
+    return link_df
+
+def read_transit_links(link_file_pattern, timeperiods=TIMEPERIODS, columns=None, period_col="period", processes=None, pool=None):
+    """
+    Reads the transit link files for the given timeperiods, where link_file_pattern is the path of a file
+    with {} in place of the timeperiod, e.g. os.path.join(trn_dir, "trnlink{}_ALLMSA.dbf").
+    Equivalents with a preferred extension are read instead if they exist; see find_transit_link_file().
+
+    The files are read in parallel by processes processes (default: one per timeperiod).  Callers reading
+    several sets of files can pass their own multiprocessing.Pool as pool instead, which is left open.
+
+    Returns one pandas DataFrame with a categorical period_col column with the timeperiods as categories,
+    in the given order, and with just the given columns (plus period_col) if passed.
+    """
+    link_files = [find_transit_link_file(link_file_pattern.format(timeperiod)) for timeperiod in timeperiods]
+    if processes is None: processes = len(timeperiods)
+
+    if pool is not None:
+        link_dfs = pool.map(_read_period, [(link_file, columns) for link_file in link_files])
+    elif processes > 1:
+        pool     = multiprocessing.Pool(min(processes, len(timeperiods)))
+        link_dfs = pool.map(_read_period, [(link_file, columns) for link_file in link_files])
+        pool.close()
+        pool.join()
+    else:
+        link_dfs = [_read_period((link_file, columns)) for link_file in link_files]
+
+    periods = numpy.repeat(timeperiods, [len(link_df) for link_df in link_dfs])
+    trn_link_df = pandas.concat(link_dfs, ignore_index=True, sort=False)
+    trn_link_df[period_col] = pandas.Categorical(periods, categories=timeperiods)
+    print("Read {} total transit links".format(len(trn_link_df)))
+    return trn_link_df
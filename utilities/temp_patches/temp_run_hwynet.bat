@@ -70,6 +70,9 @@ copy "%BOX_USER%\Box\Modeling and Surveys\Development\Travel Model 1.5\Model_inp
 :: get the correct script
 ren CTRAMP\scripts\metrics\hwynet.py hwynet_old.py
 copy "%GITHUB_DIR%\hwynet.py" CTRAMP\scripts\metrics\hwynet.py
+:: hwynet.py imports these
+copy "%GITHUB_DIR%\loadednet.py" CTRAMP\scripts\metrics\loadednet.py
+copy "%GITHUB_DIR%\linkmapping.py" CTRAMP\scripts\metrics\linkmapping.py
 
 :: run hwynet.py
 call python ".\CTRAMP\scripts\metrics\hwynet.py" --filter %FUTURE% --year %MODEL_YEAR% hwy\iter%ITER%\avgload5period_vehclasses.csv
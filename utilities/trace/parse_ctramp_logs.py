@@ -2,25 +2,28 @@ USAGE = r"""
   Parses ctramp log and outputs trace information into csv files for debugging
 
   e.g. python parse_ctramp_logs.py base|build event-node0-tourDCMan.log
+       python parse_ctramp_logs.py base|build "logs/event-node*-tourDCMan.log"
+       python parse_ctramp_logs.py base|build logs
 
-  Note: python2 won't work because of the regex
-  It errors out with:
+  When multiple logs are given (e.g. one per JPPF node), they're parsed at the same time in a process pool
+  and outputs for the same household are merged in log file order.
 
-      File "X:\travel-model-one-master\utilities\check-network\parse_ctramp_logs.py", line 20, in <module>
-        UTILITY_RE     = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, FULL_UTILITY_RE_TXT))
-      File "C:\Python27\lib\re.py", line 194, in compile
-        return _compile(pattern, flags)
-      File "C:\Python27\lib\re.py", line 249, in _compile
-        p = sre_compile.compile(pattern, flags)
-      File "C:\Python27\lib\sre_compile.py", line 583, in compile
-        "sorry, but this version only supports 100 named groups"
-    AssertionError: sorry, but this version only supports 100 named groups
+  With --parquet, results are written to one dataset partitioned by base_or_build and model rather than
+  csv files per household, and the logs aren't copied.  Base and build can then be compared term by term with
 
-    Python3 works, however.
+  e.g. python parse_ctramp_logs.py base  logs_base  --parquet trace_utilities.parquet
+       python parse_ctramp_logs.py build logs_build --parquet trace_utilities.parquet
+       python parse_ctramp_logs.py diff --parquet trace_utilities.parquet   (writes trace_utilities_diff.csv)
+
+  With --hh and/or --purpose, only the matching blocks are read.  The byte offset of every block is saved
+  the first time in an index next to each log ([log].index.csv) so later runs seek straight to the blocks.
+
+  Utility lines are tokenized on whitespace and parsed straight into numpy buffers
+  rather than matched with a regex per alternative, so parse time is linear in the log size.
 
 """
 
-import argparse, re, os, shutil, sys
+import argparse, collections, glob, multiprocessing, re, os, shutil, sys, tempfile
 import numpy, pandas
 
 NUM_TAZ      = 1454
@@ -43,23 +46,103 @@ TOURMC_RE_TXT         = "(Utility Expressions for( Individual Non-Mandatory)? To
 TRIPMC_RE_TXT         = "(Utility Expressions for Trip Mode Choice Model for HH=(\d+), PersonNum=(\d+), PersonType=([ A-Za-z\-]+), TourPurpose=([A-Za-z\-_]+), TourId=(\d+), StopDestPurpose=([A-Za-z\-_]+), StopId=(\-?\d+)[.])"
 TRIPMC_ORIGDEST_RE_TXT= "(\s+(orig|origWalkSegment|dest|destWalkSegment): \s+(\d+))"
 
-# utility expression for one term - coefficient x variable
-UTILITY_RE_TXT        = "(\s+([\.\-0-9]+) [*]\s+(([\.\-0-9]+e[+-]\d\d)|NaN|Infinity))"
-# utility expression for all terms - expression number  (coefficient x variable)xNUM_DEST_ALT
-FULL_UTILITY_RE_TXT   = "(\d+)" + UTILITY_RE_TXT*NUM_DEST_ALT
-UTILITY_RE            = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, FULL_UTILITY_RE_TXT))
-# utility expression for tour mc terms - expression number  (coefficient x variable)NUM_MC_ALT
-MC_UTILITY_RE_TXT     = "(\d+)" + UTILITY_RE_TXT*NUM_MC_ALT
-MC_UTILITY_RE         = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, MC_UTILITY_RE_TXT))
-
-# utility express for total utility
-TOTAL_UTIL_RE_TXT     = "(\s+(([\.\-0-9]+e[+-]\d\d)|NaN|Infinity))"
-# utility expression for all terms
-TOTAL_UTILITY_RE_TXT  = "(Alt Utility)" + TOTAL_UTIL_RE_TXT*NUM_DEST_ALT
-TOTAL_UTILITY_RE      = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TOTAL_UTILITY_RE_TXT))
-# utility expression for all mode choice terms
-MC_TOTAL_UTILITY_RE_TXT = "(Alt Utility)" + TOTAL_UTIL_RE_TXT*NUM_MC_ALT
-MC_TOTAL_UTILITY_RE     = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, MC_TOTAL_UTILITY_RE_TXT))
+LINE_RE       = re.compile("{}(.*)$".format(DATE_LOG_TYPE_RE_TXT))
+TOUR_DC_RE    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TOURDC_RE_TXT))
+TOUR_MC_RE    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TOURMC_RE_TXT))
+TRIP_MC_RE    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TRIPMC_RE_TXT))
+TRIP_MC_OD_RE = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TRIPMC_ORIGDEST_RE_TXT))
+
+# marks header lines, for which the above regexes are checked
+HEADER_TXT    = "Utility Expressions for"
+
+# parsed rows held in memory per log before they're spilled to disk; a destination choice block is about 180,000
+MAX_ROWS_IN_MEMORY = 2000000
+
+# columns of the log index written by build_log_index()
+INDEX_COLS    = ["offset", "model", "purpose", "hh", "persnum", "tour_id", "dest_taz", "dest_subzone"]
+
+# separates the date/log type prefix from the rest of every log line
+LOG_TYPE_SEPARATOR    = ", INFO, "
+
+def parse_utility_line(line, num_alts):
+    """
+    Tokenizes one utility expression line into the row number and the coefficient, variable pairs for each alternative, e.g.
+    06-Aug-2019 09:24:58, INFO, 476         0.00000 *   2.01000e-01       0.00000 *           NaN       0.00000 *   2.01000e-01
+
+    Splitting on whitespace is linear in the line length, unlike a regex with num_alts groups.
+    Returns (row_num, numpy float64 array of length 2*num_alts with coefficient, variable interleaved)
+    NaN and Infinity variables are parsed by numpy.
+    """
+    tokens = line.split(LOG_TYPE_SEPARATOR, 1)[1].replace("*", " ").split()
+    values = numpy.array(tokens[1:2*num_alts+1], dtype=numpy.float64)
+    if len(values) != 2*num_alts:
+        raise ValueError("Expected {} alternatives but found {} in utility line for row {}".format(num_alts, len(values)/2.0, tokens[0]))
+    return (int(tokens[0]), values)
+
+def parse_total_utility_line(line, num_alts):
+    """
+    Tokenizes the total utility line into a numpy float64 array of length num_alts, e.g.
+    12-Jul-2019 18:19:15, INFO, Alt Utility            -1.00624e+03                   5.85899e+00                           NaN
+    """
+    tokens = line.split(LOG_TYPE_SEPARATOR, 1)[1].split()
+    assert(tokens[:2] == ["Alt", "Utility"])
+    values = numpy.array(tokens[2:num_alts+2], dtype=numpy.float64)
+    if len(values) != num_alts:
+        raise ValueError("Expected {} alternatives but found {} in total utility line".format(num_alts, len(values)))
+    return values
+
+def read_utility_block(file_object, num_rows, num_alts):
+    """
+    Reads the utility block following a "Utility Expressions for" line from the file_object:
+    five lines we don't care about, num_rows utility expression lines, a line of dashes and the total utility line.
+
+    The coefficients and variables are written directly into preallocated num_rows x num_alts numpy buffers.
+    Returns (lines_read, row_nums, coefficients, variables, total_utility)
+    """
+    # read 5 lines that we don't care about
+    for lines_read in range(1,6):
+        line = file_object.readline()
+
+    row_nums     = numpy.empty(num_rows, dtype=numpy.int64)
+    coefficients = numpy.empty((num_rows, num_alts), dtype=numpy.float64)
+    variables    = numpy.empty((num_rows, num_alts), dtype=numpy.float64)
+
+    # read utiltities
+    for row_idx in range(num_rows):
+        (row_nums[row_idx], values) = parse_utility_line(file_object.readline(), num_alts)
+        coefficients[row_idx,:] = values[0::2]
+        variables[row_idx,:]    = values[1::2]
+    lines_read += num_rows
+
+    # read 1 more lines that we don't care about, the dashes
+    line     = file_object.readline()
+    assert("----------------------------" in line)
+
+    # total utility
+    total_utility = parse_total_utility_line(file_object.readline(), num_alts)
+    lines_read += 2
+
+    return (lines_read, row_nums, coefficients, variables, total_utility)
+
+def utilities_to_dataframe(row_nums, row_names, coefficients, variables, total_utility, alt_columns):
+    """
+    Converts the arrays returned by read_utility_block into a long DataFrame with one row per (utility row, alternative)
+    followed by the "Total Utility" rows, which have row num -1 and coefficient 1.0.
+
+    alt_columns is a dict of column name -> scalar or array of length num_alts, which are placed between
+    the row description and coefficient columns.
+    """
+    (num_rows, num_alts) = coefficients.shape
+    row_descrs = numpy.array([row_names[row_num] for row_num in row_nums] + ["Total Utility"], dtype=object)
+
+    columns = collections.OrderedDict()
+    columns["row num"        ] = numpy.repeat(numpy.append(row_nums, -1), num_alts)
+    columns["row description"] = numpy.repeat(row_descrs, num_alts)
+    for colname, values in alt_columns.items():
+        columns[colname] = numpy.tile(values, num_rows+1) if numpy.ndim(values) > 0 else values
+    columns["coefficient"    ] = numpy.append(coefficients.ravel(), numpy.ones(num_alts))
+    columns["variable"       ] = numpy.append(variables.ravel(), total_utility)
+    return pandas.DataFrame(columns)
 
 def read_tour_mode_choice_logsum_lines(file_object, type_str, purpose, hh, persnum, ptype, destTaz, destSubz, base_or_build, log_file):
     """
@@ -1040,79 +1123,18 @@ def read_tour_mode_choice_logsum_lines(file_object, type_str, purpose, hh, persn
     if type_str == "NonMandLocChoice":
         ROW_NAMES = SHOPPING_ROW_NAMES
 
-    # read 5 lines that we don't care about
-    for lines_read in range(1,6):
-        line = file_object.readline().strip()
-        # print("{}   {}".format(lines_read, line[:30]))
-
-    row_alt_dicts = []
-
-    # read utiltities
-    for utils_read in range(1,len(ROW_NAMES)+1):
-        line     = file_object.readline().strip()
-        match    = MC_UTILITY_RE.match(line)
-        row_num   = int(match.group(2)) # row number
-        row_descr = ROW_NAMES[row_num]
-
-        full_idx  = 3  # coefficient x variable
-        for mode_alt in range(1, NUM_MC_ALT+1):
-            row_alt_dict = {}
-            row_alt_dict["row num"        ] = row_num
-            row_alt_dict["row description"] = row_descr
-            row_alt_dict["mode alt"       ] = mode_alt
-            row_alt_dict["dest taz"       ] = destTaz
-            row_alt_dict["dest subzone"   ] = destSubz
-            row_alt_dict["coefficient"    ] = float(match.group(full_idx+1))
-            row_alt_dict["variable"       ] = match.group(full_idx+2)
-            if row_alt_dict["variable"] == "Infinity":
-                row_alt_dict["variable"] = numpy.Infinity
-            elif row_alt_dict["variable"] == "NaN":
-                row_alt_dict["variable"] = numpy.NaN
-            else:
-                row_alt_dict["variable"] = float(row_alt_dict["variable"])
-
-            row_alt_dicts.append(row_alt_dict)
-
-            full_idx += 4 # go to next alt
     # 06-Aug-2019 09:24:58, INFO, 476         0.00000 *   2.01000e-01       0.00000 *           NaN       0.00000 *   2.01000e-01       0.00000 *           NaN
     # 06-Aug-2019 09:24:58, INFO, -----------------------------------------------------------------------------------------------------------------------------------
     # 06-Aug-2019 09:24:58, INFO, Alt Utility            -3.14411e+00                           NaN                  -4.22511e+00                           NaN                  -4.69850e+00                           NaN                           NaN                           NaN                           NaN                           NaN                           NaN                           NaN                           NaN                  -4.36949e+00                           NaN                           NaN                           NaN                           NaN                  -8.65800e+00                  -9.48385e+00                  -1.11842e+01
-
-    # read 1 more lines that we don't care about, the dashes
-    line     = file_object.readline().strip()
-    assert("----------------------------" in line)
-    lines_read += 1
-
-    # total utility
-    line     = file_object.readline().strip()
-    match    = MC_TOTAL_UTILITY_RE.match(line)
+    (lines_read, row_nums, coefficients, variables, total_utility) = read_utility_block(file_object, len(ROW_NAMES), NUM_MC_ALT)
 
     if destTaz == 1 and destSubz == 0:
-        print(match.groups())
-
-    full_idx = 3 # TOTAL_UTIL_RE_TXT
-    for mode_alt in range(1,NUM_MC_ALT+1):
-        row_alt_dict = {}
-        row_alt_dict["row num"        ] = -1
-        row_alt_dict["row description"] = "Total Utility"
-        row_alt_dict["mode alt"       ] = mode_alt
-        row_alt_dict["dest taz"       ] = destTaz
-        row_alt_dict["dest subzone"   ] = destSubz
-        row_alt_dict["coefficient"    ] = 1.0
-        row_alt_dict["variable"       ] = match.group(full_idx+1)
-        if row_alt_dict["variable"] == "Infinity":
-            row_alt_dict["variable"] = numpy.Infinity
-        elif row_alt_dict["variable"] == "NaN":
-            row_alt_dict["variable"] = numpy.NaN
-        else:
-            row_alt_dict["variable"] = float(row_alt_dict["variable"])
-        # print(row_alt_dict["variable"])
-
-        row_alt_dicts.append(row_alt_dict)
+        print(total_utility)
 
-        full_idx += 3 # go to next alt
-
-    df = pandas.DataFrame.from_records(row_alt_dicts)
+    df = utilities_to_dataframe(row_nums, ROW_NAMES, coefficients, variables, total_utility,
+                                collections.OrderedDict([("mode alt",     numpy.arange(1, NUM_MC_ALT+1)),
+                                                         ("dest taz",     destTaz),
+                                                         ("dest subzone", destSubz)]))
 
     # to keep reasonable, drop everything with coefficient == 0
     df = df.loc[ df.coefficient != 0]
@@ -1123,7 +1145,7 @@ def read_tour_mode_choice_logsum_lines(file_object, type_str, purpose, hh, persn
         print("head: \n{}".format(df.head(NUM_MC_ALT)))
         print("tail: \n{}".format(df.tail(NUM_MC_ALT)))
 
-    return (lines_read + utils_read, df)
+    return (lines_read, df)
 
 
 def read_trip_mode_choice_lines(file_object, type_str, trip_mc_od, purpose, hh, persnum, ptype, tour_purpose, tour_id, stopdest_purpose, stop_id, base_or_build, log_file):
@@ -1715,85 +1737,19 @@ def read_trip_mode_choice_lines(file_object, type_str, trip_mc_od, purpose, hh,
         print("read_trip_mode_choice_lines supports othmaint purpose only currently; skipping {}".format(purpose))
         return (0, 0)
 
-    # read 5 lines that we don't care about
-    for lines_read in range(1,6):
-        line = file_object.readline().strip()
-
-    row_alt_dicts = []
-    # read utiltities
-    for utils_read in range(1,len(ROW_NAMES)+1):
-        line     = file_object.readline().strip()
-        match    = MC_UTILITY_RE.match(line)
-        row_num   = int(match.group(2)) # row number
-        row_descr = ROW_NAMES[row_num]
-
-        full_idx  = 3  # coefficient x variable
-        for mode_alt in range(1, NUM_MC_ALT+1):
-            row_alt_dict = {}
-            row_alt_dict["row num"         ] = row_num
-            row_alt_dict["row description" ] = row_descr
-            row_alt_dict["mode alt"        ] = mode_alt
-            row_alt_dict["persnum"         ] = persnum
-            row_alt_dict["tour_purpose"    ] = tour_purpose
-            row_alt_dict["tour_id"         ] = tour_id
-            row_alt_dict["stopdest_purpose"] = stopdest_purpose
-            row_alt_dict["stop_id"         ] = stop_id
-            row_alt_dict["orig"            ] = trip_mc_od["orig"]
-            row_alt_dict["origWalkSegment" ] = trip_mc_od["origWalkSegment"]
-            row_alt_dict["dest"            ] = trip_mc_od["dest"]
-            row_alt_dict["destWalkSegment" ] = trip_mc_od["destWalkSegment"]
-            row_alt_dict["coefficient"     ] = float(match.group(full_idx+1))
-            row_alt_dict["variable"        ] = match.group(full_idx+2)
-            if row_alt_dict["variable"] == "Infinity":
-                row_alt_dict["variable"] = numpy.Infinity
-            elif row_alt_dict["variable"] == "NaN":
-                row_alt_dict["variable"] = numpy.NaN
-            else:
-                row_alt_dict["variable"] = float(row_alt_dict["variable"])
+    (lines_read, row_nums, coefficients, variables, total_utility) = read_utility_block(file_object, len(ROW_NAMES), NUM_MC_ALT)
 
-            row_alt_dicts.append(row_alt_dict)
-
-            full_idx += 4 #
-
-    # read 1 more lines that we don't care about, the dashes
-    line     = file_object.readline().strip()
-    assert("----------------------------" in line)
-    lines_read += 1
-
-    # total utility
-    line     = file_object.readline().strip()
-    match    = MC_TOTAL_UTILITY_RE.match(line)
-
-    full_idx = 3 # TOTAL_UTIL_RE_TXT
-    for mode_alt in range(1,NUM_MC_ALT+1):
-        row_alt_dict = {}
-        row_alt_dict["row num"         ] = -1
-        row_alt_dict["row description" ] = "Total Utility"
-        row_alt_dict["mode alt"        ] = mode_alt
-        row_alt_dict["persnum"         ] = persnum
-        row_alt_dict["tour_purpose"    ] = tour_purpose
-        row_alt_dict["tour_id"         ] = tour_id
-        row_alt_dict["stopdest_purpose"] = stopdest_purpose
-        row_alt_dict["stop_id"         ] = stop_id
-        row_alt_dict["orig"            ] = trip_mc_od["orig"]
-        row_alt_dict["origWalkSegment" ] = trip_mc_od["origWalkSegment"]
-        row_alt_dict["dest"            ] = trip_mc_od["dest"]
-        row_alt_dict["destWalkSegment" ] = trip_mc_od["destWalkSegment"]
-        row_alt_dict["coefficient"     ] = 1.0
-        row_alt_dict["variable"        ] = match.group(full_idx+1)
-        if row_alt_dict["variable"] == "Infinity":
-            row_alt_dict["variable"] = numpy.Infinity
-        elif row_alt_dict["variable"] == "NaN":
-            row_alt_dict["variable"] = numpy.NaN
-        else:
-            row_alt_dict["variable"] = float(row_alt_dict["variable"])
-        # print(row_alt_dict["variable"])
-
-        row_alt_dicts.append(row_alt_dict)
-
-        full_idx += 3 # go to next alt
-
-    df = pandas.DataFrame.from_records(row_alt_dicts)
+    df = utilities_to_dataframe(row_nums, ROW_NAMES, coefficients, variables, total_utility,
+                                collections.OrderedDict([("mode alt",         numpy.arange(1, NUM_MC_ALT+1)),
+                                                         ("persnum",          persnum),
+                                                         ("tour_purpose",     tour_purpose),
+                                                         ("tour_id",          tour_id),
+                                                         ("stopdest_purpose", stopdest_purpose),
+                                                         ("stop_id",          stop_id),
+                                                         ("orig",             trip_mc_od["orig"]),
+                                                         ("origWalkSegment",  trip_mc_od["origWalkSegment"]),
+                                                         ("dest",             trip_mc_od["dest"]),
+                                                         ("destWalkSegment",  trip_mc_od["destWalkSegment"])]))
 
     # to keep reasonable, drop everything with coefficient == 0
     df = df.loc[ df.coefficient != 0]
@@ -1803,13 +1759,13 @@ def read_trip_mode_choice_lines(file_object, type_str, trip_mc_od, purpose, hh,
     # print("head: \n{}".format(df.head(NUM_MC_ALT)))
     # print("tail: \n{}".format(df.tail(NUM_MC_ALT)))
 
-    return (lines_read + utils_read, df)
+    return (lines_read, df)
 
 def read_destination_choice_lines(file_object, type_str, purpose, hh, persnum, ptype, tournum, base_or_build, log_file):
     """
     Read the destination choice utilities from the file_object
-    Saves as destchoice_[type_str]_hh[hh]_pers[persnum]/[base_or_build]_dc_utilities.csv
-    Also copies log file into that directory as backup
+    Returns (lines_read, output_dir, output_filename, df) where the output is
+    destchoice_[type_str]_hh[hh]_pers[persnum]/[base_or_build]_dc_utilities.csv
     """
     output_dir      = "destchoice_{}_hh{}_pers{}".format(type_str, hh, persnum)
     output_filename = "{}_dc_utilities.csv".format(base_or_build)
@@ -1885,162 +1841,236 @@ def read_destination_choice_lines(file_object, type_str, purpose, hh, persnum, p
     # 10-Jul-2019 18:40:36, INFO, -----------------------------------------------------------------------------------------------------------------------------------------------------------
     # 10-Jul-2019 18:40:36, INFO, 1           0.00000 *   3.00000e+00       0.00000 *   3.00000e+00       0.00000 *   3.00000e+00       0.00000 *   3.00000e+00       0.00000 *   3.00000e+00
 
-    # read 5 lines that we don't care about
-    for lines_read in range(1,6):
-        line = file_object.readline().strip()
-        print("{}   {}".format(lines_read, line[:30]))
-
-    row_alt_dicts = []
-
-    # read utiltities
-    for utils_read in range(1,len(ROW_NAMES)+1):
-        line     = file_object.readline().strip()
-        match    = UTILITY_RE.match(line)
-
-        # print(match.groups())
-        # ('08-Jul-2019 18:31:21, INFO, ', '1', '           0.00000 *   3.00000e+00', '0.00000', '3.00000e+00', '3.00000e+00',
-        #                                       '       0.00000 *   3.00000e+00', '0.00000', '3.00000e+00', '3.00000e+00',
-        #                                       '       0.00000 *   3.00000e+00', '0.00000', '3.00000e+00', '3.00000e+00')
-        #  1 = date/log/type
-        #  2 = row number
-        #  3 = coefficient x variable 1
-        #  4 = coefficient 1
-        #  5 = variable 1 (numeric or NaN)
-        #  6 = variable 1 (numeric)
-        #  7 = coefficient x variable 2
-        #  8 = coefficient 2
-        #  9 = variable 2 (numeric or NaN)
-        # 10 = variable 2 (numeric)
-
-        print("{}   {}".format(utils_read, line[:30]))
-
-
-        # print(match.group(0))
-        row_num   = int(match.group(2)) # row number
-        row_descr = ROW_NAMES[row_num]
-
-        full_idx  = 3  # coefficient x variable
-        for dest_alt in range(1,NUM_DEST_ALT+1):
-            # print("row_num {} dest_alt {} full=[{}] coeff={} var={}".format(row_num, dest_alt, match.group(full_idx), match.group(full_idx+1), match.group(full_idx+2)))
-
-            row_alt_dict = {}
-            row_alt_dict["row num"        ] = row_num
-            row_alt_dict["row description"] = row_descr
-            row_alt_dict["dest alt"       ] = dest_alt
-            # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L464            row_alt_dict["dest alt"       ] = dest_alt
-            row_alt_dict["dest taz"       ] = int((dest_alt-1)/NUM_SUBZONES + 1)
-            # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L480
-            row_alt_dict["dest subzone"   ] = int(dest_alt - (row_alt_dict["dest taz"]-1)*NUM_SUBZONES - 1)
-            row_alt_dict["coefficient"    ] = float(match.group(full_idx+1))
-            row_alt_dict["variable"       ] = match.group(full_idx+2)
-            if row_alt_dict["variable"] == "Infinity":
-                row_alt_dict["variable"] = numpy.Infinity
-            elif row_alt_dict["variable"] == "NaN":
-                row_alt_dict["variable"] = numpy.NaN
-            else:
-                row_alt_dict["variable"] = float(row_alt_dict["variable"])
-
-            row_alt_dicts.append(row_alt_dict)
-
-            full_idx += 4 # go to next alt
-
     # 12-Jul-2019 18:19:15, INFO, 40         -0.04500 *   0.00000e+00      -0.04500 *   0.00000e+00      -0.04500 *           NaN      -0.04500 *           NaN      -0.04500 *   0.00000e+00
     # 12-Jul-2019 18:19:15, INFO, -----------------------------------------------------------------------------------------------------------------------------------------------------------
     # 12-Jul-2019 18:19:15, INFO, Alt Utility            -1.00624e+03                   5.85899e+00                           NaN                           NaN                   5.86802e+00
-
-    # read 1 more lines that we don't care about, the dashes
-    line     = file_object.readline().strip()
-    assert("----------------------------" in line)
-    lines_read += 1
-
-    # total utility
-    line     = file_object.readline().strip()
-    match    = TOTAL_UTILITY_RE.match(line)
-    # print(match.groups())
-    #  1 = date/log/type
-    #  2 = Alt Utility
-    #  3 = TOTAL_UTIL_RE_TXT alt1, spaces plus num or Nan
-    #  4 = number or Nan
-    #  5 = number
-    #  6 = TOTAL_UTIL_RE_TXT alt2, spaces plus num or Nan
-    #  7 = number or Nan
-    #  8 = number
-    full_idx = 3 # TOTAL_UTIL_RE_TXT
-    for dest_alt in range(1,NUM_DEST_ALT+1):
-        row_alt_dict = {}
-        row_alt_dict["row num"        ] = -1
-        row_alt_dict["row description"] = "Total Utility"
-        row_alt_dict["dest alt"       ] = dest_alt
-        # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L464            row_alt_dict["dest alt"       ] = dest_alt
-        row_alt_dict["dest taz"       ] = int((dest_alt-1)/NUM_SUBZONES + 1)
-        # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L480
-        row_alt_dict["dest subzone"   ] = int(dest_alt - (row_alt_dict["dest taz"]-1)*NUM_SUBZONES - 1)
-        row_alt_dict["coefficient"    ] = 1.0
-        row_alt_dict["variable"       ] = match.group(full_idx+1)
-        if row_alt_dict["variable"] == "Infinity":
-            row_alt_dict["variable"] = numpy.Infinity
-        elif row_alt_dict["variable"] == "NaN":
-            row_alt_dict["variable"] = numpy.NaN
-        else:
-            row_alt_dict["variable"] = float(row_alt_dict["variable"])
-
-        row_alt_dicts.append(row_alt_dict)
-
-        full_idx += 3 # go to next alt
-
-    df = pandas.DataFrame.from_records(row_alt_dicts)
+    (lines_read, row_nums, coefficients, variables, total_utility) = read_utility_block(file_object, len(ROW_NAMES), NUM_DEST_ALT)
+
+    dest_alt = numpy.arange(1, NUM_DEST_ALT+1)
+    # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L464
+    dest_taz = (dest_alt-1)//NUM_SUBZONES + 1
+    # https://github.com/BayAreaMetro/travel-model-one/blob/master/core/models/ctramp/src/java/com/pb/models/ctramp/TazDataHandler.java#L480
+    dest_subz = dest_alt - (dest_taz-1)*NUM_SUBZONES - 1
+
+    df = utilities_to_dataframe(row_nums, ROW_NAMES, coefficients, variables, total_utility,
+                                collections.OrderedDict([("dest alt",     dest_alt),
+                                                         ("dest taz",     dest_taz),
+                                                         ("dest subzone", dest_subz)]))
     print("head: \n{}".format(df.head()))
-    try:
-        os.mkdir(output_dir)
-    except:
-        pass
-    df.to_csv(os.path.join(output_dir,output_filename), index=False)
-    print("Wrote {}".format(os.path.join(output_dir,output_filename)))
 
-    # copy source log file
-    shutil.copyfile(log_file, os.path.join(output_dir, log_file))
-    print("Copied {} to {}".format(log_file, output_dir))
+    return (lines_read, output_dir, output_filename, df)
 
-    return (lines_read + utils_read, output_dir)
+def expand_log_files(log_file_args):
+    """
+    Expands the log_file arguments, each of which may be a log file, a glob (e.g. logs/event-node*-tourDCMan.log)
+    or a directory (in which case all event-node*.log files in it are used).
+    Returns sorted list of unique log files.
+    """
+    log_files = set()
+    for log_file_arg in log_file_args:
+        if os.path.isdir(log_file_arg):
+            log_files.update(glob.glob(os.path.join(log_file_arg, "event-node*.log")))
+        elif glob.has_magic(log_file_arg):
+            log_files.update(glob.glob(log_file_arg))
+        else:
+            log_files.add(log_file_arg)
+    return sorted(log_files)
 
-if __name__ == '__main__':
-    pandas.options.display.width = 1000
-    pandas.options.display.max_columns = 100
+def build_log_index(log_file):
+    """
+    Scans log_file once for "Utility Expressions for" header lines and returns a DataFrame with columns INDEX_COLS,
+    giving the byte offset at which to start reading each traced block.
+    For trip mode choice blocks, the offset is that of the orig/dest lines preceding the header, since those are needed too.
+    """
+    index_rows = []
+    offset     = 0
+    od_offset  = None # offset of the first trip mode choice orig/dest line since the last header
+    with open(log_file, 'rb') as log_fo:
+        for line in log_fo:
+            line_offset = offset
+            offset     += len(line)
+
+            # only decode header and orig/dest lines; utility lines have neither
+            if b"Utility Expressions for" not in line and b"orig" not in line and b"dest" not in line: continue
+            line = line.decode().strip()
+
+            if HEADER_TXT not in line:
+                if TRIP_MC_OD_RE.match(line) and od_offset is None: od_offset = line_offset
+                continue
+
+            match = TOUR_MC_RE.match(line)
+            if match:
+                type_str = "NonMandLocChoice" if match.group(3) and "Individual Non-Mandatory" in match.group(3) else "UsualWorkLocChoice"
+                tour_id  = int(re.search("\d+", match.group(8)).group(0)) if match.group(8) else -1
+                index_rows.append( (line_offset, "tourModeChoice_{}".format(type_str), match.group(4), int(match.group(5)), int(match.group(6)),
+                                    tour_id, int(match.group(9)), int(match.group(10))) )
+
+            match = TOUR_DC_RE.match(line)
+            if match:
+                type_str = "NonMandLocChoice" if "Non-Mandatory" in match.group(3) else "UsualWorkLocChoice"
+                index_rows.append( (line_offset, "destChoice_{}".format(type_str), match.group(4), int(match.group(5)), int(match.group(6)),
+                                    int(match.group(9)), -1, -1) )
+
+            match = TRIP_MC_RE.match(line)
+            if match:
+                index_rows.append( (line_offset if od_offset is None else od_offset, "tripModeChoice", match.group(6), int(match.group(3)), int(match.group(4)),
+                                    int(match.group(7)), -1, -1) )
+
+            od_offset = None
+
+    return pandas.DataFrame.from_records(index_rows, columns=INDEX_COLS)
+
+def read_log_index(log_file):
+    """
+    Returns the index for log_file, reading it from the sidecar [log_file].index.csv if it's newer than the log
+    and otherwise building it with build_log_index() and saving it there.
+    """
+    index_file = "{}.index.csv".format(log_file)
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(log_file):
+        index_df = pandas.read_csv(index_file)
+        print("Read {} blocks from index {}".format(len(index_df), index_file))
+        return index_df
+
+    print("Building index for {}".format(log_file))
+    index_df = build_log_index(log_file)
+    index_df.to_csv(index_file, index=False)
+    print("Wrote {} blocks to index {}".format(len(index_df), index_file))
+    return index_df
+
+class TracedUtilities(object):
+    """
+    Accumulates the traced utility blocks parsed from one log.
 
-    parser = argparse.ArgumentParser(description=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter,)
-    parser.add_argument("base_or_build",  choices=["base","build"], help="For output file name")
-    parser.add_argument("log_file",  metavar="event-node0-something.log", help="Log file to parse")
+    Blocks are kept in a list and concatenated once per output file when flushed, rather than with a
+    DataFrame.append() per block, which copies everything accumulated so far.  Once more than max_rows rows are
+    held, they're flushed and spilled to a pickle in a temporary directory so memory stays bounded;
+    the writers then read the chunks back one at a time.
+    """
 
-    args = parser.parse_args()
+    def __init__(self, max_rows):
+        self.max_rows       = max_rows
+        self.blocks         = []   # (output_dir, output_filename, keys, df) not yet flushed
+        self.block_rows     = 0
+        self.chunks         = []   # (output_dir, output_filename, keys, columns, df or spill file)
+        self.num_rows       = 0
+        self.spill_dir      = None
+        # mode choice blocks are added with output_dir None and written here, the last output dir found in the log
+        self.modechoice_dir = None
+
+    def append(self, output_dir, output_filename, keys, df):
+        """
+        Adds a block.  keys is a dict of scalars (e.g. model, hh, persnum) describing every row of df;
+        blocks for the same output file must have the same keys.
+        """
+        self.blocks.append( (output_dir, output_filename, keys, df) )
+        self.block_rows += len(df)
+        self.num_rows   += len(df)
+        if self.block_rows >= self.max_rows:
+            self.flush(spill=True)
+
+    def flush(self, spill=False):
+        """
+        Concatenates the blocks accumulated since the last flush into a chunk per output file,
+        keeping keys as arrays with a value per row.  If spill, the chunks are pickled to disk.
+        """
+        grouped_blocks = collections.OrderedDict()
+        for (output_dir, output_filename, keys, df) in self.blocks:
+            grouped_blocks.setdefault((output_dir, output_filename), []).append( (keys, df) )
+
+        for (output_dir, output_filename), key_dfs in grouped_blocks.items():
+            chunk_df   = pandas.concat([df for (keys, df) in key_dfs], sort=False)
+            num_rows   = [len(df) for (keys, df) in key_dfs]
+            chunk_keys = collections.OrderedDict()
+            for key in key_dfs[0][0].keys():
+                chunk_keys[key] = numpy.repeat([keys[key] for (keys, df) in key_dfs], num_rows)
+
+            if spill:
+                if self.spill_dir is None: self.spill_dir = tempfile.mkdtemp(prefix="parse_ctramp_logs_")
+                spill_file = os.path.join(self.spill_dir, "chunk{}.pkl".format(len(self.chunks)))
+                chunk_df.to_pickle(spill_file)
+                self.chunks.append( (output_dir, output_filename, chunk_keys, list(chunk_df.columns), spill_file) )
+            else:
+                self.chunks.append( (output_dir, output_filename, chunk_keys, list(chunk_df.columns), chunk_df) )
+
+        self.blocks     = []
+        self.block_rows = 0
+
+    def output_path(self, chunk):
+        """
+        Returns (output_dir, output_filename) for the given chunk.
+        """
+        return (self.modechoice_dir if chunk[0] is None else chunk[0], chunk[1])
+
+    def read_chunk(self, chunk):
+        """
+        Returns the DataFrame for the given chunk, reading it back if it was spilled.
+        """
+        df = chunk[4]
+        if isinstance(df, str): df = pandas.read_pickle(df)
+        return df
+
+    def cleanup(self):
+        """
+        Deletes any spilled chunks.
+        """
+        if self.spill_dir: shutil.rmtree(self.spill_dir)
+
+def _parse_log_file(args):
+    """
+    Pool worker for the main block: parse_log_file() with its arguments as a tuple.
+    """
+    return parse_log_file(*args)
 
+def parse_log_file(log_file, base_or_build, hh_list=None, purpose_list=None, max_rows=MAX_ROWS_IN_MEMORY):
+    """
+    Parses one ctramp log file for traced utilities.
 
-    line_re       = re.compile("{}(.*)$".format(DATE_LOG_TYPE_RE_TXT))
-    tour_dc_re    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TOURDC_RE_TXT))
-    tour_mc_re    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TOURMC_RE_TXT))
-    trip_mc_re    = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TRIPMC_RE_TXT))
-    trip_mc_od_re = re.compile("{}{}".format(DATE_LOG_TYPE_RE_TXT, TRIPMC_ORIGDEST_RE_TXT))
+    If hh_list or purpose_list are passed, only the blocks for those households and/or purposes are read,
+    seeking straight to them using the index from read_log_index().
 
-    print("Reading {}".format(args.log_file))
-    log_fo = open(args.log_file, 'r')
+    Returns (traced, copy_dirs) where traced is a TracedUtilities, holding at most max_rows rows in memory,
+    and copy_dirs is a list of output dirs that should get a backup copy of the log.
+    Nothing is written here so that multiple logs can be parsed in parallel and merged by write_outputs().
+    """
+    # offsets of the blocks to read, or None to read everything
+    block_offsets = None
+    if hh_list or purpose_list:
+        index_df = read_log_index(log_file)
+        if hh_list:      index_df = index_df.loc[ index_df.hh.isin(hh_list) ]
+        if purpose_list: index_df = index_df.loc[ index_df.purpose.isin(purpose_list) ]
+        block_offsets = collections.deque(sorted(index_df.offset.unique()))
+        print("Reading {} indexed blocks from {}".format(len(block_offsets), log_file))
+        if len(block_offsets) == 0: return (TracedUtilities(max_rows), [])
+
+    print("Reading {}".format(log_file))
+    log_fo = open(log_file, 'r')
+    if block_offsets is not None:
+        log_fo.seek(block_offsets.popleft())
     lines_read = 0
     output_dir = None
-    modechoice_df = pandas.DataFrame()
+    traced     = TracedUtilities(max_rows)
+    copy_dirs  = []
     trip_mc_od = {}
 
     while True:
-        line = log_fo.readline().strip()
-        # check for eof
+        line = log_fo.readline()
+        # check for eof -- blank lines are still "\n"
         if line == "": break
 
+        line = line.strip()
         lines_read += 1
 
-        match = tour_mc_re.match(line)
+        # header regexes only need to run on header lines
+        is_header = HEADER_TXT in line
+
+        match = TOUR_MC_RE.match(line) if is_header else None
         if match:
             nonm    = match.group(3)
             purpose = match.group(4)
             hh      = match.group(5)
             persnum = match.group(6)
             ptype   = match.group(7)
+            tour_id = int(re.search("\d+", match.group(8)).group(0)) if match.group(8) else -1
             destTaz = int(match.group(9))
             destSubz= int(match.group(10))
 
@@ -2052,13 +2082,18 @@ if __name__ == '__main__':
                   purpose, hh, persnum, ptype, destTaz, destSubz))
 
 
-            (new_lines_read,df) = read_tour_mode_choice_logsum_lines(log_fo, type_str, purpose, hh, persnum, ptype, destTaz, destSubz, args.base_or_build, args.log_file)
+            (new_lines_read,df) = read_tour_mode_choice_logsum_lines(log_fo, type_str, purpose, hh, persnum, ptype, destTaz, destSubz, base_or_build, log_file)
             lines_read += new_lines_read
-            modechoice_df = modechoice_df.append(df)
+            traced.append(None, "{}_modechoice_utilities.csv".format(base_or_build),
+                          collections.OrderedDict([("model","tourModeChoice_{}".format(type_str)), ("hh",int(hh)), ("persnum",int(persnum)),
+                                                   ("tour_purpose",purpose), ("tour_id",tour_id)]), df)
 
+            if block_offsets is not None:
+                if len(block_offsets) == 0: break
+                log_fo.seek(block_offsets.popleft())
             continue
 
-        match = tour_dc_re.match(line)
+        match = TOUR_DC_RE.match(line) if is_header else None
         if match:
 
             dctype  = match.group(3)
@@ -2074,12 +2109,19 @@ if __name__ == '__main__':
                 type_str = "NonMandLocChoice"
 
             # read the rest of the relevant lines
-            (new_lines_read,output_dir) = read_destination_choice_lines(log_fo, type_str, purpose, hh, persnum, ptype, tournum, args.base_or_build, args.log_file)
+            (new_lines_read,output_dir,output_filename,df) = read_destination_choice_lines(log_fo, type_str, purpose, hh, persnum, ptype, tournum, base_or_build, log_file)
             lines_read += new_lines_read
-
+            traced.append(output_dir, output_filename,
+                          collections.OrderedDict([("model","destChoice_{}".format(type_str)), ("hh",int(hh)), ("persnum",int(persnum)),
+                                                   ("tour_purpose",purpose), ("tour_id",int(tournum))]), df)
+            copy_dirs.append(output_dir)
+
+            if block_offsets is not None:
+                if len(block_offsets) == 0: break
+                log_fo.seek(block_offsets.popleft())
             continue
 
-        match = trip_mc_od_re.match(line)
+        match = TRIP_MC_OD_RE.match(line)
         if match:
         	label = match.group(3)
         	value = int(match.group(4))
@@ -2087,7 +2129,7 @@ if __name__ == '__main__':
         	trip_mc_od[label] = value
         	continue
 
-        match = trip_mc_re.match(line)
+        match = TRIP_MC_RE.match(line) if is_header else None
         if match:
             hh               = match.group(3)
             persnum          = match.group(4)
@@ -2104,24 +2146,214 @@ if __name__ == '__main__':
                   hh, persnum, ptype, tour_purpose, tour_id, stopdest_purpose, stop_id))
 
             (new_lines_read,df) = read_trip_mode_choice_lines(log_fo, type_str, trip_mc_od, tour_purpose, hh, persnum, ptype, tour_purpose,
-                                                              tour_id, stopdest_purpose, stop_id, args.base_or_build, args.log_file)
+                                                              tour_id, stopdest_purpose, stop_id, base_or_build, log_file)
             if new_lines_read > 0:
                 lines_read += new_lines_read
-                modechoice_df = modechoice_df.append(df)
+                traced.append(None, "{}_modechoice_utilities.csv".format(base_or_build),
+                              collections.OrderedDict([("model",type_str), ("hh",int(hh)), ("persnum",int(persnum)),
+                                                       ("tour_purpose",tour_purpose), ("tour_id",int(tour_id))]), df)
+
+            if block_offsets is not None:
+                if len(block_offsets) == 0: break
+                log_fo.seek(block_offsets.popleft())
             continue
 
-        match = line_re.match(line)
+        match = LINE_RE.match(line)
 
-        if lines_read <= 10:
+        if match and lines_read <= 10:
             print(match.group(2))
 
         # end for line in log file object
     log_fo.close()
 
-    print("modechoice_df length: {}".format(len(modechoice_df)))
-    if len(modechoice_df) > 0:
+    traced.flush()
+    traced.modechoice_dir = output_dir
+    print("{} traced utilities rows: {}".format(log_file, traced.num_rows))
+
+    return (traced, copy_dirs)
+
+def write_outputs(log_files, log_results):
+    """
+    Writes the results of parse_log_file() for each of the log_files as csv files, one chunk at a time.
+    Results for the same output file from different logs are written in log_files order,
+    so the output doesn't depend on which log finished parsing first.
+    Also copies each log file into its copy_dirs as backup.
+    """
+    output_chunks = collections.OrderedDict()
+    for (traced, copy_dirs) in log_results:
+        for chunk in traced.chunks:
+            output_chunks.setdefault(traced.output_path(chunk), []).append( (traced, chunk) )
+
+    for (output_dir, output_filename), chunks in output_chunks.items():
         if not os.path.exists(output_dir): os.makedirs(output_dir)
+        output_file = os.path.join(output_dir, output_filename)
+
+        # chunks may have different columns (e.g. tour and trip mode choice) so use them all, in the order found
+        columns = []
+        for (traced, chunk) in chunks:
+            columns.extend([col for col in chunk[3] if col not in columns])
+        # columns missing from some chunks are float (with NaN) regardless of how the chunks were split
+        partial_columns = [col for col in columns if any(col not in chunk[3] for (traced, chunk) in chunks)]
+
+        for chunk_num, (traced, chunk) in enumerate(chunks):
+            df = traced.read_chunk(chunk).reindex(columns=columns)
+            for col in partial_columns:
+                if pandas.api.types.is_integer_dtype(df[col]): df[col] = df[col].astype(numpy.float64)
+            df.to_csv(output_file, index=False, mode="w" if chunk_num == 0 else "a", header=(chunk_num == 0))
+        print("Wrote {}".format(output_file))
+
+    for (log_file, (traced, copy_dirs)) in zip(log_files, log_results):
+        # copy source log file
+        for output_dir in sorted(set(copy_dirs)):
+            shutil.copyfile(log_file, os.path.join(output_dir, os.path.basename(log_file)))
+            print("Copied {} to {}".format(log_file, output_dir))
+
+# columns renamed so that every model shares the same columnar layout
+COLUMNAR_RENAME = {
+    "row num"        : "expression",
+    "row description": "expression_description",
+    "dest alt"       : "alternative",
+    "mode alt"       : "alternative",
+}
+# columns that only some models have, with the value used when they don't apply,
+# so every chunk written to the columnar dataset has the same columns and types
+COLUMNAR_FILL = collections.OrderedDict([
+    ("dest_taz",          -1),
+    ("dest_subzone",      -1),
+    ("tour_purpose",      ""),
+    ("tour_id",           -1),
+    ("stopdest_purpose",  ""),
+    ("stop_id",           -1),
+    ("orig",              -1),
+    ("origWalkSegment",   -1),
+    ("dest",              -1),
+    ("destWalkSegment",   -1),
+])
+# the columnar dataset is partitioned by these
+PARTITION_COLS = ["base_or_build", "model"]
+# these are the values, the other columns identify the term
+VALUE_COLS     = ["coefficient", "variable", "utility"]
+
+def to_columnar(base_or_build, keys, df):
+    """
+    Converts one chunk from TracedUtilities into the columnar layout, with columns
+    PARTITION_COLS, hh, persnum, expression, expression_description, alternative, COLUMNAR_FILL and VALUE_COLS.
+    """
+    df = df.rename(columns=COLUMNAR_RENAME)
+    df.columns = [col.replace(" ","_") for col in df.columns]
+    # trip mode choice frames already have persnum, but as a string
+    df = df.assign(base_or_build=base_or_build, **keys)
+    for col, fill in COLUMNAR_FILL.items():
+        df[col] = df[col].fillna(fill).astype(type(fill)) if col in df.columns else fill
+    df["utility"] = numpy.where(df.coefficient == 0, 0.0, df.coefficient*df.variable)
+    return df[PARTITION_COLS + ["hh", "persnum", "expression", "expression_description", "alternative"] + list(COLUMNAR_FILL.keys()) + VALUE_COLS]
+
+def write_parquet_outputs(log_results, base_or_build, parquet_dir):
+    """
+    Writes the results of parse_log_file() for all logs into one columnar dataset, parquet_dir,
+    partitioned by base_or_build and model, one chunk at a time.  Each row is keyed by
+    (base_or_build, model, hh, persnum, tour_purpose, tour_id, [block columns like dest_taz], alternative, expression).
+
+    Existing results for base_or_build in parquet_dir are replaced; the other partition is left as is
+    so base and build can be parsed separately and then compared with diff_traced_utilities().
+    """
+    partition_dir = os.path.join(parquet_dir, "base_or_build={}".format(base_or_build))
+    if os.path.exists(partition_dir):
+        shutil.rmtree(partition_dir)
+        print("Removed previous {}".format(partition_dir))
+
+    rows_written = 0
+    for (traced, copy_dirs) in log_results:
+        for chunk in traced.chunks:
+            columnar_df = to_columnar(base_or_build, chunk[2], traced.read_chunk(chunk))
+            columnar_df.to_parquet(parquet_dir, partition_cols=PARTITION_COLS, index=False)
+            rows_written += len(columnar_df)
+
+    if rows_written == 0:
+        print("No traced utilities found; not writing {}".format(parquet_dir))
+    else:
+        print("Wrote {} rows to {}".format(rows_written, parquet_dir))
+
+def diff_traced_utilities(parquet_dir):
+    """
+    Joins the base and build traced utilities in the parquet_dir dataset written by write_parquet_outputs()
+    term by term, as a single merge.
+
+    Returns DataFrame of the terms that differ (including those only in base or build) with the key columns,
+    coefficient/variable/utility for base and build, utility_diff = build - base and
+    in_base_or_build = both, base_only or build_only.
+    """
+    traced_df = pandas.read_parquet(parquet_dir)
+    for col in PARTITION_COLS:
+        traced_df[col] = traced_df[col].astype(str)
+    key_cols = ["model"] + [col for col in traced_df.columns if col not in PARTITION_COLS + VALUE_COLS]
+
+    base_df  = traced_df.loc[traced_df.base_or_build == "base",  key_cols + VALUE_COLS]
+    build_df = traced_df.loc[traced_df.base_or_build == "build", key_cols + VALUE_COLS]
+    print("Read {} base and {} build traced utility terms from {}".format(len(base_df), len(build_df), parquet_dir))
+
+    # each term is keyed by its tour, so this fails rather than pairing up terms of different tours
+    diff_df = pandas.merge(left=base_df, right=build_df, on=key_cols, how="outer", suffixes=("_base","_build"), indicator="in_base_or_build",
+                           validate="one_to_one")
+    diff_df["in_base_or_build"] = diff_df["in_base_or_build"].astype(str).replace({"left_only":"base_only", "right_only":"build_only"})
+    diff_df["utility_diff"] = diff_df.utility_build - diff_df.utility_base
+
+    same_variable = (diff_df.variable_base == diff_df.variable_build) | (diff_df.variable_base.isnull() & diff_df.variable_build.isnull())
+    same = (diff_df.in_base_or_build == "both") & (diff_df.coefficient_base == diff_df.coefficient_build) & same_variable
+    return diff_df.loc[~same]
+
+if __name__ == '__main__':
+    pandas.options.display.width = 1000
+    pandas.options.display.max_columns = 100
+
+    parser = argparse.ArgumentParser(description=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter,)
+    parser.add_argument("base_or_build",  choices=["base","build","diff"],
+                        help="For output file name, or diff to compare the base and build results in the --parquet dataset")
+    parser.add_argument("log_file",  metavar="event-node0-something.log", nargs="*",
+                        help="Log file(s) to parse.  Globs (e.g. \"logs/event-node*-tourDCMan.log\") and directories (for all event-node*.log files in them) are accepted")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="Maximum number of log files to parse at the same time")
+    parser.add_argument("--hh", type=int, nargs="+",
+                        help="Only read blocks for these households, using (and building if needed) an index next to each log")
+    parser.add_argument("--purpose", nargs="+",
+                        help="Only read blocks for these purposes (e.g. work_low, shopping, othmaint), using the log index")
+    parser.add_argument("--max_rows_in_memory", type=int, default=MAX_ROWS_IN_MEMORY,
+                        help="Parsed rows held in memory per log before spilling them to a temporary file")
+    parser.add_argument("--parquet", metavar="trace_utilities.parquet",
+                        help="Write one partitioned parquet dataset instead of csv files and log copies per household")
+
+    args = parser.parse_args()
 
-        output_filename = "{}_modechoice_utilities.csv".format(args.base_or_build)
-        modechoice_df.to_csv(os.path.join(output_dir, output_filename), index=False)
-        print("Wrote {}".format(os.path.join(output_dir,output_filename)))
+    if args.base_or_build == "diff":
+        if not args.parquet:
+            parser.error("diff requires --parquet")
+        diff_df = diff_traced_utilities(args.parquet)
+        diff_file = "{}_diff.csv".format(os.path.splitext(args.parquet.rstrip("/\\"))[0])
+        diff_df.to_csv(diff_file, index=False)
+        print("Wrote {} differing terms to {}".format(len(diff_df), diff_file))
+        sys.exit(0)
+
+    log_files = expand_log_files(args.log_file)
+    if len(log_files) == 0:
+        print("No log files found for {}".format(args.log_file))
+        sys.exit(2)
+    print("Parsing {} log files: {}".format(len(log_files), log_files))
+
+    parse_args = [(log_file, args.base_or_build, args.hh, args.purpose, args.max_rows_in_memory) for log_file in log_files]
+    num_processes = min(args.processes, len(log_files))
+    if num_processes > 1:
+        pool = multiprocessing.Pool(processes=num_processes)
+        # map returns results in log_files order
+        log_results = pool.map(_parse_log_file, parse_args)
+        pool.close()
+        pool.join()
+    else:
+        log_results = [parse_log_file(*parse_arg) for parse_arg in parse_args]
+
+    if args.parquet:
+        write_parquet_outputs(log_results, args.base_or_build, args.parquet)
+    else:
+        write_outputs(log_files, log_results)
+
+    for (traced, copy_dirs) in log_results:
+        traced.cleanup()